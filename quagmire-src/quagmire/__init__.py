@@ -19,6 +19,7 @@ from .mesh import TriMesh as _TriMesh
 from petsc4py import PETSc as _PETSc
 from .topomesh import TopoMesh as _TopoMeshClass
 from .surfmesh import SurfMesh as _SurfaceProcessMeshClass
+from .surfmesh import LandscapeEvolution
 from . import documentation
 
 import tools
@@ -16,58 +16,194 @@ You should have received a copy of the GNU Lesser General Public License
 along with Quagmire.  If not, see <http://www.gnu.org/licenses/>.
 """
 
+import numpy as np
+
 try: range = xrange
 except: pass
 
 
+class MeshVariableArray(np.ndarray):
+    """
+    The local values of a MeshVariable. Writes through indexing or in-place
+    operators (e.g. mesh.height[nodes] = 0.0, mesh.height -= dh) mark the
+    variable as dirty. Views keep this behaviour, copies are plain arrays.
+    """
+    def __array_finalize__(self, obj):
+        variable = getattr(obj, '_variable', None)
+        if variable is not None and not np.may_share_memory(self, obj):
+            variable = None
+        self._variable = variable
+
+    def _modified(self):
+        # the variable may have been written with new values since this view was taken
+        variable = self._variable
+        if variable is not None and np.may_share_memory(self, variable._array):
+            variable._modified()
+
+    def __setitem__(self, index, val):
+        np.ndarray.__setitem__(self, index, val)
+        self._modified()
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        args = [np.asarray(a) if isinstance(a, MeshVariableArray) else a for a in inputs]
+        out = kwargs.get('out', ())
+        if out:
+            kwargs['out'] = tuple(np.asarray(a) if isinstance(a, MeshVariableArray) else a for a in out)
+
+        result = getattr(ufunc, method)(*args, **kwargs)
+
+        # ufunc.at works in place on its first argument
+        written = out if method != 'at' else inputs[:1]
+        for a in written:
+            if isinstance(a, MeshVariableArray):
+                a._modified()
+
+        if out:
+            return out[0] if len(out) == 1 else out
+        return result
+
+
 class MeshVariable(object):
     """
-    Mesh variables live on the global mesh
-    Every time its data is called a local instance is returned
+    A field on the nodes of a mesh. The local values (including the shadow nodes)
+    are held in a numpy array, PETSc local and global vectors are filled on request.
+
+    Writes to the local values mark the variable as dirty and the shadow values are
+    only exchanged (mesh.update_ghosts) the next time they are read, so a variable
+    that is read many times between writes is synchronised once. The exchange is
+    collective: a dirty variable must be read (or synchronised with sync) on every
+    processor, outside code that only some of the ranks run. Call sync after a
+    write to keep later reads local.
+
+    Writing a whole array stores a copy, so references to the previous values are
+    not changed. Writes through the array returned by data (indexing and in-place
+    operators) change the variable and mark it as dirty. Pass the array back
+    (variable.data = array) after changing it in any other way.
+
+    Parameters
+    ----------
+     name : string
+     mesh : TriMesh or PixMesh object
+
+    Usage
+    -----
+     height = MeshVariable("height", mesh)
+     height.data = values       # local write, the shadow values are stale
+     height.data                # shadow values are exchanged once
+     height[nodes] = 0.0        # partial write
+     height.data[nodes] -= 1.0  # partial write
     """
-    def __init__(self, name, dm):
-        self._dm = dm
-        name = str(name)
+    def __init__(self, name, mesh):
+        self._mesh = mesh
+        self._dm = mesh.dm
+        self.name = str(name)
 
         # mesh variable vector
-        self._gdata = dm.createGlobalVector()
-        self._ldata = dm.createLocalVector()
+        self._gdata = self._dm.createGlobalVector()
+        self._ldata = self._dm.createLocalVector()
 
-        self._gdata.setName(name)
-        self._ldata.setName(name)
+        self._gdata.setName(self.name)
+        self._ldata.setName(self.name)
+
+        self._ldata.set(0.0)
+        self._gdata.set(0.0)
+
+        self._array = self._ldata.array.copy()
+        self._view = None
+
+        self._dirty = False         # shadow values are stale
+        self._global_stale = False  # global vector is behind the local values
 
-## This is a redundancy - @property definition is nuked by the @ .getter
     @property
-    def data(self):
-        # return self._gdata
-        pass
+    def dirty(self):
+        """ True if the shadow values have not been exchanged since the last write """
+        return self._dirty
 
-    @data.getter
+    @property
     def data(self):
-        print "getter"
-        self._dm.globalToLocal(self._gdata, self._ldata)
-        return self._ldata
+        """
+        Local values with valid shadow values (writes mark the variable as dirty).
+        Reading a dirty variable exchanges the shadow values and is collective.
+        """
+        if self._dirty:
+            self.sync()
+        if self._view is None:
+            self._view = self._array.view(MeshVariableArray)
+            self._view._variable = self
+        return self._view
 
     @data.setter
     def data(self, val):
-        print "setter"
-        if type(val) is float:
-            self._ldata.set(val)
-            self._gdata.set(val)
-        else:
-            self._ldata.setArray(val)
-            self._dm.localToGlobal(self._ldata, self._gdata)
+        self.set_data(val)
 
     @data.deleter
     def data(self):
-        print "deleter"
-        self._ldata.destroy()
-        self._gdata.destroy()
+        self.destroy()
+
+    def _modified(self, consistent=False):
+        self._dirty = self._dirty or not consistent
+        self._global_stale = True
+
+    def set_data(self, val, consistent=False):
+        """
+        Write the local values (a scalar is written to every node and nothing is exchanged)
+
+        Arguments
+        ---------
+         val : float or ndarray of floats, shape (n,)
+         consistent : bool
+            the shadow values are already the same as on the processors that own them
+            (e.g. computed pointwise from synchronised fields) and are not exchanged
+        """
+        if np.isscalar(val):
+            self._array = np.full_like(self._array, val)
+            self._view = None
+            self._dirty = False
+            self._global_stale = True
+            return
+
+        val = np.asarray(val)
+        if val.shape != self._array.shape:
+            raise IndexError("Incompatible array size, should be {}".format(self._array.size))
+
+        # the variable's own values changed in place (e.g. mesh.height passed back to the mesh)
+        if np.may_share_memory(val, self._array):
+            self._modified(consistent)
+            return
+
+        self._array = np.array(val, dtype=np.float64)
+        self._view = None
+        self._dirty = not consistent
+        self._global_stale = True
+
+    def __getitem__(self, index):
+        return self.data[index]
+
+    def __setitem__(self, index, val):
+        self._array[index] = val
+        self._modified()
+
+    def sync(self):
+        """ Exchange the shadow values (in place) """
+        self._mesh.update_ghosts(self._array)
+        self._dirty = False
+
+    def getLocal(self):
+        """ Local vector with valid shadow values """
+        self._ldata.setArray(self.data)
+        return self._ldata
 
     def getGlobal(self):
-        print "global"
+        """ Global vector (updated from the local values if they have changed) """
+        if self._global_stale:
+            self._dm.localToGlobal(self.getLocal(), self._gdata)
+            self._global_stale = False
         return self._gdata
 
-    def getLocal(self):
-        print "local"
-        return self.data
+    def save(self, file):
+        """ Save the variable to an HDF5 file (see mesh.save_field_to_hdf5) """
+        self._mesh.save_field_to_hdf5(file, **{self.name: np.asarray(self.data)})
+
+    def destroy(self):
+        self._ldata.destroy()
+        self._gdata.destroy()
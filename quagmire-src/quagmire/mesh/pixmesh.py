@@ -48,8 +48,20 @@ class PixMesh(object):
         self.lvec = dm.createLocalVector()
         self.sizes = self.gvec.getSizes(), self.gvec.getSizes()
 
-        lgmap_r = dm.getLGMap()
-        l2g = lgmap_r.indices.copy()
+        self.rank = self.dm.comm.rank
+
+        # the LGMap of a DMDA maps the ghost nodes to their global index instead of -(index+1)
+        (xs, ys), (xm, ym) = dm.getCorners()
+        (gxs, gys), (gxm, gym) = dm.getGhostCorners()
+        i, j = np.meshgrid(np.arange(gxs, gxs+gxm), np.arange(gys, gys+gym))
+        ghost = np.logical_or(np.logical_or(i < xs, i >= xs+xm), np.logical_or(j < ys, j >= ys+ym)).ravel()
+
+        l2g = dm.getLGMap().indices.copy()
+        ghost = np.logical_and(ghost, l2g >= 0)
+        l2g[ghost] = -(l2g[ghost] + 1)
+        lgmap_r = PETSc.LGMap().create(l2g, comm=comm)
+
+        l2g = l2g.copy()
         offproc = l2g < 0
 
         l2g[offproc] = -(l2g[offproc] + 1)
@@ -148,11 +160,15 @@ class PixMesh(object):
 
 
     def derivative_grad(self, PHI):
+        """
+        Derivatives of PHI, shape (n,) or a block of fields (n,k)
+        """
+        PHI = np.asarray(PHI)
 
-        u = PHI.reshape(self.ny, self.nx)
-        u_x, u_y = np.gradient(u, self.dx, self.dy)
+        u = PHI.reshape((self.ny, self.nx) + PHI.shape[1:])
+        u_x, u_y = np.gradient(u, self.dx, self.dy, axis=(0,1))
 
-        return u_x.ravel(), u_y.ravel()
+        return u_x.reshape(PHI.shape), u_y.reshape(PHI.shape)
 
 
     def derivative_div(self, PHIx, PHIy):
@@ -223,6 +239,31 @@ class PixMesh(object):
         self.neighbour_array = np.array(closed_neighbours)
 
 
+    def calculate_laplacian_weights(self):
+        """
+        Weights of the 5-point Laplacian stencil (flux across each cell face
+        divided by the node spacing) in the CSR layout of the neighbour arrays
+
+        Returns
+        -------
+         indptr, indices, weights : CSR arrays (stored in self.laplacian_weights)
+        """
+
+        indptr, indices = self.vertex_neighbour_vertices
+        rows = np.repeat(np.arange(0, self.npoints), np.diff(indptr))
+
+        dx = np.abs(self.coords[indices,0] - self.coords[rows,0])
+        dy = np.abs(self.coords[indices,1] - self.coords[rows,1])
+
+        weights = np.zeros(indices.size)
+        weights[dx > 0.5*self.dx] = self.dy / self.dx
+        weights[dy > 0.5*self.dy] = self.dx / self.dy
+
+        self.laplacian_weights = indptr, indices, weights
+
+        return self.laplacian_weights
+
+
     def sort_nodes_by_field2(self, field):
         """
         Generate an array of the two lowest nodes and a highest node
@@ -304,6 +345,15 @@ class PixMesh(object):
 
 
     def local_area_smoothing(self, data, its=1, centre_weight=0.75):
+        """
+        Smoothing that retains a fraction (centre_weight) of each node and takes the remainder
+        from the local smoothing matrix. data is a field, shape (n,), or a block of fields (n,k),
+        smoothed one field at a time (the DMDA has one DoF per node).
+        """
+
+        if np.ndim(data) > 1:
+            return np.column_stack([self.local_area_smoothing(data[:,i], its, centre_weight)
+                                    for i in range(0, data.shape[1])])
 
         self.lvec.setArray(data)
         self.dm.localToGlobal(self.lvec, self.gvec)
@@ -315,7 +365,7 @@ class PixMesh(object):
 
         self.dm.globalToLocal(smooth_data, self.lvec)
 
-        return self.lvec.array
+        return self.lvec.array.copy()
 
 
     def get_boundary(self):
@@ -355,14 +405,75 @@ class PixMesh(object):
 
         return self.zvec.array.copy()
 
+    def update_ghosts(self, vector):
+        """
+        Replace the shadow values of vector with the values of the processors that own them,
+        in place and in a single exchange (DMDA localToLocal).
+        A block of k fields, shape (n,k), is exchanged at once through a DMDA with k DoF per node.
+        """
+        self.sync_begin(vector)
+        return self.sync_end(vector)
+
+    def _block_scatter(self, k):
+        """
+        Local vector and local-to-local scatter of the DMDA with k DoF per node.
+        The companion DMDA has the layout of self.dm (ownership ranges and stencil)
+        and is created once for each k.
+        """
+        if not hasattr(self, '_block_scatters'):
+            self._block_scatters = dict()
+
+        if k not in self._block_scatters:
+            dm = self.dm if k == 1 else self.dm.duplicate(dof=k)
+            gtol, ltol = dm.getScatter()
+            self._block_scatters[k] = dm, dm.createLocalVector(), ltol
+
+        dm, lvec, ltol = self._block_scatters[k]
+        return lvec, ltol
+
+    def sync_begin(self, vector):
+        """
+        Start to replace the shadow values of vector (in place) with the values of the
+        processors that own them. The owned values must not change until sync_end.
+        A vector that is not a contiguous array of PETSc.ScalarType is exchanged
+        through a copy that sync_end writes back. The k fields of a block, shape (n,k),
+        are interleaved node by node which is the layout of the DMDA with k DoF.
+        """
+        k = vector.shape[1] if vector.ndim > 1 else 1
+        self._sync_lvec, self._ltol = self._block_scatter(k)
+
+        self._sync_buffer = np.ascontiguousarray(vector, dtype=PETSc.ScalarType)
+        self._sync_lvec.placeArray(self._sync_buffer.reshape(-1))
+        self._ltol.begin(self._sync_lvec, self._sync_lvec,
+                         PETSc.InsertMode.INSERT_VALUES, PETSc.ScatterMode.FORWARD)
+
+    def sync_end(self, vector):
+        """
+        Complete the exchange started by sync_begin
+        """
+        self._ltol.end(self._sync_lvec, self._sync_lvec,
+                       PETSc.InsertMode.INSERT_VALUES, PETSc.ScatterMode.FORWARD)
+        self._sync_lvec.resetArray()
+
+        if self._sync_buffer is not vector:
+            vector[...] = self._sync_buffer
+        self._sync_buffer = None
+
+        return vector
+
     def sync(self, vector):
         """
         Synchronise the local domain with the global domain
         """
-        self.lvec.setArray(vector)
-        self.dm.localToGlobal(self.lvec, self.gvec)
-        self.dm.globalToLocal(self.gvec, self.lvec)
-        return self.lvec.array.copy()
+        vector = np.array(vector, dtype=PETSc.ScalarType)
+        return self.update_ghosts(vector)
+
+    def sync_fields(self, *fields):
+        """
+        Synchronise several fields, shape (n,)
+        """
+        block = self.update_ghosts(np.column_stack(fields).astype(PETSc.ScalarType))
+        return [block[:,i].copy() for i in range(0, block.shape[1])]
 
     def _construct_rbf_weights(self, delta=None):
 
@@ -382,9 +493,17 @@ class PixMesh(object):
         return
 
     def rbf_smoother(self, field):
+        """
+        Smoothing using a radial-basis function smoothing kernel
+        of a field, shape (n,), or a block of fields (n,k)
+        """
 
         # Should do some error checking here to ensure the field and point cloud are compatible
 
-        smoothfield = (field[self.neighbour_cloud[:,:]] * self.gaussian_dist_w[:,:]).sum(axis=1)
+        weights = self.gaussian_dist_w
+        if np.ndim(field) > 1:
+            weights = weights[:,:,np.newaxis]
+
+        smoothfield = (field[self.neighbour_cloud[:,:]] * weights).sum(axis=1)
 
         return smoothfield
@@ -27,11 +27,29 @@ from time import clock
 try: range = xrange
 except: pass
 
+# MPI datatypes of the arrays exchanged with update_ghosts
+_mpi_datatypes = {np.dtype(np.float64): MPI.DOUBLE,
+                  np.dtype(np.float32): MPI.FLOAT,
+                  np.dtype(np.int64):   MPI.INT64_T,
+                  np.dtype(np.int32):   MPI.INT32_T}
+
+
+def _coordinate_noise(coords):
+    """
+    Pseudo-random numbers in [0, 1) for each coordinate that are a function
+    of the coordinates of the point (and not of the order of the points)
+    """
+    x, y = coords[:,0], coords[:,1]
+    noise = np.column_stack([np.sin(12.9898*x + 78.233*y), np.sin(39.3468*x + 11.135*y)]) * 43758.5453
+    return noise - np.floor(noise)
+
 
 class TriMesh(object):
     """
     Creating a global vector from a distributed DM removes duplicate entries (shadow zones)
     We recommend having 1) triangle or 2) scipy installed for Delaunay triangulations.
+    The overlap the DM was distributed with can be given as a keyword argument (overlap),
+    otherwise it is read from the DM.
     """
     def __init__(self, dm, verbose=True,  *args, **kwargs):
         import stripy
@@ -43,8 +61,16 @@ class TriMesh(object):
         self.log.begin()
 
         self.verbose = verbose
+        self._init_args = args, dict(kwargs, verbose=verbose)
 
         self.dm = dm
+
+        # overlap the DM was distributed with (rebalance distributes it again with the same overlap).
+        # petsc4py without DMPlex.getOverlap assumes the default overlap of the meshtools functions
+        overlap = kwargs.get('overlap', None)
+        if overlap is None:
+            overlap = dm.getOverlap() if hasattr(dm, "getOverlap") else 1
+        self.dm_overlap = overlap
         self.gvec = dm.createGlobalVector()
         self.lvec = dm.createLocalVector()
         self.sect = dm.getDefaultSection()
@@ -52,8 +78,16 @@ class TriMesh(object):
 
         self.rank = self.dm.comm.rank
 
-        lgmap_r = dm.getLGMap()
-        l2g = lgmap_r.indices.copy()
+        from ..tools.meshtools import _owned_points
+
+        # PETSc >= 3.8 maps the shadow vertices to their global index instead of -(index+1)
+        pStart, pEnd = dm.getDepthStratum(0)
+        l2g = dm.getLGMap().indices.copy()
+        shadow = np.logical_and(~_owned_points(dm, pStart, pEnd), l2g >= 0)
+        l2g[shadow] = -(l2g[shadow] + 1)
+        lgmap_r = PETSc.LGMap().create(l2g, comm=comm)
+
+        l2g = l2g.copy()
         offproc = l2g < 0
 
         l2g[offproc] = -(l2g[offproc] + 1)
@@ -64,12 +98,16 @@ class TriMesh(object):
 
         # Delaunay triangulation
         t = clock()
-        coords = dm.getCoordinatesLocal().array.reshape(-1,2)
+        coords = dm.getCoordinatesLocal().array.reshape(-1,2).copy()
 
-        minX, minY = coords.min(axis=0)
-        maxX, maxY = coords.max(axis=0)
-        length_scale = np.sqrt((maxX - minX)*(maxY - minY)/coords.shape[0])
-        coords += np.random.random(coords.shape) * 0.0001 * length_scale # This should be aware of the point spacing (small perturbation)
+        # small perturbation of the coordinates (aware of the point spacing) that only depends
+        # on the coordinates, so a DM is triangulated the same way every time it is loaded
+        bounds = np.hstack([-coords.min(axis=0), coords.max(axis=0)])
+        comm.Allreduce(MPI.IN_PLACE, bounds, op=MPI.MAX)
+        minX, minY = -bounds[:2]
+        maxX, maxY = bounds[2:]
+        length_scale = np.sqrt((maxX - minX)*(maxY - minY)/self.gvec.getSize())
+        coords += _coordinate_noise(coords) * 0.0001 * length_scale
 
         self.tri = stripy.Triangulation(coords[:,0], coords[:,1], permute=True)
         self.npoints = self.tri.npoints
@@ -77,6 +115,8 @@ class TriMesh(object):
         if self.rank==0 and self.verbose:
             print("{} - Delaunay triangulation {}s".format(self.dm.comm.rank, clock()-t))
 
+        self._construct_ghost_sf()
+
         # Calculate weigths and pointwise area
         t = clock()
         self.calculate_area_weights()
@@ -110,6 +150,15 @@ class TriMesh(object):
             print("{} - Construct neighbour cloud array {}s".format(self.dm.comm.rank, clock()-t))
 
 
+        # Depth of the shadow zone
+        t = clock()
+        self.construct_halo()
+        self.timings['construct halo'] = [clock()-t, self.log.getCPUTime(), self.log.getFlops()]
+        if self.rank==0 and self.verbose:
+            print("{} - Construct halo (depth {}, sync every {} iterations) {}s".format(self.dm.comm.rank,
+                  self.halo_depth, self.sync_interval, clock()-t))
+
+
         # sync smoothing operator
         t = clock()
         self._construct_rbf_weights()
@@ -122,6 +171,10 @@ class TriMesh(object):
         self.root = False
         self.coords = self.tri.points
 
+        # stages that are not repeated during a run
+        self._setup_stages = set(self.timings.keys())
+        self._setup_stages.add('rebalance')
+
 
     def get_local_mesh(self):
         """
@@ -171,17 +224,10 @@ class TriMesh(object):
         """
         Marks local indices in the DM with a label
         """
-        pStart, pEnd = self.dm.getDepthStratum(0)
-        indices += pStart
+        from ..tools.meshtools import label_DMPlex_points
 
-        labels = []
-        for i in range(self.dm.getNumLabels()):
-            labels.append(self.dm.getLabelName(i))
-
-        if label not in labels:
-            self.dm.createLabel(label)
-        for ind in indices:
-            self.dm.setLabelValue(label, ind, 1)
+        pStart, pEnd = self.dm.getDepthStratum(0)
+        label_DMPlex_points(self.dm, label, np.asarray(indices) + pStart)
 
 
     def calculate_area_weights(self):
@@ -211,8 +257,8 @@ class TriMesh(object):
 
         Arguments
         ---------
-         PHI : ndarray of floats, shape (n,)
-            compute the derivative of this array
+         PHI : ndarray of floats, shape (n,) or (n,k)
+            compute the derivative of this array (or of each field in a block)
          nit : int optional (default: 10)
             number of iterations to reach convergence
          tol : float optional (default: 1e-8)
@@ -220,12 +266,22 @@ class TriMesh(object):
 
         Returns
         -------
-         PHIx : ndarray of floats, shape(n,)
+         PHIx : ndarray of floats, shape(n,) or (n,k)
             first partial derivative of PHI in x direction
-         PHIy : ndarray of floats, shape(n,)
+         PHIy : ndarray of floats, shape(n,) or (n,k)
             first partial derivative of PHI in y direction
         """
-        return self.tri.gradient(PHI, nit, tol)
+        PHI = np.asarray(PHI)
+
+        if PHI.ndim == 1:
+            return self.tri.gradient(PHI, nit, tol)
+
+        PHIx = np.empty_like(PHI, dtype=np.float64)
+        PHIy = np.empty_like(PHI, dtype=np.float64)
+        for i in range(0, PHI.shape[1]):
+            PHIx[:,i], PHIy[:,i] = self.tri.gradient(np.ascontiguousarray(PHI[:,i]), nit, tol)
+
+        return PHIx, PHIy
 
 
     def derivative_div(self, PHIx, PHIy, **kwargs):
@@ -315,6 +371,48 @@ class TriMesh(object):
         self.neighbour_array = np.array(closed_neighbours)
 
 
+    def calculate_laplacian_weights(self):
+        """
+        Finite volume weights of the Laplacian on the dual (Voronoi) mesh.
+
+        The flux between neighbouring nodes i, j is w_ij (phi_j - phi_i) where w_ij is the length
+        of the dual edge divided by the length of the edge, 0.5 (cot a + cot b) for the angles opposite
+        the edge. Negative weights (from obtuse triangles on the boundary) are set to zero.
+
+        Returns
+        -------
+         indptr, indices, weights : CSR arrays (stored in self.laplacian_weights)
+        """
+        from scipy.sparse import coo_matrix
+
+        points = self.tri.points
+        simplices = self.tri.simplices
+
+        rows = []
+        cols = []
+        vals = []
+
+        for k in range(0, 3):
+            a = simplices[:,k]
+            b = simplices[:,(k+1)%3]
+            c = simplices[:,(k+2)%3]
+            u = points[b] - points[a]
+            v = points[c] - points[a]
+            cot = (u[:,0]*v[:,0] + u[:,1]*v[:,1]) / np.abs(u[:,0]*v[:,1] - u[:,1]*v[:,0])
+
+            rows.extend([b, c])
+            cols.extend([c, b])
+            vals.extend([0.5*cot, 0.5*cot])
+
+        L = coo_matrix((np.hstack(vals), (np.hstack(rows), np.hstack(cols))), shape=(self.npoints, self.npoints)).tocsr()
+        L.sum_duplicates()
+        L.sort_indices()
+
+        self.laplacian_weights = L.indptr, L.indices, np.maximum(L.data, 0.0)
+
+        return self.laplacian_weights
+
+
     def construct_extended_neighbour_cloud(self):
         """
         Find extended node neighbours
@@ -393,6 +491,85 @@ class TriMesh(object):
         return
 
 
+    def construct_halo(self, max_interval=64):
+        """
+        Measure the depth of the shadow zone and how many iterations of an operator
+        on the neighbour cloud can run locally before the shadow nodes must be synchronised.
+
+        ghost_depth is the number of rings of edges between a node and the nodes owned
+        by this processor (0 for owned nodes) and halo_depth is the deepest ring on any
+        processor (this is measured and is not the overlap of the DM). The neighbour cloud of a node is complete if it
+        is closer to the node than any node in the outermost ring of the shadow zone (beyond
+        which there may be points on other processors). After a sync every node is correct and
+        an iteration keeps a node correct if its cloud is complete and every node in the cloud
+        was correct. sync_interval is the number of iterations after which all owned nodes are
+        still correct on every processor (0 if the shadow zone is too shallow for the cloud,
+        in which case the overlap of the DM should be increased).
+
+        Arguments
+        ---------
+         max_interval : int, largest sync interval (when there is no shadow zone)
+        """
+        from scipy.sparse import coo_matrix
+        from quagmire.tools import meshtools
+
+        owned = self.lgmap_row.indices >= 0
+
+        cells = meshtools.get_DMPlex_cells(self.dm)
+        row = np.hstack([cells[:,0], cells[:,1], cells[:,2]])
+        col = np.hstack([cells[:,1], cells[:,2], cells[:,0]])
+        adjacency = coo_matrix((np.ones(row.size), (row, col)), shape=(self.npoints, self.npoints)).tocsr()
+        adjacency = adjacency + adjacency.T
+
+        # breadth first search from the owned nodes
+        ghost_depth = np.empty(self.npoints, dtype=int)
+        ghost_depth.fill(self.npoints)
+        ghost_depth[owned] = 0
+
+        front = owned.astype(np.float64)
+        depth = 0
+        while front.any():
+            depth += 1
+            front = np.logical_and(adjacency.dot(front) > 0, ghost_depth > depth)
+            ghost_depth[front] = depth
+            front = front.astype(np.float64)
+
+        self.ghost_depth = ghost_depth
+        # (a processor may have no points)
+        reached = ghost_depth[ghost_depth < self.npoints]
+        self.halo_depth = comm.allreduce(int(reached.max()) if reached.size else 0, op=MPI.MAX)
+
+        # neighbour clouds that may be missing points on other processors
+        outer = np.logical_and(ghost_depth > 0, ghost_depth >= self.halo_depth)
+        if outer.any():
+            from scipy.spatial import cKDTree as _cKDTree
+            distance, nearest = _cKDTree(self.tri.points[outer]).query(self.tri.points)
+            complete = self.neighbour_cloud_distances[:,-1] < distance
+        else:
+            complete = np.ones(self.npoints, dtype=bool)
+
+        correct = np.ones(self.npoints, dtype=bool)
+        interval = 0
+        while interval < max_interval:
+            correct_next = np.logical_and(complete, correct[self.neighbour_cloud].all(axis=1))
+            if not correct_next[owned].all():
+                break
+            interval += 1
+            if np.array_equal(correct_next, correct):
+                interval = max_interval
+                break
+            correct = correct_next
+
+        self.sync_interval = comm.allreduce(interval, op=MPI.MIN)
+
+        # owned nodes that can be updated without the shadow nodes (while they are exchanged)
+        interior = np.logical_and(owned, (ghost_depth[self.neighbour_cloud] == 0).all(axis=1))
+        self.interior_nodes = np.nonzero(interior)[0]
+        self.exterior_nodes = np.nonzero(~interior)[0]
+
+        return
+
+
     def _build_smoothing_matrix(self):
 
         indptr, indices = self.vertex_neighbour_vertices
@@ -426,17 +603,15 @@ class TriMesh(object):
 
 
     def local_area_smoothing(self, data, its=1, centre_weight=0.75):
+        """
+        Smoothing that retains a fraction (centre_weight) of each node and takes the remainder
+        from the rbf_smoother. The shadow nodes are synchronised every sync_interval iterations.
+        """
 
-        smooth_data = data.copy()
-        smooth_data_old = data.copy()
-
-        for i in range(0, its):
-            smooth_data_old[:] = smooth_data
-            smooth_data = centre_weight*smooth_data_old + \
-                          (1.0 - centre_weight)*self.rbf_smoother(smooth_data)
-            smooth_data[:] = self.sync(smooth_data)
+        def smooth(vector, nodes, out):
+            out[nodes] = centre_weight*vector[nodes] + (1.0 - centre_weight)*self._cloud_average(vector, nodes)
 
-        return smooth_data
+        return self._iterate_with_sync(smooth, data, its)
 
 
     def local_area_smoothing_old(self, data, its=1, centre_weight=0.75):
@@ -468,10 +643,11 @@ class TriMesh(object):
             boundary_indices = self.get_label(marker)
 
         except ValueError:
+            from ..tools.meshtools import label_DMPlex_points
+
             self.dm.markBoundaryFaces(marker) # marks line segments
             boundary_indices = self.tri.convex_hull()
-            for ind in boundary_indices:
-                self.dm.setLabelValue(marker, ind + pStart, 1)
+            label_DMPlex_points(self.dm, marker, boundary_indices + pStart)
 
 
         bmask[boundary_indices] = False
@@ -594,19 +770,287 @@ class TriMesh(object):
 
         return zvec.array.copy()
 
+    def _construct_ghost_sf(self):
+        """
+        Star forest from the owned nodes on each processor (roots) to the shadow nodes
+        of its neighbours (leaves) in the local ordering of the nodes. It is built from
+        the vertices in the point SF of the DM.
+        """
+        owned = self.lgmap_row.indices >= 0
+
+        self._owned_nodes = np.nonzero(owned)[0]
+        self._ghost_nodes = np.nonzero(~owned)[0]
+
+        pStart, pEnd = self.dm.getDepthStratum(0)
+        vertex_start = np.array(comm.allgather(pStart))
+
+        # the point SF of a DM that is not distributed has no graph
+        if comm.size > 1:
+            nroots, ilocal, iremote = self.dm.getPointSF().getGraph()
+            iremote = np.asarray(iremote).reshape(-1,2)
+            if ilocal is None or len(ilocal) == 0:
+                ilocal = np.arange(0, iremote.shape[0])
+        else:
+            ilocal, iremote = np.zeros(0, dtype=int), np.zeros((0,2), dtype=int)
+
+        vertex = np.logical_and(ilocal >= pStart, ilocal < pEnd)
+        leaves = np.asarray(ilocal)[vertex] - pStart
+        remote = iremote[vertex].copy()
+        remote[:,1] -= vertex_start[remote[:,0]]
+
+        sf = PETSc.SF().create(comm=comm)
+        sf.setGraph(self.npoints, leaves.astype(PETSc.IntType), remote.ravel().astype(PETSc.IntType))
+        sf.setUp()
+
+        self._ghost_sf = sf
+        self._ghost_sf_units = dict()
+
+
+    def _ghost_sf_unit(self, vector):
+        """
+        MPI datatype of the values of one node, a row of k values for a block of fields (n,k)
+        """
+        if vector.shape[0] != self.npoints:
+            raise IndexError("Incompatible array size, should be {}".format(self.npoints))
+
+        if vector.dtype not in _mpi_datatypes:
+            raise TypeError("Cannot exchange arrays of type {}".format(vector.dtype))
+
+        basetype = _mpi_datatypes[vector.dtype]
+        k = int(np.prod(vector.shape[1:]))
+
+        if k == 1:
+            return basetype
+
+        key = vector.dtype.char, k
+        if key not in self._ghost_sf_units:
+            self._ghost_sf_units[key] = basetype.Create_contiguous(k).Commit()
+
+        return self._ghost_sf_units[key]
+
+
+    def update_ghosts(self, vector):
+        """
+        Replace the shadow values of vector with the values of the processors that own them,
+        in place and in a single exchange (the owned values are sent straight to the shadow
+        nodes instead of a localToGlobal followed by globalToLocal, which moves every owned value
+        twice and copies the array).
+
+        A block of fields, shape (n,k), is exchanged in one message per neighbouring processor.
+
+        Arguments
+        ---------
+         vector : contiguous ndarray, shape (n,) or (n,k)
+
+        Returns
+        -------
+         vector : the same array with synchronised shadow values
+        """
+        self.sync_begin(vector)
+        return self.sync_end(vector)
+
+
+    def sync_begin(self, vector):
+        """
+        Start to replace the shadow values of vector (in place) with the values of the processors
+        that own them. Work that does not read the shadow nodes (e.g. on the interior_nodes)
+        can be done before sync_end completes the exchange.
+        The owned values of vector must not change until sync_end.
+        """
+        if not vector.flags['C_CONTIGUOUS']:
+            raise ValueError("vector must be a contiguous array")
+
+        self._ghost_sf.bcastBegin(self._ghost_sf_unit(vector), vector, vector)
+
+
+    def sync_end(self, vector):
+        """
+        Complete the exchange started by sync_begin
+
+        Returns
+        -------
+         vector : the same array with synchronised shadow values
+        """
+        self._ghost_sf.bcastEnd(self._ghost_sf_unit(vector), vector, vector)
+
+        return vector
+
+
     def sync(self, vector):
         """
         Synchronise the local domain with the global domain
         Replaces shadow values in the local domain (non additive)
+        and returns a copy (see update_ghosts to update vector in place)
         """
 
-        self.lvec.setArray(vector)
+        vector = np.array(vector, dtype=PETSc.ScalarType)
 
-        # self.dm.localToLocal(self.lvec, self.gvec)
-        self.dm.localToGlobal(self.lvec, self.gvec)
-        self.dm.globalToLocal(self.gvec, self.lvec)
+        return self.update_ghosts(vector)
 
-        return self.lvec.array.copy()
+
+    def sync_fields(self, *fields):
+        """
+        Synchronise several fields, shape (n,), in a single exchange
+
+        Returns
+        -------
+         fields : list of synchronised copies of the fields
+        """
+        block = self.update_ghosts(np.column_stack(fields).astype(PETSc.ScalarType))
+
+        return [block[:,i].copy() for i in range(0, block.shape[1])]
+
+
+    def load_imbalance(self, stages=None):
+        """
+        Ratio of the maximum to the mean time that processors spent in stages
+        recorded in the timings dict (the last call of each stage)
+
+        Arguments
+        ---------
+         stages : list of keys in the timings dict
+            (default: all stages except those of the mesh construction)
+
+        Returns
+        -------
+         imbalance : float
+         times : ndarray of floats, shape (nprocs,)
+            time spent by each processor
+        """
+        if stages is None:
+            stages = [key for key in self.timings if key not in self._setup_stages]
+
+        local_time = sum([self.timings[key][0] for key in stages if key in self.timings])
+        times = np.array(comm.allgather(local_time), dtype=np.float64)
+
+        if times.mean() <= 0.0:
+            return 1.0, times
+
+        return times.max() / times.mean(), times
+
+
+    def rebalance(self, fields=None, threshold=1.25, stages=None, node_weights=None, force=False):
+        """
+        Redistribute the mesh when the work is out of balance between processors.
+
+        If load_imbalance exceeds the threshold, the distributed DM is partitioned again in place.
+        Each cell is weighted by the time that its processor spent per node, the cells are cut
+        into blocks of equal weight along a space-filling curve (meshtools.partition_distributed_cells)
+        and the DM is distributed with that (shell) partition. The fields are moved with the
+        star forest returned by the distribution and the mesh is initialised again on the new
+        partition. The height (TopoMesh) is migrated with the mesh.
+
+        Arguments
+        ---------
+         fields : dict of ndarrays of floats, shape (n,)
+            fields to migrate to the new partition
+         threshold : float, ratio of the maximum to mean time
+         stages : list of keys in the timings dict (see load_imbalance)
+         node_weights : ndarray of floats, shape (n,)
+            (optional) expected work at each node, multiplies the measured weight
+         force : bool, rebalance regardless of the threshold
+
+        Returns
+        -------
+         fields : dict of ndarrays of floats, shape (n,)
+            local values of the fields on the new partition,
+            or None if the mesh is not rebalanced
+
+        Notes
+        -----
+         No processor holds more than its own part of the mesh. The labels of the DM
+         ("boundary" and "coarse") are migrated with it, and every processor then
+         triangulates its new partition again. Only meshes built from a DMPlex can be
+         rebalanced.
+        """
+        from quagmire.tools import meshtools
+
+        if fields is None:
+            fields = dict()
+
+        imbalance, times = self.load_imbalance(stages)
+
+        if comm.size == 1 or (imbalance < threshold and not force):
+            return None
+
+        t = clock()
+
+        owned = self.lgmap_row.indices >= 0
+
+        # the cost of a node is the time this processor spent per node
+        weights = np.ones(self.npoints)
+        if times.sum() > 0.0:
+            weights *= times[self.rank] / max(owned.sum(), 1)
+        if node_weights is not None:
+            weights *= node_weights
+
+        # weight and centroid of the cells (the cells in the overlap are counted by their owner)
+
+        cStart, cEnd = self.dm.getHeightStratum(0)
+        cells = meshtools.get_DMPlex_cells(self.dm)
+        owned_cells = meshtools._owned_points(self.dm, cStart, cEnd)
+
+        coords = self.dm.getCoordinatesLocal().array.reshape(-1,2)
+        cx = coords[cells,0].mean(axis=1)
+        cy = coords[cells,1].mean(axis=1)
+        cell_weights = np.where(owned_cells, weights[cells].mean(axis=1), 0.0)
+
+        cell_part = meshtools.partition_distributed_cells(cx, cy, cell_weights, comm.size)
+        meshtools._set_distributed_shell_partition(self.dm, cell_part)
+
+        # local vectors of the fields on the current partition
+
+        sect = self.dm.getDefaultSection()
+        field_vecs = dict()
+        for key in fields:
+            field_vecs[key] = self.dm.createLocalVector()
+            field_vecs[key].setArray(fields[key])
+
+        height = getattr(self, 'height', None)
+        if height is not None:
+            field_vecs['_height'] = self.dm.createLocalVector()
+            field_vecs['_height'].setArray(height)
+
+        origVec = self.dm.createLocalVector()
+
+        # the DM is distributed in place, the star forest moves the fields with their vertices.
+        # The overlap is added afterwards: the star forest that DMPlexDistribute returns for the
+        # migration and overlap of a distributed DM together does not map the vertices correctly.
+
+        sfs = [self.dm.distribute(overlap=0)]
+        if self.dm_overlap:
+            sfs.append(self.dm.distributeOverlap(self.dm_overlap))
+
+        field_vecs['_orig'] = origVec
+        for sf in sfs:
+            for key in field_vecs:
+                fieldSect, fieldVec = self.dm.distributeField(sf, sect, field_vecs[key])
+                field_vecs[key].destroy()
+                field_vecs[key] = fieldVec
+            sect = fieldSect
+            sf.destroy()
+
+        self.dm.setDefaultSection(sect)
+        field_vecs.pop('_orig').destroy()
+
+        local_fields = dict()
+        for key in field_vecs:
+            local_fields[key] = field_vecs[key].array.copy()
+            field_vecs[key].destroy()
+
+        height = local_fields.pop('_height', None)
+
+        args, kwargs = self._init_args
+        type(self).__init__(self, self.dm, *args, **kwargs)
+
+        if height is not None:
+            self.update_height(height)
+
+        self.timings['rebalance'] = [clock()-t, self.log.getCPUTime(), self.log.getFlops()]
+        if self.rank==0 and self.verbose:
+            print("Rebalance mesh (imbalance {:.2f}) {}s".format(imbalance, clock()-t))
+
+        return local_fields
 
 
     def _construct_rbf_weights(self, delta=None):
@@ -643,7 +1087,7 @@ class TriMesh(object):
 
         Arguments
         ---------
-         vector     : field vector shape (n,)
+         vector     : field vector shape (n,) or a block of fields (n,k)
          iterations : int, number of iterations to smooth vector
          delta      : distance weights to apply the the Gaussian
                     : interpolants
@@ -663,12 +1107,45 @@ class TriMesh(object):
         if type(delta) != type(None):
             self._construct_rbf_weights(delta)
 
-        vector = self.sync(vector)
+        def smooth(vector, nodes, out):
+            out[nodes] = self._cloud_average(vector, nodes)
+
+        return self._iterate_with_sync(smooth, vector, iterations)
+
+
+    def _cloud_average(self, vector, nodes=Ellipsis):
+        """
+        Gaussian weighted average of vector over the neighbour cloud of nodes
+        (vector can be a block of fields, shape (n,k))
+        """
+        weights = self.gaussian_dist_w[nodes]
+        if vector.ndim > 1:
+            weights = weights.reshape(weights.shape + (1,))
+
+        return (vector[self.neighbour_cloud[nodes]] * weights).sum(axis=1)
+
+
+    def _iterate_with_sync(self, operator, vector, iterations):
+        """
+        Apply operator(vector, nodes, out), which writes the new values of nodes into out,
+        for a number of iterations. The shadow zone is synchronised every sync_interval
+        iterations (see construct_halo) and the interior_nodes are updated while the
+        shadow values are exchanged.
+        """
+        interval = max(1, self.sync_interval)
+
+        vector = np.array(vector, dtype=PETSc.ScalarType)
+        out = np.empty_like(vector)
 
         for i in range(0, iterations):
-            # print self.dm.comm.rank, ": RBF ",vector.max(), vector.min()
+            if i % interval == 0:
+                self.sync_begin(vector)
+                operator(vector, self.interior_nodes, out)
+                self.sync_end(vector)
+                operator(vector, self.exterior_nodes, out)
+            else:
+                operator(vector, Ellipsis, out)
 
-            vector_smoothed = (vector[self.neighbour_cloud[:,:]] * self.gaussian_dist_w[:,:]).sum(axis=1)
-            vector = self.sync(vector_smoothed)
+            vector, out = out, vector
 
-        return vector
+        return self.sync(vector)
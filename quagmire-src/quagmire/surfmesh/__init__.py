@@ -16,4 +16,5 @@ You should have received a copy of the GNU Lesser General Public License
 along with Quagmire.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from .surfmesh import SurfMesh
\ No newline at end of file
+from .surfmesh import SurfMesh
+from .driver import LandscapeEvolution
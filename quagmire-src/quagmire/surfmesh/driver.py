@@ -0,0 +1,337 @@
+"""
+Copyright 2016-2017 Louis Moresi, Ben Mather, Romain Beucher
+
+This file is part of Quagmire.
+
+Quagmire is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or any later version.
+
+Quagmire is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with Quagmire.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from mpi4py import MPI
+from petsc4py import PETSc
+comm = MPI.COMM_WORLD
+from time import clock
+
+try: range = xrange
+except: pass
+
+
+class LandscapeEvolution(object):
+    """
+    Run driver for landscape evolution on a SurfaceProcessMesh.
+
+    Each step fills the depressions (and rebuilds the slope and downhill matrices of the filled
+    surface), updates the surface processes, takes an operator-split timestep
+    (landscape_evolution_subcycle) and rebuilds the downhill matrices for the new height.
+    Output and checkpoints are written every output_interval and checkpoint_interval steps.
+
+    A checkpoint holds the DM, the height and any additional fields so that a run can be
+    restarted (LandscapeEvolution.restart) on any number of processors. The mesh is loaded from
+    the DM in the checkpoint and TriMesh triangulates the stored coordinates with a perturbation
+    that only depends on the coordinates, so the restarted mesh has the triangulation of the mesh
+    that was checkpointed.
+
+    Parameters
+    ----------
+     mesh : SurfaceProcessMesh object
+     height : ndarray of floats, shape (n,)
+     rainfall : ndarray of floats, shape (n,)
+     erodibility, kappa, m, uplift_rate, critical_slope, fluxBC :
+        see SurfMesh.landscape_evolution_subcycle
+     max_timestep : float (optional)
+     implicit_erosion : bool
+     fill : fill the depressions (low_points_swamp_fill) before each step
+     output_file : string, output is written to output_file.format(step)
+     output_interval : int, steps between output (0 to disable)
+     checkpoint_file : string
+     checkpoint_interval : int, steps between checkpoints (0 to disable)
+     rebalance_interval : int, steps between checks of the load balance (0 to disable),
+        only meshes that can be rebalanced (TriMesh) can be used
+     rebalance_threshold : float, see TriMesh.rebalance
+     time, step : start time and step number
+     fields : dict of ndarrays of floats, shape (n,) (optional)
+        additional fields written to the output and checkpoints
+        ("height" and "_rainfall" are reserved)
+    """
+    def __init__(self, mesh, height, rainfall, erodibility, kappa, m=0.5, uplift_rate=0.0,
+                 critical_slope=None, fluxBC=False, max_timestep=None, implicit_erosion=False, fill=True,
+                 output_file=None, output_interval=0, checkpoint_file=None, checkpoint_interval=0,
+                 rebalance_interval=0, rebalance_threshold=1.25, time=0.0, step=0, fields=None):
+
+        self.mesh = mesh
+        self.rank = comm.rank
+        self.verbose = mesh.verbose
+        self.timings = dict()
+
+        self.rainfall = np.array(rainfall) * np.ones(mesh.npoints)
+        self.erodibility = erodibility
+        self.kappa = kappa
+        self.m = m
+        self.uplift_rate = uplift_rate
+        self.critical_slope = critical_slope
+        self.fluxBC = fluxBC
+        self.max_timestep = max_timestep
+        self.implicit_erosion = implicit_erosion
+        self.fill = fill
+
+        self.output_file = output_file
+        self.output_interval = output_interval
+        self.checkpoint_file = checkpoint_file
+        self.checkpoint_interval = checkpoint_interval
+        self.rebalance_interval = rebalance_interval
+        self.rebalance_threshold = rebalance_threshold
+
+        self.time = time
+        self.step = step
+        self.fields = dict(fields) if fields is not None else dict()
+        self.subcycles = dict()
+
+        # names of the height and the rainfall in the checkpoints and when the mesh is rebalanced
+        reserved = sorted(set(self.fields.keys()) & set(['height', '_rainfall']))
+        if reserved:
+            raise ValueError("Field names {} are reserved".format(", ".join(reserved)))
+
+        if rebalance_interval and not hasattr(mesh, 'rebalance'):
+            raise ValueError("{} cannot be rebalanced, set rebalance_interval=0".format(type(mesh).__name__))
+
+        # work arrays kept for the whole run
+        self._discharge = np.zeros(mesh.npoints)
+
+        mesh.update_height(height)
+
+
+    def timestep(self, max_timestep=None):
+        """
+        Advance the landscape by one (operator-split) timestep. The timestep can be shorter
+        than max_timestep if the diffusion on the eroded slope needs more substeps than
+        landscape_evolution_subcycle allows (see max_subcycles); the run continues from there.
+
+        Arguments
+        ---------
+         max_timestep : float (optional)
+            limit on this timestep in addition to the max_timestep of the run
+
+        Returns
+        -------
+         timestep : float
+            the timestep that was taken
+        """
+        t = clock()
+        mesh = self.mesh
+
+        if self.max_timestep is not None:
+            max_timestep = self.max_timestep if max_timestep is None else min(max_timestep, self.max_timestep)
+
+        if self.fill:
+            mesh.low_points_swamp_fill()
+            # the fill only rebuilds the adjacency matrices
+            mesh.update_height(mesh.height)
+
+        mesh.update_surface_processes(self.rainfall, np.zeros(mesh.npoints))
+        self._discharge[:] = mesh.cumulative_flow(self.rainfall * mesh.area)
+
+        delta_h, dt, subcycles = mesh.landscape_evolution_subcycle(self.erodibility, self.kappa, m=self.m,
+                                                                   uplift_rate=self.uplift_rate,
+                                                                   critical_slope=self.critical_slope,
+                                                                   fluxBC=self.fluxBC,
+                                                                   discharge=self._discharge,
+                                                                   max_timestep=max_timestep,
+                                                                   implicit_erosion=self.implicit_erosion)
+        mesh.update_height(mesh.height + delta_h)
+
+        self.time += dt
+        self.step += 1
+        self.subcycles = subcycles
+
+        if self.output_interval and self.step % self.output_interval == 0:
+            self.write_output()
+
+        if self.checkpoint_interval and self.step % self.checkpoint_interval == 0:
+            self.checkpoint()
+
+        if self.rebalance_interval and self.step % self.rebalance_interval == 0:
+            self.rebalance()
+
+        self.timings['timestep'] = [clock()-t, mesh.log.getCPUTime(), mesh.log.getFlops()]
+        if self.rank==0 and self.verbose:
+            print("Step {} - time {} ({} diffusion substeps) {}s".format(self.step, self.time,
+                                                                          subcycles['diffusion'], clock()-t))
+
+        return dt
+
+
+    def run(self, end_time=None, steps=None):
+        """
+        Run until end_time is reached or for a number of steps, whichever comes first.
+        The last timestep is shortened to end at end_time.
+
+        Arguments
+        ---------
+         end_time : float (optional)
+         steps : int (optional)
+        """
+        if end_time is None and steps is None:
+            raise ValueError("Provide an end_time or a number of steps")
+
+        first_step = self.step
+
+        while True:
+            # (the last step ends at end_time up to rounding)
+            if end_time is not None and end_time - self.time <= 1.0e-12 * abs(end_time):
+                break
+            if steps is not None and self.step - first_step >= steps:
+                break
+
+            if end_time is not None:
+                self.timestep(max_timestep=end_time - self.time)
+            else:
+                self.timestep()
+
+        return self.time
+
+
+    def rebalance(self, force=False):
+        """
+        Redistribute the mesh, height and fields if the time spent in each stage
+        of the run is out of balance between processors (see TriMesh.rebalance)
+
+        Returns
+        -------
+         rebalanced : bool
+        """
+        mesh = self.mesh
+
+        fields = dict(self.fields)
+        fields['_rainfall'] = self.rainfall
+
+        fields = mesh.rebalance(fields, threshold=self.rebalance_threshold, force=force)
+
+        if fields is None:
+            return False
+
+        self.rainfall = fields.pop('_rainfall')
+        self.fields = fields
+
+        # the discharge is recomputed every step
+        self._discharge = np.zeros(mesh.npoints)
+
+        return True
+
+
+    def write_output(self, file=None):
+        """
+        Write the height and additional fields for the current step
+        """
+        if file is None:
+            file = self.output_file.format(self.step)
+
+        self.mesh.save_field_to_hdf5(file, height=self.mesh.height, **self.fields)
+
+
+    def checkpoint(self, file=None):
+        """
+        Write the DM, height, additional fields, time and step number to a checkpoint file.
+        If the file already exists, it is overwritten.
+        """
+        t = clock()
+        mesh = self.mesh
+
+        if file is None:
+            file = self.checkpoint_file
+
+        file = str(file)
+        if not file.endswith('.h5'):
+            file += '.h5'
+
+        fields = dict(self.fields)
+        fields['height'] = mesh.height
+
+        vec = mesh.dm.createGlobalVec()
+
+        ViewHDF5 = PETSc.Viewer()
+        ViewHDF5.createHDF5(file, mode='w')
+        ViewHDF5.view(obj=mesh.dm)
+
+        for key in fields:
+            mesh.lvec.setArray(fields[key])
+            mesh.dm.localToGlobal(mesh.lvec, vec)
+            vec.setName(key)
+            ViewHDF5.view(obj=vec)
+
+        ViewHDF5.destroy()
+        vec.destroy()
+
+        comm.barrier()
+
+        if self.rank == 0:
+            import h5py
+            with h5py.File(file, 'r+') as h5:
+                h5.attrs['time'] = self.time
+                h5.attrs['step'] = self.step
+                h5.attrs['fields'] = ','.join(sorted(self.fields.keys()))
+
+        comm.barrier()
+
+        self.timings['checkpoint'] = [clock()-t, mesh.log.getCPUTime(), mesh.log.getFlops()]
+        if self.rank==0 and self.verbose:
+            print("Checkpoint {} at step {} {}s".format(file, self.step, clock()-t))
+
+
+    @classmethod
+    def restart(cls, file, rainfall, erodibility, kappa, mesh_kwargs=None, **kwargs):
+        """
+        Restart from a checkpoint written by LandscapeEvolution.checkpoint.
+        The DM (DMPlex only) stored in the checkpoint is loaded and redistributed, with the
+        saved fields, onto the current number of processors. The mesh is not rebuilt from the
+        points: it is the DM that was checkpointed, and TriMesh triangulates its coordinates the
+        same way as before the checkpoint (see LandscapeEvolution).
+
+        Arguments
+        ---------
+         file : string
+         rainfall, erodibility, kappa : see LandscapeEvolution
+            rainfall can be a function of the (x, y) coordinates of the mesh
+         mesh_kwargs : dict of keyword arguments passed to SurfaceProcessMesh (optional)
+         kwargs : passed to LandscapeEvolution
+
+        Returns
+        -------
+         LandscapeEvolution : object
+        """
+        from quagmire import SurfaceProcessMesh
+        from quagmire import tools as meshtools
+
+        file = str(file)
+        if not file.endswith('.h5'):
+            file += '.h5'
+
+        attrs = None
+        if comm.rank == 0:
+            import h5py
+            with h5py.File(file, 'r') as h5:
+                attrs = float(h5.attrs['time']), int(h5.attrs['step']), str(h5.attrs['fields'])
+        time, step, field_names = comm.bcast(attrs, root=0)
+
+        names = ['height'] + [name for name in field_names.split(',') if name]
+        dm, fields = meshtools.create_DMPlex_and_fields_from_hdf5(file, names)
+        if mesh_kwargs is None:
+            mesh_kwargs = dict()
+
+        mesh = SurfaceProcessMesh(dm, **mesh_kwargs)
+
+        if callable(rainfall):
+            rainfall = rainfall(mesh.coords[:,0], mesh.coords[:,1])
+
+        height = fields.pop('height')
+
+        return cls(mesh, height, rainfall, erodibility, kappa, time=time, step=step, fields=fields, **kwargs)
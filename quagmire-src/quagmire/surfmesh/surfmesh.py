@@ -27,6 +27,270 @@ from time import clock
 try: range = xrange
 except: pass
 
+
+def _basin_level(z, cumA, cumAZ, volume):
+    """
+    Invert the hypsometric curve: the level at which nodes with sorted heights z
+    hold the given volume of water (cumA, cumAZ are the cumulative area and area*height
+    starting from the area already flooded below z[0])
+    """
+    if volume <= 0.0 or cumA[-1] == 0.0:
+        return z[0] if z.size else -np.inf
+
+    vz = cumA[:-1]*z - cumAZ[:-1]   # volume held when the level reaches each node
+    n = np.searchsorted(vz, volume, side='right')
+
+    return (volume + cumAZ[n]) / cumA[n]
+
+
+def _bisect_levels(hypsometry, lowest, volume, comm, tolerance=1.0e-14, max_its=200):
+    """
+    Levels at which the nodes of each lake hold the given volumes when the nodes are spread
+    over the processors. hypsometry holds the local (z, cumA, cumAZ) of each lake (see _basin_level)
+    and lowest the level below which the volume is zero (the merge level of the lake or its lowest node).
+    The volume below the trial levels is summed over the processors at each step of the bisection.
+    """
+    n = len(hypsometry)
+    volume = np.asarray(volume, dtype=float)
+
+    def held(levels):
+        local = np.zeros(n)
+        for i, (z, cumA, cumAZ) in enumerate(hypsometry):
+            k = np.searchsorted(z, levels[i])
+            local[i] = cumA[k]*levels[i] - cumAZ[k]
+        comm.Allreduce(MPI.IN_PLACE, local, op=MPI.SUM)
+        return local
+
+    # the volume at a level above the highest node is at least the area of the lake times the depth
+
+    highest = np.array([h[0][-1] if h[0].size else -np.inf for h in hypsometry])
+    area = np.array([h[1][-1] for h in hypsometry])
+    comm.Allreduce(MPI.IN_PLACE, highest, op=MPI.MAX)
+    comm.Allreduce(MPI.IN_PLACE, area, op=MPI.SUM)
+
+    lo = np.array(lowest, dtype=float)
+    lo[~np.isfinite(lo)] = 0.0
+    hi = np.maximum(lo, highest) + volume / np.where(area > 0.0, area, 1.0)
+
+    for its in range(0, max_its):
+        if np.all(hi - lo <= tolerance * np.maximum(1.0, np.maximum(np.abs(lo), np.abs(hi)))):
+            break
+        mid = 0.5*(lo + hi)
+        below = held(mid) < volume
+        lo = np.where(below, mid, lo)
+        hi = np.where(below, hi, mid)
+
+    levels = 0.5*(lo + hi)
+    levels[volume <= 0.0] = lo[volume <= 0.0]
+    levels[area == 0.0] = -np.inf
+
+    return levels
+
+
+def _fill_and_spill_levels(node_basin, node_z, node_area, edges, inflow, comm=None):
+    """
+    Lake levels for each basin of a depression hierarchy given the volume of water
+    (or sediment) arriving in each basin.
+
+    node_basin, node_z, node_area : basin index (0..nbasins-1), height and area of every node in a basin
+    edges  : array (nedges, 3) of (basin, basin, saddle height); a basin index of nbasins
+             denotes the outflow (anything draining off the mesh)
+    inflow : array (nbasins,) of inflow volumes
+
+    The basins are merged in order of increasing saddle height (Kruskal) to build a tree in which
+    each internal node is the lake that forms when both children fill to their common saddle.
+    The nodes are swept in order of height alongside the saddles so each set of the union-find
+    carries the area and area*height flooded below the current saddle; the capacity of a lake
+    and the hypsometry between its merge and spill levels are recorded as it closes.
+    Trees that reach the outflow through a basin of another tree pass their overflow to that basin,
+    so trees are processed in reverse order of joining the outflow. Returns the lake level for each
+    basin (no lake if the level is below the lowest node of the basin) and the volume that leaves the mesh.
+
+    In parallel (comm) each processor passes its own nodes and the same edges and inflow. The tree only
+    depends on the edges and is built on every processor, the capacities of the local nodes are summed
+    over the processors and the levels are found by a bisection of the volume summed over the processors
+    (_bisect_levels), so only values for each basin are communicated.
+    """
+    parallel = comm is not None and comm.size > 1
+
+    nbasins = inflow.size
+    outflow = nbasins
+
+    order = np.argsort(node_z, kind='mergesort')
+    z_sorted = node_z[order]
+    a_sorted = node_area[order]
+    b_sorted = node_basin[order]
+
+    # Kruskal merge of basins in order of saddle height
+
+    uf_parent = np.arange(0, nbasins+1)
+    flooded_area = np.zeros(nbasins+1)
+    flooded_az = np.zeros(nbasins+1)
+
+    def find(i):
+        root = i
+        while uf_parent[root] != root:
+            root = uf_parent[root]
+        while uf_parent[i] != root:
+            uf_parent[i], i = root, uf_parent[i]
+        return root
+
+    children = [None]*nbasins
+    capacity = [np.inf]*nbasins
+    base = [(0.0, 0.0)]*nbasins
+    flooded = [[] for b in range(0, nbasins)]
+    merge_level = [-np.inf]*nbasins
+    link = [-1]*nbasins
+    tree_node = list(range(0, nbasins+1))
+    roots = []
+
+    def flood_below(h, start):
+        # add the nodes below h to the lake that currently holds their basin
+        end = np.searchsorted(z_sorted, h) if h < np.inf else z_sorted.size
+        if end <= start:
+            return start
+        nodes = start + np.argsort(b_sorted[start:end], kind='mergesort')
+        basins, first = np.unique(b_sorted[nodes], return_index=True)
+        for b, idx in zip(basins, np.split(nodes, first[1:])):
+            r = find(b)
+            if r == find(outflow):
+                continue
+            flooded_area[r] += a_sorted[idx].sum()
+            flooded_az[r] += (a_sorted[idx]*z_sorted[idx]).sum()
+            flooded[tree_node[r]].append(idx)
+        return end
+
+    edges = edges[np.argsort(edges[:,2], kind='mergesort')]
+    swept = 0
+
+    for a, b, h in edges:
+        a, b = int(a), int(b)
+        ra, rb = find(a), find(b)
+        if ra == rb:
+            continue
+
+        swept = flood_below(h, swept)
+
+        if find(outflow) in (ra, rb):
+            if ra == find(outflow):
+                ra, rb, a, b = rb, ra, b, a
+            # tree ra spills at h into basin b (already connected to the outflow)
+            X = tree_node[ra]
+            capacity[X] = flooded_area[ra]*h - flooded_az[ra]
+            link[X] = b if b != outflow else -1
+            roots.append(X)
+            uf_parent[ra] = rb
+        else:
+            M = len(children)
+            children.append((tree_node[ra], tree_node[rb]))
+            capacity.append(np.inf)
+            base.append((flooded_area[ra] + flooded_area[rb], flooded_az[ra] + flooded_az[rb]))
+            flooded.append([])
+            merge_level.append(h)
+            link.append(-1)
+            for r in (ra, rb):
+                capacity[tree_node[r]] = flooded_area[r]*h - flooded_az[r]
+            flooded_area[ra] += flooded_area[rb]
+            flooded_az[ra] += flooded_az[rb]
+            uf_parent[rb] = ra
+            tree_node[ra] = M
+
+    # the rest of the nodes fill the closed basins that never reach the outflow
+    flood_below(np.inf, swept)
+
+    for b in range(0, nbasins):
+        if find(b) == b and b != find(outflow):
+            roots.insert(0, tree_node[b])
+
+    if parallel:
+        capacity = np.array(capacity)
+        comm.Allreduce(MPI.IN_PLACE, capacity, op=MPI.SUM)
+
+    def hypsometry(X):
+        # only the nodes between the merge and spill levels of X are needed
+        idx = np.sort(np.hstack(flooded[X])).astype(int) if flooded[X] else np.zeros(0, dtype=int)
+        z = z_sorted[idx]
+        a = a_sorted[idx]
+        area0, az0 = base[X]
+        return z, area0 + np.hstack(([0.0], np.cumsum(a))), az0 + np.hstack(([0.0], np.cumsum(a*z)))
+
+    # levels are found for all of the lakes together once the water is distributed
+    queries = []
+    leaf_query = np.empty(nbasins, dtype=int)
+
+    inflow = np.array(inflow, dtype=float)
+    lost = 0.0
+
+    for root in reversed(roots):
+
+        # accumulate water up the tree
+
+        total = dict()
+        stack = [root]
+        while stack:
+            X = stack.pop()
+            if X < nbasins:
+                total[X] = inflow[X]
+            elif children[X][0] in total:
+                total[X] = total[children[X][0]] + total[children[X][1]]
+            else:
+                stack.append(X)
+                stack.extend(children[X])
+
+        excess = total[root] - capacity[root]
+
+        if excess > 0.0:
+            if link[root] >= 0:
+                inflow[link[root]] += excess
+            else:
+                lost += excess
+
+        # distribute the stored water down the tree; the basins below a merged lake
+        # share its level
+
+        stack = [(root, min(total[root], capacity[root]), None)]
+        while stack:
+            X, w, shared = stack.pop()
+            if shared is None and X >= nbasins:
+                A, B = children[X]
+                if w >= capacity[A] + capacity[B]:
+                    queries.append((X, w))
+                    shared = len(queries) - 1
+
+            if X < nbasins:
+                if shared is None:
+                    queries.append((X, w))
+                    shared = len(queries) - 1
+                leaf_query[X] = shared
+                continue
+
+            A, B = children[X]
+            if shared is not None:
+                stack.extend([(A, None, shared), (B, None, shared)])
+            elif total[A] >= capacity[A]:
+                stack.extend([(A, capacity[A], None), (B, w - capacity[A], None)])
+            elif total[B] >= capacity[B]:
+                stack.extend([(A, w - capacity[B], None), (B, capacity[B], None)])
+            else:
+                stack.extend([(A, total[A], None), (B, total[B], None)])
+
+    if parallel:
+        basin_lowest = np.empty(nbasins)
+        basin_lowest.fill(np.inf)
+        np.minimum.at(basin_lowest, b_sorted, z_sorted)
+
+        # water in a merged lake is above its merge level, in a basin above its lowest node
+        lowest = np.array([merge_level[X] if X >= nbasins else basin_lowest[X] for X, w in queries])
+        comm.Allreduce(MPI.IN_PLACE, lowest, op=MPI.MIN)
+        levels = _bisect_levels([hypsometry(X) for X, w in queries], lowest, [w for X, w in queries], comm)
+    else:
+        levels = np.array([_basin_level(*(hypsometry(X) + (w,))) for X, w in queries])
+
+    lake_level = levels[leaf_query] if nbasins else np.empty(0)
+
+    return lake_level, lost
+
+
 class SurfMesh(object):
 
     def __init__(self, *args, **kwargs):
@@ -71,12 +335,11 @@ class SurfMesh(object):
 
         fill_height =  (self.height[self.neighbour_cloud[my_low_points,1:7]].mean(axis=1)-self.height[my_low_points])
 
+        # uphill_propagation and rbf_smoother return synchronised fields
         new_h = self.uphill_propagation(my_low_points,  fill_height, scale=scale,  its=its, fill=0.0)
-        new_h = self.sync(new_h)
 
         smoothed_new_height = self.rbf_smoother(new_h, iterations=smoothing_steps)
         new_height = np.maximum(0.0, smoothed_new_height) + self.height
-        new_height = self.sync(new_height)
 
         self._update_height_partial(self.height)
         if self.rank==0 and self.verbose:
@@ -110,12 +373,9 @@ class SurfMesh(object):
 
             # self.sync(smoothed_delta_height)
 
-            self.height = np.maximum(smoothed_height, self.height)
-            self.height = self.sync(self.height)
-
             ## Push this / rebuild for the next loop
 
-            self._update_height_partial(self.height)
+            self._update_height_partial(np.maximum(smoothed_height, self.height), consistent=True)
 
         ## Don't leave the mesh in a half-updated state
         # self.update_height(self.height)
@@ -125,7 +385,14 @@ class SurfMesh(object):
 
         return self.height
 
-    def low_points_swamp_fill(self, its=1000, saddles=True, ref_height=0.0):
+    def low_points_swamp_fill(self, its=1000, saddles=True, ref_height=0.0, gradient=None):
+        """
+        Fill each depression to the height of its lowest spill point.
+
+        The filled area is given a small gradient towards the spill point so that it drains
+        (default 0.000001). If the mesh resolves flats (resolve_flats=True) the default gradient is zero
+        and the flow across the filled area is routed without modifying the heights.
+        """
 
         import petsc4py
         from petsc4py import PETSc
@@ -137,6 +404,9 @@ class SurfMesh(object):
 
         t0 = clock()
 
+        if gradient is None:
+            gradient = 0.0 if self.resolve_flats else 0.000001
+
         my_low_points = self.identify_low_points()
         my_glow_points = self.lgmap_row.apply(my_low_points.astype(PETSc.IntType))
 
@@ -226,14 +496,13 @@ class SurfMesh(object):
             separation_y = (self.coords[catchment_nodes,1] - spill['y'])
             distance = np.hypot(separation_x, separation_y)
 
-            height2[catchment_nodes] = spill['h'] + 0.000001 * distance  # A 'small' gradient (should be a user-parameter)
-
-        height2 = self.sync(height2)
+            height2[catchment_nodes] = spill['h'] + gradient * distance
 
+        # height2 is computed pointwise from the synchronised catchments, the global spill points
+        # and the coordinates (perturbed the same way on every processor), so it is not exchanged
         new_height = np.maximum(height, height2)
-        new_height = self.sync(new_height)
 
-        self._update_height_partial(new_height)
+        self._update_height_partial(new_height, consistent=True)
 
         if self.rank==0 and self.verbose:
             print "Low point swamp fill ",  clock()-t0, " seconds"
@@ -272,6 +541,150 @@ class SurfMesh(object):
 
         return height
 
+    def build_basin_graph(self, its=1000):
+        """
+        Build the graph of internally-draining basins (the catchments of the local minima)
+        that is needed to route water or sediment from one depression to the next.
+
+        Each basin is connected to its neighbours (and to the outflow of the mesh) by the
+        lowest saddle on their common edge. Only the lowest saddle of each pair of basins found on
+        each process is exchanged, so every process holds the basins and edges of the whole graph,
+        while the hypsometry of each basin (node heights and areas) stays on the processes that own
+        the nodes. The graph remains valid for any number of inflow vectors until the height field changes.
+
+        Returns
+        -------
+         basin_graph : dict
+            catchment : global node number of the low point draining each (local) node, -ve if
+                        the node drains out of the mesh
+            basins    : sorted global node numbers of the low points
+            nodes     : basin index, height, area of every owned node in a basin
+            edges     : array of (basin, basin, saddle height)
+        """
+
+        t = clock()
+
+        my_low_points = self.identify_low_points()
+        my_glow_points = self.lgmap_row.apply(my_low_points.astype(PETSc.IntType))
+
+        ctmt = self.uphill_propagation(my_low_points,  my_glow_points, its=its, fill=-999999).astype(int)
+        ctmt[ctmt < 0] = -1
+
+        owned = self.lgmap_row.indices >= 0
+        height = self.height
+        area = np.ones(self.npoints) * self.area
+
+        ## Saddles: lowest point on the edge between two basins (or a basin and the outflow)
+
+        indptr, indices = self._get_neighbour_csr()
+        rows = np.repeat(np.arange(0, self.npoints), np.diff(indptr))
+
+        mask = np.logical_and(owned[rows], ctmt[rows] >= 0)
+        mask = np.logical_and(mask, ctmt[rows] != ctmt[indices])
+
+        outer = np.where(np.logical_and(owned, np.logical_and(~self.bmask, ctmt >= 0)))[0]
+
+        edge_a = np.hstack((ctmt[rows[mask]], ctmt[outer]))
+        edge_b = np.hstack((ctmt[indices[mask]], -np.ones(outer.size, dtype=int)))
+        edge_h = np.hstack((np.maximum(height[rows[mask]], height[indices[mask]]), height[outer]))
+
+        def lowest_saddles(edge_a, edge_b, edge_h):
+            order = np.lexsort((edge_h, edge_b, edge_a))
+            edge_a, edge_b, edge_h = edge_a[order], edge_b[order], edge_h[order]
+            first = np.ones(edge_a.size, dtype=bool)
+            first[1:] = np.logical_or(edge_a[1:] != edge_a[:-1], edge_b[1:] != edge_b[:-1])
+            return edge_a[first], edge_b[first], edge_h[first]
+
+        my_edges = lowest_saddles(edge_a, edge_b, edge_h)
+
+        in_basin = np.logical_and(owned, ctmt >= 0)
+
+        # one record for each basin and for each pair of basins on each process
+
+        list_of_basins = comm.allgather(np.unique(ctmt[in_basin]))
+        list_of_edges = comm.allgather(my_edges)
+
+        basins = np.unique(np.hstack(list_of_basins)).astype(int)
+
+        edge_a, edge_b, edge_h = lowest_saddles(np.hstack([e[0] for e in list_of_edges]),
+                                                np.hstack([e[1] for e in list_of_edges]),
+                                                np.hstack([e[2] for e in list_of_edges]))
+
+        edge_a = np.searchsorted(basins, edge_a)
+        edge_b = np.where(edge_b < 0, basins.size, np.searchsorted(basins, edge_b))
+
+        basin_graph = dict()
+        basin_graph['catchment'] = ctmt
+        basin_graph['basins'] = basins
+        basin_graph['nodes'] = (np.searchsorted(basins, ctmt[in_basin]), height[in_basin], area[in_basin])
+        basin_graph['edges'] = np.column_stack((edge_a, edge_b, edge_h))
+
+        if self.rank==0 and self.verbose:
+            print("Build basin graph ({} basins) {}s".format(basin_graph['basins'].size, clock()-t))
+
+        return basin_graph
+
+
+    def lake_fill_and_spill(self, inflow, basin_graph=None):
+        """
+        Volume-limited filling of the depressions in the height field.
+
+        Unlike low_points_swamp_fill, which fills every depression to its spill height, each lake
+        only fills to the level that holds the volume of water (or sediment) that arrives in
+        its basin. A full lake spills the excess into the neighbouring basin across its lowest
+        saddle and lakes that fill to a common saddle merge and rise together.
+
+        Arguments
+        ---------
+         inflow : ndarray of floats, shape (n,)
+            volume delivered to each node (e.g. rainfall * area * dt); the volume arriving at nodes
+            in the catchment of a local minimum is collected in that lake
+         basin_graph : dict (optional)
+            the output of build_basin_graph which can be reused for many inflow vectors
+            as long as the height field does not change
+
+        Returns
+        -------
+         lake_height : ndarray of floats, shape (n,)
+            height of the lake surface or the original height where there is no lake
+         outflow : float
+            volume that spills out of the mesh
+        """
+
+        inflow = np.array(inflow)
+        if inflow.size != self.npoints:
+            raise IndexError("Incompatible array size, should be {}".format(self.npoints))
+
+        if basin_graph is None:
+            basin_graph = self.build_basin_graph()
+
+        t = clock()
+
+        ctmt = basin_graph['catchment']
+        basins = basin_graph['basins']
+
+        owned = self.lgmap_row.indices >= 0
+        in_basin = np.logical_and(owned, ctmt >= 0)
+
+        my_inflow = np.bincount(np.searchsorted(basins, ctmt[in_basin]),
+                                weights=inflow[in_basin], minlength=basins.size).astype(np.float64)
+        basin_inflow = np.zeros_like(my_inflow)
+        comm.Allreduce([my_inflow, MPI.DOUBLE], [basin_inflow, MPI.DOUBLE], op=MPI.SUM)
+
+        # every process finds the same levels from its own nodes (see _fill_and_spill_levels)
+        node_basin, node_z, node_area = basin_graph['nodes']
+        levels, outflow = _fill_and_spill_levels(node_basin, node_z, node_area,
+                                                 basin_graph['edges'], basin_inflow, comm)
+
+        lake_height = self.height.copy()
+        lake = ctmt >= 0
+        lake_height[lake] = np.maximum(lake_height[lake], levels[np.searchsorted(basins, ctmt[lake])])
+
+        if self.rank==0 and self.verbose:
+            print("Lake fill and spill {}s".format(clock()-t))
+
+        return lake_height, outflow
+
     def uphill_propagation(self, points, values, scale=1.0, its=1000, fill=-1):
 
         t0 = clock()
@@ -291,6 +704,10 @@ class SurfMesh(object):
         local_ID.setArray(identifier)
         self.dm.localToGlobal(local_ID, global_ID)
 
+        # the maximum is taken on the owned nodes (global vector)
+        # and the shadow nodes are only synchronised at the end
+        global_identifier = global_ID.copy()
+
         delta = global_ID.copy()
         delta.abs()
         rtolerance = delta.max()[1] * 1.0e-10
@@ -307,11 +724,12 @@ class SurfMesh(object):
                 break
 
             self.gvec.scale(scale)
-            self.dm.globalToLocal(gvec, local_ID)
             global_ID.array[:] = gvec.array[:]
 
-            identifier = np.maximum(identifier, local_ID.array)
-            identifier = self.sync(identifier)
+            global_identifier.pointwiseMax(global_identifier, gvec)
+
+        self.dm.globalToLocal(global_identifier, local_ID)
+        identifier = local_ID.array.copy()
 
         # Note, the -1 is used to identify out of bounds values
 
@@ -416,6 +834,14 @@ class SurfMesh(object):
 
 
     def identify_flat_spots(self):
+        """
+        Identify flat regions of the height field. If the mesh resolves flats these are the
+        flat nodes found when the downhill matrices were built, otherwise they are the nodes
+        where the (smoothed) slope is very small.
+        """
+
+        if self.resolve_flats:
+            return self.flat_spots
 
         smooth_grad1 = self.local_area_smoothing(self.slope, its=1, centre_weight=0.5)
 
@@ -522,7 +948,7 @@ class SurfMesh(object):
 
         flat_spots = self.identify_flat_spots()
 
-        if len(flat_spots):
+        if len(flat_spots) and not self.resolve_flats:
             smoothed_deposition = deposition.copy()
             smoothed_deposition[np.invert(flat_spots)] = 0.0
             smoothed_deposition = self.local_area_smoothing(smoothed_deposition, its=2, centre_weight=0.5)
@@ -534,10 +960,12 @@ class SurfMesh(object):
 
 
 
-    def landscape_diffusion_critical_slope(self, kappa, critical_slope, fluxBC):
+    def landscape_diffusion_critical_slope(self, kappa, critical_slope, fluxBC, height=None):
         '''
         Non-linear diffusion to keep slopes at a critical value. Assumes a background
         diffusion rate (can be a vector of length mesh.tri.npoints) and a critical slope value.
+        If critical_slope is None the diffusion is linear. The rate is computed for self.height
+        unless a (local) height array is given.
 
         This term is suitable for the sloughing of sediment from hillslopes.
 
@@ -550,14 +978,18 @@ class SurfMesh(object):
 
         inverse_bmask = np.invert(self.bmask)
 
-        kappa_eff = kappa / (1.01 - (np.clip(self.slope,0.0,critical_slope) / critical_slope)**2)
+        gradZx, gradZy = self.derivative_grad(self.height if height is None else height)
+        gradZx, gradZy = self.sync_fields(gradZx, gradZy)
+
+        if height is None:
+            slope = self.slope
+        else:
+            slope = np.hypot(gradZx, gradZy)
+
+        kappa_eff = self._critical_slope_diffusivity(kappa, critical_slope, slope)
         self.kappa = kappa_eff
         diff_timestep   =  self.area.min() / kappa_eff.max()
 
-
-        gradZx, gradZy = self.derivative_grad(self.height)
-        gradZx = self.sync(gradZx)
-        gradZy = self.sync(gradZy)
         flux_x = kappa_eff * gradZx
         flux_y = kappa_eff * gradZy
 
@@ -574,9 +1006,196 @@ class SurfMesh(object):
         return diffDz, diff_timestep
 
 
-    def landscape_evolution_timestep(self, diffusion_rate, erosion_rate, deposition_rate, uplift_rate):
+    def _critical_slope_diffusivity(self, kappa, critical_slope, slope):
+        """
+        Effective diffusivity of the critical slope diffusion (linear if critical_slope is None)
+        """
+        if critical_slope:
+            return kappa / (1.01 - (np.clip(slope,0.0,critical_slope) / critical_slope)**2)
+        else:
+            return kappa * np.ones(self.npoints)
+
+
+    def _diffusion_edges(self):
+        """
+        Laplacian weights and edge lengths for every (row, column) pair of neighbours
+        """
+
+        if not hasattr(self, "laplacian_weights"):
+            self.calculate_laplacian_weights()
+
+        indptr, indices, weights = self.laplacian_weights
+        rows = np.repeat(np.arange(0, self.npoints), np.diff(indptr))
+        keep = rows != indices
+
+        rows, cols, weights = rows[keep], indices[keep], weights[keep]
+        length = np.hypot(self.coords[rows,0] - self.coords[cols,0],
+                          self.coords[rows,1] - self.coords[cols,1])
+
+        return rows, cols, weights, length
+
+
+    def _diffusion_edge_kappa(self, height, kappa, critical_slope):
+        """
+        Diffusivity on each edge, increasing without limit as the slope
+        along the edge approaches the critical slope
+        """
+
+        rows, cols, weights, length = self._diffusion_edges()
+
+        kappa = kappa * np.ones(self.npoints)
+        edge_kappa = 0.5 * (kappa[rows] + kappa[cols])
+
+        if critical_slope:
+            slope = np.abs(height[rows] - height[cols]) / length
+            edge_kappa /= (1.01 - (np.clip(slope, 0.0, critical_slope) / critical_slope)**2)
+
+        return edge_kappa
+
+
+    def _assemble_diffusion_matrix(self, matrix, timestep, edge_kappa, fixed):
+        """
+        Assemble area + timestep * (Laplacian) on the rows of the local (owned) nodes,
+        with identity rows on the fixed nodes. A new matrix is created if matrix is None.
+        """
+
+        rows, cols, weights, length = self._diffusion_edges()
+
+        nodes = np.arange(0, self.npoints)
+        owned = self.lgmap_row.indices >= 0
+        area = np.ones(self.npoints) * self.area
+
+        coefficient = timestep * weights * edge_kappa
+        diagonal = area + np.bincount(rows, weights=coefficient, minlength=self.npoints)
+        diagonal[fixed] = 1.0
+
+        keep = np.logical_and(owned[rows], ~fixed[rows])
+
+        r = np.hstack((rows[keep], nodes[owned]))
+        c = np.hstack((cols[keep], nodes[owned]))
+        v = np.hstack((-coefficient[keep], diagonal[owned]))
+
+        order = np.lexsort((c, r))
+        nnz = np.bincount(r, minlength=self.npoints)
+        indptr = np.hstack(([0], np.cumsum(nnz))).astype(PETSc.IntType)
+
+        if matrix is None:
+            matrix = self._adjacency_matrix_template(nnz[owned].astype(PETSc.IntType))
+        else:
+            matrix.zeroEntries()
+
+        matrix.setValuesLocalCSR(indptr, c[order].astype(PETSc.IntType), v[order])
+        matrix.assemblyBegin()
+        matrix.assemblyEnd()
+
+        return matrix
+
+
+    def landscape_diffusion_implicit(self, timestep, kappa, critical_slope=None, fluxBC=False):
+        """
+        Hillslope diffusion integrated implicitly (backward Euler) with the Laplacian assembled
+        on the dual mesh (TriMesh) or the 5-point stencil (PixMesh).
+
+        Linear diffusion is a single KSP solve. With a critical slope the diffusivity on each
+        edge is kappa / (1.01 - (S/Sc)**2) and the nonlinear system is solved with SNES, using
+        the Picard linearisation as the Jacobian (use -diffusion_snes_mf_operator for Newton-Krylov).
+        Solver options can be set with the prefix "diffusion_". There is no stability limit on
+        the timestep so diffusion no longer restricts landscape_evolution_timestep.
+
+        Arguments
+        ---------
+         timestep : float
+         kappa : float or ndarray of floats, shape (n,)
+         critical_slope : float (optional)
+         fluxBC : bool
+            True: no flux across the boundary, False: boundary heights are fixed
+
+        Returns
+        -------
+         delta_h : ndarray of floats, shape (n,)
+            change in height over the timestep
+        """
+
+        t = clock()
+
+        height = self.height.copy()
+        area = np.ones(self.npoints) * self.area
+        fixed = np.zeros(self.npoints, dtype=bool) if fluxBC else ~self.bmask
+
+        rhs = np.where(fixed, height, area * height)
+
+        b = self.gvec.duplicate()
+        x = self.gvec.duplicate()
+        self.lvec.setArray(rhs)
+        self.dm.localToGlobal(self.lvec, b)
+        self.lvec.setArray(height)
+        self.dm.localToGlobal(self.lvec, x)
+
+        if not critical_slope:
+            edge_kappa = self._diffusion_edge_kappa(height, kappa, None)
+            matrix = self._assemble_diffusion_matrix(None, timestep, edge_kappa, fixed)
+
+            ksp = PETSc.KSP().create(comm=comm)
+            ksp.setOperators(matrix)
+            ksp.setType('gmres')
+            ksp.getPC().setType('bjacobi')
+            ksp.setTolerances(rtol=1.0e-10)
+            ksp.setOptionsPrefix('diffusion_')
+            ksp.setFromOptions()
+            ksp.solve(b, x)
+
+        else:
+            rows, cols, weights, length = self._diffusion_edges()
+            h_local = self.lvec.duplicate()
+            r_local = self.lvec.duplicate()
+
+            def residual(snes, X, F):
+                self.dm.globalToLocal(X, h_local)
+                h = h_local.array
+                edge_kappa = self._diffusion_edge_kappa(h, kappa, critical_slope)
+                flux = timestep * weights * edge_kappa * (h[rows] - h[cols])
+                r = area * h + np.bincount(rows, weights=flux, minlength=self.npoints)
+                r = np.where(fixed, h, r) - rhs
+                r_local.setArray(r)
+                self.dm.localToGlobal(r_local, F)
+
+            def jacobian(snes, X, J, P):
+                self.dm.globalToLocal(X, h_local)
+                edge_kappa = self._diffusion_edge_kappa(h_local.array, kappa, critical_slope)
+                self._assemble_diffusion_matrix(P, timestep, edge_kappa, fixed)
+                if J != P:
+                    J.assemble()
+
+            edge_kappa = self._diffusion_edge_kappa(height, kappa, critical_slope)
+            matrix = self._assemble_diffusion_matrix(None, timestep, edge_kappa, fixed)
+
+            snes = PETSc.SNES().create(comm=comm)
+            snes.setFunction(residual, self.gvec.duplicate())
+            snes.setJacobian(jacobian, matrix)
+            snes.setType('newtonls')
+            snes.getKSP().setType('gmres')
+            snes.getKSP().getPC().setType('bjacobi')
+            snes.setOptionsPrefix('diffusion_')
+            snes.setFromOptions()
+            snes.solve(None, x)
+
+        self.dm.globalToLocal(x, self.lvec)
+        delta_h = self.lvec.array - height
+        delta_h[fixed] = 0.0  # not only to the solver tolerance
+
+        self.timings['implicit diffusion'] = [clock()-t, self.log.getCPUTime(), self.log.getFlops()]
+        if self.rank==0 and self.verbose:
+            print("Implicit diffusion {}s".format(clock()-t))
+
+        return delta_h
+
+
+    def landscape_evolution_timestep(self, diffusion_rate, erosion_rate, deposition_rate, uplift_rate, implicit_diffusion=False):
     	"""
 		Calculate the change in topography for one timestep
+
+		If the diffusion is integrated separately with landscape_diffusion_implicit
+		(implicit_diffusion=True), it does not limit the timestep and diffusion_rate should be zero.
     	"""
 
     	time = 0.0
@@ -589,7 +1208,7 @@ class SurfMesh(object):
 
     	erosion_timestep    = (self.slope*typical_l/(erosion_rate + 1e-12)).min()
     	deposition_timestep = (self.slope*typical_l/(deposition_rate + 1e-12)).min()
-    	diffusion_timestep  = self.area.min()/np.max(self.kappa)
+    	diffusion_timestep  = self.area.min()/np.max(self.kappa) if not implicit_diffusion else np.inf
 
     	local_timestep = np.array(min(erosion_timestep, deposition_timestep, diffusion_timestep))
     	timestep = np.array(0.0)
@@ -602,6 +1221,477 @@ class SurfMesh(object):
 
 
 
+    def landscape_evolution_subcycle(self, erodibility, kappa, m=0.5, uplift_rate=0.0, critical_slope=None,
+                                     fluxBC=False, discharge=None, max_timestep=None, implicit_erosion=False,
+                                     courant=0.5, max_subcycles=100):
+        """
+        Operator-split timestep in which hillslope diffusion is subcycled inside a single
+        stream-power erosion step.
+
+        Each process is limited by its own stable timestep instead of the smallest of all of them:
+        the erosion step is limited by the explicit stream-power operator (or only by max_timestep
+        if implicit_erosion is True) and the diffusion is advanced in explicit substeps, each limited
+        by the stability of the diffusion on the current (eroded and diffused) slope. Uplift is applied
+        with the erosion. The downhill matrices are not rebuilt between the substeps so update_height
+        only needs to be called once with the new height.
+
+        Arguments
+        ---------
+         erodibility : float or ndarray of floats, shape (n,)
+         kappa : float or ndarray of floats, shape (n,)
+         m : discharge exponent (default: 0.5)
+         uplift_rate : float or ndarray of floats, shape (n,)
+         critical_slope : float (optional) - see landscape_diffusion_critical_slope
+         fluxBC : bool - see landscape_diffusion_critical_slope
+         discharge : ndarray of floats, shape (n,)
+            default: the cumulative flow of rainfall (rainfall_pattern * area)
+         max_timestep : float (required if implicit_erosion is True)
+         implicit_erosion : use stream_power_erosion_deposition_implicit for the erosion step
+         courant : fraction of the stable timestep of each explicit process
+         max_subcycles : the erosion step is reduced so the diffusion on the initial slope
+            does not need more substeps. If the diffusion on the eroded slope needs more
+            (the critical slope diffusion speeds up as erosion steepens the surface), the
+            timestep is shortened to the time covered by max_subcycles substeps and the
+            erosion and uplift are taken over the shortened timestep
+
+        Returns
+        -------
+         delta_h : ndarray of floats, shape (n,)
+            change in height over the timestep
+         timestep : float
+            can be shorter than the step limited by max_timestep (see max_subcycles)
+         subcycles : dict
+            number of substeps taken by each process
+        """
+
+        t = clock()
+
+        if discharge is None:
+            discharge = self.cumulative_flow(self.rainfall_pattern * self.area)
+
+        if implicit_erosion:
+            if max_timestep is None:
+                raise ValueError("max_timestep is required for the implicit erosion step")
+            erosion_timestep = max_timestep
+        else:
+            coefficient = self._stream_power_coefficient(erodibility, m, discharge)
+            erosion_timestep = self._global_min_timestep(courant / (coefficient.max() + 1e-12))
+            if max_timestep is not None:
+                erosion_timestep = min(erosion_timestep, max_timestep)
+
+        # stability limit of the diffusion on the initial slope (sets the length of the step)
+
+        kappa_eff = self._critical_slope_diffusivity(kappa, critical_slope, self.slope)
+        diffusion_timestep = self._global_min_timestep(courant * self.area.min() / kappa_eff.max())
+
+        timestep = min(erosion_timestep, max_subcycles * diffusion_timestep)
+
+        # erosion and uplift
+
+        if implicit_erosion:
+            erosion = self.stream_power_erosion_deposition_implicit(timestep, erodibility, m=m,
+                                                                    uplift_rate=uplift_rate, discharge=discharge)
+        else:
+            erosion = timestep * self._stream_power_erosion_rate(coefficient, uplift_rate)
+
+        # diffusion substeps on the eroded surface, each stable for the current slope
+
+        diffusion = np.zeros_like(erosion)
+        elapsed = 0.0
+        nsubcycles = 0
+        while timestep - elapsed > 1.0e-12 * timestep and nsubcycles < max_subcycles:
+            height = self.height + erosion + diffusion
+            diffusion_rate, diffusion_timestep = self.landscape_diffusion_critical_slope(kappa, critical_slope,
+                                                                                         fluxBC, height=height)
+            dt = min(self._global_min_timestep(courant * diffusion_timestep), timestep - elapsed)
+            diffusion += dt * diffusion_rate
+            elapsed += dt
+            nsubcycles += 1
+
+        # the eroded slope needs more substeps than max_subcycles:
+        # shorten the timestep to the time the diffusion has covered
+
+        if timestep - elapsed > 1.0e-12 * timestep:
+            if implicit_erosion:
+                erosion = self.stream_power_erosion_deposition_implicit(elapsed, erodibility, m=m,
+                                                                        uplift_rate=uplift_rate, discharge=discharge)
+            else:
+                erosion *= elapsed / timestep
+            timestep = elapsed
+
+        subcycles = {'erosion': 1, 'diffusion': nsubcycles}
+
+        self.timings['subcycle timestep'] = [clock()-t, self.log.getCPUTime(), self.log.getFlops()]
+        if self.rank==0 and self.verbose:
+            print("Subcycled timestep {} ({} diffusion substeps) {}s".format(timestep, nsubcycles, clock()-t))
+
+        return erosion + diffusion, timestep, subcycles
+
+
+    def _global_min_timestep(self, local_timestep):
+        """ Smallest timestep of all processors """
+        local_timestep = np.array(local_timestep)
+        timestep = np.array(0.0)
+        comm.Allreduce([local_timestep, MPI.DOUBLE], [timestep, MPI.DOUBLE], op=MPI.MIN)
+        return float(timestep)
+
+
+
+    def stream_power_erosion_implicit(self, timestep, erodibility, m=0.5, n=1.0, uplift_rate=0.0,
+                                      discharge=None, max_its=100, tolerance=1.0e-10):
+        """
+        Detachment-limited stream-power erosion integrated implicitly along the receiver chains
+        (Braun and Willett, 2013).
+
+            dh/dt = U - K Q^m S^n
+
+        The heights are updated from base level upwards along the single downhill receiver
+        (down_neighbour[1]) so each node sees the new height of its receiver. This is a single pass
+        over the nodes per timestep and is stable for any timestep. Boundary nodes are held fixed,
+        internal low points only receive uplift.
+
+        In parallel, chains that cross process boundaries are resolved by exchanging the new heights
+        of the shadow nodes and re-solving until the heights no longer change. The number of
+        exchanges is set by the number of times a chain crosses a partition boundary.
+
+        Arguments
+        ---------
+         timestep : float
+         erodibility : float or ndarray of floats, shape (n,) (K)
+         m, n : stream power exponents (default: 0.5, 1.0)
+         uplift_rate : float or ndarray of floats, shape (n,) (U)
+         discharge : ndarray of floats, shape (n,) (Q)
+            default: the cumulative flow of rainfall (rainfall_pattern * area)
+         max_its : maximum number of boundary exchanges (parallel only)
+         tolerance : convergence of the boundary exchange
+
+        Returns
+        -------
+         delta_h : ndarray of floats, shape (n,)
+            change in height over the timestep
+        """
+
+        t = clock()
+
+        if discharge is None:
+            discharge = self.cumulative_flow(self.rainfall_pattern * self.area)
+
+        nodes = np.arange(0, self.npoints)
+        receiver = self.down_neighbour[1]
+        shadow = self.lgmap_row.indices < 0
+
+        length = np.hypot(self.coords[:,0] - self.coords[receiver,0],
+                          self.coords[:,1] - self.coords[receiver,1])
+        length[receiver == nodes] = 1.0
+
+        F = timestep * erodibility * np.power(np.maximum(discharge, 0.0), m) / np.power(length, n)
+        F = F * np.ones(self.npoints)
+
+        h0 = self.height + timestep * uplift_rate * np.ones(self.npoints)
+        h0[~self.bmask] = self.height[~self.bmask]
+
+        levels = self._receiver_levels(receiver, fixed=np.logical_or(shadow, ~self.bmask))
+
+        h = h0.copy()
+        h[shadow] = self.height[shadow]
+
+        for its in range(0, max_its):
+            h_old = h.copy()
+
+            for level in levels[1:]:
+                hr = h[receiver[level]]
+                hp = h0[level]
+                Fl = F[level]
+
+                if n == 1.0:
+                    hn = (hp + Fl * hr) / (1.0 + Fl)
+                else:
+                    # Newton iterations on x - hp + F (x - hr)^n = 0 for hr < x <= hp
+                    hn = hp.copy()
+                    for i in range(0, 20):
+                        dh = np.maximum(hn - hr, 1.0e-30)
+                        f = hn - hp + Fl * np.power(dh, n)
+                        hn -= f / (1.0 + n * Fl * np.power(dh, n-1.0))
+                        hn = np.maximum(hn, hr)
+
+                h[level] = np.where(hp > hr, hn, hp)
+
+            if comm.size == 1:
+                break
+
+            h = self.sync(h)
+
+            local_change = np.array(np.abs(h - h_old).max())
+            change = np.array(0.0)
+            comm.Allreduce([local_change, MPI.DOUBLE], [change, MPI.DOUBLE], op=MPI.MAX)
+
+            if change < tolerance:
+                break
+
+        self.timings['implicit stream power'] = [clock()-t, self.log.getCPUTime(), self.log.getFlops()]
+        if self.rank==0 and self.verbose:
+            print("Implicit stream power erosion ({} exchanges) {}s".format(its+1, clock()-t))
+
+        return h - self.height
+
+
+
+    def _stream_power_coefficient(self, erodibility, m, discharge):
+        """
+        K Q^m / L for the weighted (multiple) downhill pathways, where L is the
+        weighted distance to the downhill nodes. Zero at nodes with no downhill neighbour
+        and at the boundary nodes (fixed base level).
+        """
+
+        if discharge is None:
+            discharge = self.cumulative_flow(self.rainfall_pattern * self.area)
+
+        nodes = np.arange(0, self.npoints)
+        length = np.zeros(self.npoints)
+        sink = np.ones(self.npoints, dtype=bool)
+
+        for i in range(0, self.downhill_neighbours):
+            down_N = self.down_neighbour[i+1]
+            length += self.downhill_weights[i] * np.hypot(self.coords[:,0] - self.coords[down_N,0],
+                                                          self.coords[:,1] - self.coords[down_N,1])
+            sink = np.logical_and(sink, down_N == nodes)
+
+        length[sink] = 1.0
+
+        coefficient = erodibility * np.power(np.maximum(discharge, 0.0), m) / length
+        coefficient = coefficient * np.ones(self.npoints)
+        coefficient[sink] = 0.0
+        coefficient[~self.bmask] = 0.0
+
+        return coefficient
+
+
+    def stream_power_erosion_rate_mfd(self, erodibility, m=0.5, uplift_rate=0.0, discharge=None):
+        """
+        Explicit rate of change of height for stream-power erosion (n=1) on the weighted downhill
+        pathways, dh/dt = U - K Q^m (h - D^T h) / L where D is the downhill matrix.
+        This is the same spatial operator that stream_power_erosion_deposition_implicit integrates.
+        """
+
+        coefficient = self._stream_power_coefficient(erodibility, m, discharge)
+
+        return self._stream_power_erosion_rate(coefficient, uplift_rate)
+
+
+    def _stream_power_erosion_rate(self, coefficient, uplift_rate):
+        """
+        dh/dt = U - C (h - D^T h) for the coefficient C = K Q^m / L (see _stream_power_coefficient)
+        """
+
+        hvec = self.gvec.duplicate()
+        self.lvec.setArray(self.height)
+        self.dm.localToGlobal(self.lvec, hvec)
+        self.downhillMat.multTranspose(hvec, self.gvec)
+        self.dm.globalToLocal(self.gvec, self.lvec)
+
+        dhdt = uplift_rate - coefficient * (self.height - self.lvec.array)
+        dhdt[~self.bmask] = 0.0
+
+        return dhdt
+
+
+    def stream_power_erosion_deposition_implicit(self, timestep, erodibility, m=0.5, uplift_rate=0.0,
+                                                 deposition_coefficient=0.0, discharge=None, solver=None,
+                                                 max_its=50, tolerance=1.0e-8):
+        """
+        Stream-power erosion and deposition on the weighted (multiple) downhill pathways integrated
+        implicitly in time (after Yuan et al., 2019).
+
+            dh/dt = U - K Q^m S + G Qs / Q
+
+        The slope is measured along the downhill matrix built in update_height so the erosion
+        operator is I + dt K Q^m (I - D^T) / L. Downhill nodes are always lower, so the system
+        is triangular when ordered by height: solver="sweep" solves it in a single ordered pass
+        (serial only) and solver="ksp" uses a PETSc KSP (default in parallel, options prefix
+        "erosion_"). The sediment flux Qs from upstream erosion is lagged and the solution iterated
+        until it converges (no iterations if the deposition coefficient G is zero).
+
+        Arguments
+        ---------
+         timestep : float
+         erodibility : float or ndarray of floats, shape (n,) (K)
+         m : discharge exponent (default: 0.5)
+         uplift_rate : float or ndarray of floats, shape (n,) (U)
+         deposition_coefficient : float (G) (default: 0.0, detachment-limited)
+         discharge : ndarray of floats, shape (n,) (Q)
+            default: the cumulative flow of rainfall (rainfall_pattern * area)
+         solver : "sweep" or "ksp"
+         max_its, tolerance : control the sediment flux iterations
+
+        Returns
+        -------
+         delta_h : ndarray of floats, shape (n,)
+            change in height over the timestep
+        """
+
+        t = clock()
+
+        if discharge is None:
+            discharge = self.cumulative_flow(self.rainfall_pattern * self.area)
+
+        if solver is None:
+            solver = "sweep" if comm.size == 1 else "ksp"
+
+        F = timestep * self._stream_power_coefficient(erodibility, m, discharge)
+
+        h0 = self.height + timestep * uplift_rate * np.ones(self.npoints)
+        h0[~self.bmask] = self.height[~self.bmask]
+
+        if solver == "sweep":
+            solve = self._erosion_sweep_solver(F)
+        else:
+            solve = self._erosion_ksp_solver(F)
+
+        h = solve(h0)
+
+        if deposition_coefficient:
+            area = np.ones(self.npoints) * self.area
+            for its in range(0, max_its):
+                erosion = area * (h0 - h) / timestep
+                sediment_flux = self.cumulative_flow(erosion) - erosion
+                deposition = deposition_coefficient * sediment_flux / np.maximum(discharge, 1.0e-12)
+                deposition[~self.bmask] = 0.0
+
+                h_old = h
+                h = solve(h0 + timestep * deposition)
+
+                local_change = np.array(np.abs(h - h_old).max())
+                change = np.array(0.0)
+                comm.Allreduce([local_change, MPI.DOUBLE], [change, MPI.DOUBLE], op=MPI.MAX)
+
+                if change < tolerance:
+                    break
+
+        self.timings['implicit erosion deposition'] = [clock()-t, self.log.getCPUTime(), self.log.getFlops()]
+        if self.rank==0 and self.verbose:
+            print("Implicit erosion / deposition ({}) {}s".format(solver, clock()-t))
+
+        return h - self.height
+
+
+    def _erosion_sweep_solver(self, F):
+        """
+        Returns a function that solves (I + F (I - D^T)) h = b by substitution
+        in order of increasing height (serial)
+        """
+        from scipy.sparse import csr_matrix
+        from scipy.sparse.linalg import spsolve_triangular
+
+        if comm.size > 1:
+            raise RuntimeError("The ordered sweep is only available in serial, use solver='ksp'")
+
+        nodes = np.arange(0, self.npoints)
+        rows = [nodes]
+        cols = [nodes]
+        vals = [1.0 + F]
+
+        for i in range(0, self.downhill_neighbours):
+            down_N = self.down_neighbour[i+1]
+            rows.append(nodes)
+            cols.append(down_N)
+            vals.append(-F * self.downhill_weights[i])
+
+        rows, cols, vals = np.hstack(rows), np.hstack(cols), np.hstack(vals)
+
+        rank = np.empty(self.npoints, dtype=int)
+        order = np.argsort(self.height, kind='mergesort')
+        rank[order] = nodes
+
+        off_diagonal = np.logical_and(rows != cols, vals != 0.0)
+        if np.any(rank[cols[off_diagonal]] > rank[rows[off_diagonal]]):
+            # equal heights can break the ordering - fall back to a Krylov solve
+            return self._erosion_ksp_solver(F)
+
+        matrix = csr_matrix((vals, (rank[rows], rank[cols])), shape=(self.npoints, self.npoints))
+
+        def solve(b):
+            h = np.empty_like(b)
+            h[order] = spsolve_triangular(matrix, b[order], lower=True)
+            return h
+
+        return solve
+
+
+    def _erosion_ksp_solver(self, F):
+        """
+        Returns a function that solves (I + F (I - D^T)) h = b with a PETSc KSP,
+        built from the downhill matrix.
+
+        The transpose of the downhill matrix, the operator (with its diagonal), the KSP and its
+        vectors are kept until the downhill matrix changes (then they are destroyed), so each
+        call only refills the values of the operator for F.
+        """
+
+        cache = getattr(self, '_erosion_ksp', None)
+
+        if cache is None or cache['downhillMat'] is not self.downhillMat:
+            self._destroy_erosion_ksp()
+
+            transpose = self.downhillMat.transpose(PETSc.Mat())
+
+            matrix = transpose.copy()
+            matrix.setOption(PETSc.Mat.Option.NEW_NONZERO_ALLOCATION_ERR, False)
+            Fvec = self.gvec.duplicate()
+            Fvec.set(1.0)
+            matrix.setDiagonal(Fvec)
+
+            ksp = PETSc.KSP().create(comm=comm)
+            ksp.setType('gmres')
+            ksp.getPC().setType('bjacobi')
+            ksp.setTolerances(rtol=1.0e-10)
+            ksp.setOptionsPrefix('erosion_')
+            ksp.setFromOptions()
+
+            cache = {'downhillMat': self.downhillMat, 'transpose': transpose, 'matrix': matrix, 'ksp': ksp,
+                     'F': Fvec, 'b': self.gvec.duplicate(), 'h': self.gvec.duplicate()}
+            self._erosion_ksp = cache
+
+        matrix, ksp, Fvec, bvec, hvec = cache['matrix'], cache['ksp'], cache['F'], cache['b'], cache['h']
+
+        self.lvec.setArray(F)
+        self.dm.localToGlobal(self.lvec, Fvec)
+
+        # the diagonal is in the pattern of the operator, not of the transpose
+        matrix.zeroEntries()
+        matrix.axpy(1.0, cache['transpose'], structure=PETSc.Mat.Structure.SUBSET_NONZERO_PATTERN)
+        Fvec.scale(-1.0)
+        matrix.diagonalScale(L=Fvec)
+        Fvec.scale(-1.0)
+        Fvec.shift(1.0)
+        matrix.setDiagonal(Fvec)
+
+        ksp.setOperators(matrix)
+
+        def solve(b):
+            self.lvec.setArray(b)
+            self.dm.localToGlobal(self.lvec, bvec)
+            hvec.setArray(bvec)
+            ksp.solve(bvec, hvec)
+            self.dm.globalToLocal(hvec, self.lvec)
+            return self.lvec.array.copy()
+
+        return solve
+
+
+    def _destroy_erosion_ksp(self):
+        """
+        Destroy the operator and KSP of the implicit erosion (see _erosion_ksp_solver)
+        """
+        cache = getattr(self, '_erosion_ksp', None)
+        if cache is None:
+            return
+
+        for key in ['ksp', 'matrix', 'transpose', 'F', 'b', 'h']:
+            cache[key].destroy()
+        self._erosion_ksp = None
+
+
+
     def stream_power_erosion_deposition_rate_local(self, stream_power,
                                              efficiency=0.01,
                                              smoothOperator=None,
@@ -678,7 +1768,7 @@ class SurfMesh(object):
 
         flat_spots = self.identify_flat_spots()
 
-        if len(flat_spots):
+        if len(flat_spots) and not self.resolve_flats:
             smoothed_deposition = deposition.copy()
             smoothed_deposition[np.invert(flat_spots)] = 0.0
             smoothed_deposition = self.local_area_smoothing(smoothed_deposition, its=2, centre_weight=0.5)
@@ -17,4 +17,7 @@ along with Quagmire.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 from meshtools import *
-from generate_xdmf import generateXdmf as generate_xdmf
\ No newline at end of file
+from generate_xdmf import generateXdmf as generate_xdmf
+from generate_xdmf import XdmfAppender
+from timeseries import TimeSeriesWriter, AsyncTimeSeriesWriter
+from raster import open_raster, sample_raster, MeshRasteriser
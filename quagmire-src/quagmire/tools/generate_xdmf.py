@@ -9,13 +9,16 @@ class Xdmf:
     self.typeExt  = {2 : {'vector' : ['x', 'y'], 'tensor' : ['xx', 'yy', 'xy']}, 3 : {'vector' : ['x', 'y', 'z'], 'tensor' : ['xx', 'yy', 'zz', 'xy', 'yz', 'xz']}}
     return
 
-  def writeHeader(self, fp, hdfFilename):
+  def writeHeader(self, fp, hdfFilename, meshFilename = None):
+    if meshFilename is None: meshFilename = hdfFilename
+    meshPath = os.path.relpath(meshFilename, os.path.dirname(os.path.abspath(self.filename)))
     fp.write('''\
 <?xml version="1.0" ?>
 <!DOCTYPE Xdmf SYSTEM "Xdmf.dtd" [
 <!ENTITY HeavyData "%s">
+<!ENTITY MeshData "%s">
 ]>
-''' % os.path.basename(hdfFilename))
+''' % (os.path.basename(hdfFilename), meshPath))
     fp.write('\n<Xdmf>\n  <Domain Name="domain">\n')
     return
 
@@ -26,7 +29,7 @@ class Xdmf:
 	      Format="HDF"
 	      NumberType="Float" Precision="8"
 	      Dimensions="%d %d">
-      &HeavyData;:/%s/cells
+      &MeshData;:/%s/cells
     </DataItem>
 ''' % (numCells, numCorners, topologyPath))
     return
@@ -36,7 +39,7 @@ class Xdmf:
     <DataItem Name="vertices"
 	      Format="HDF"
 	      Dimensions="%d %d">
-      &HeavyData;:/%s/vertices
+      &MeshData;:/%s/vertices
     </DataItem>
     <!-- ============================================================ -->
 ''' % (numVertices, spaceDim, geometryPath))
@@ -180,10 +183,10 @@ class Xdmf:
     fp.write('  </Domain>\n</Xdmf>\n')
     return
 
-  def write(self, hdfFilename, topologyPath, numCells, numCorners, cellDim, geometryPath, numVertices, spaceDim, time, vfields, cfields):
+  def write(self, hdfFilename, topologyPath, numCells, numCorners, cellDim, geometryPath, numVertices, spaceDim, time, vfields, cfields, meshFilename = None):
     useTime = not (len(time) < 2 and time[0] == -1)
     with file(self.filename, 'w') as fp:
-      self.writeHeader(fp, hdfFilename)
+      self.writeHeader(fp, hdfFilename, meshFilename)
       self.writeCells(fp, topologyPath, numCells, numCorners)
       self.writeVertices(fp, geometryPath, numVertices, spaceDim)
       if useTime: self.writeTimeGridHeader(fp, time)
@@ -196,9 +199,80 @@ class Xdmf:
       self.writeFooter(fp)
     return
 
-def generateXdmf(hdfFilename, xdmfFilename = None):
+class XdmfAppender(Xdmf):
+  """
+  Xdmf file for a time series that is extended one timestep at a time.
+  Each timestep is a Grid with its own Time value in a temporal collection.
+  The file is closed (valid) after every append and the dataset shapes are
+  given, so the HDF5 file is never read. The mesh can be in a separate file.
+  """
+  def __init__(self, filename, hdfFilename, topologyPath, numCells, numCorners, cellDim, geometryPath, numVertices, spaceDim, meshFilename = None):
+    Xdmf.__init__(self, filename)
+    self.numCells   = numCells
+    self.numCorners = numCorners
+    self.cellDim    = cellDim
+    self.spaceDim   = spaceDim
+    with open(self.filename, 'w') as fp:
+      self.writeHeader(fp, hdfFilename, meshFilename)
+      self.writeCells(fp, topologyPath, numCells, numCorners)
+      self.writeVertices(fp, geometryPath, numVertices, spaceDim)
+      fp.write('    <Grid Name="TimeSeries" GridType="Collection" CollectionType="Temporal">\n')
+      self.offset = fp.tell()
+      self.writeTimeGridFooter(fp)
+      self.writeFooter(fp)
+    return
+
+  def writeAttribute(self, fp, numSteps, timestep, name, path, dof, bs, domain, precision = 8):
+    fp.write('''\
+	<Attribute
+	   Name="%s"
+	   Type="%s"
+	   Center="%s">
+          <DataItem ItemType="HyperSlab"
+		    Dimensions="1 %d %d"
+		    Type="HyperSlab">
+            <DataItem
+	       Dimensions="3 3"
+	       Format="XML">
+              %d 0 0
+              1 1 1
+              1 %d %d
+	    </DataItem>
+	    <DataItem
+	       DataType="Float" Precision="%d"
+	       Dimensions="%d %d %d"
+	       Format="HDF">
+	      &HeavyData;:%s
+	    </DataItem>
+	  </DataItem>
+	</Attribute>
+''' % (name, 'Scalar' if bs == 1 else 'Vector', domain, dof, bs, timestep, dof, bs, precision, numSteps, dof, bs, path))
+    return
+
+  def append(self, time, timestep, vfields, cfields=[]):
+    """
+    Add a timestep. vfields and cfields are lists of (name, dof, bs) or
+    (name, dof, bs, precision) for the datasets in /vertex_fields and /cell_fields
+    """
+    with open(self.filename, 'r+') as fp:
+      fp.seek(self.offset)
+      self.writeSpaceGridHeader(fp, self.numCells, self.numCorners, self.cellDim, self.spaceDim)
+      fp.write('\t<Time Value="%s"/>\n' % repr(float(time)))
+      for vf in vfields: self.writeAttribute(fp, timestep+1, timestep, vf[0], '/vertex_fields/'+vf[0], vf[1], vf[2], 'Node', *vf[3:])
+      for cf in cfields: self.writeAttribute(fp, timestep+1, timestep, cf[0], '/cell_fields/'+cf[0], cf[1], cf[2], 'Cell', *cf[3:])
+      self.writeSpaceGridFooter(fp)
+      self.offset = fp.tell()
+      self.writeTimeGridFooter(fp)
+      self.writeFooter(fp)
+      fp.truncate()
+    return
+
+def generateXdmf(hdfFilename, xdmfFilename = None, meshFilename = None):
   """
   Generate Xdmf file from HDF5 file
+
+  If the mesh was written to a separate file (meshFilename) the
+  Xdmf file references the mesh in that file
   """
   import h5py
   import numpy as np
@@ -206,18 +280,22 @@ def generateXdmf(hdfFilename, xdmfFilename = None):
     xdmfFilename = os.path.splitext(hdfFilename)[0] + '.xmf'
   # Read mesh
   h5          = h5py.File(hdfFilename, 'r')
-  if 'viz' in h5 and 'geometry' in h5['viz']:
+  if meshFilename is None:
+    h5mesh    = h5
+  else:
+    h5mesh    = h5py.File(meshFilename, 'r')
+  if 'viz' in h5mesh and 'geometry' in h5mesh['viz']:
     geomPath  = 'viz/geometry'
-    geom      = h5['viz']['geometry']
+    geom      = h5mesh['viz']['geometry']
   else:
     geomPath  = 'geometry'
-    geom      = h5['geometry']
-  if 'viz' in h5 and 'topology' in h5['viz']:
+    geom      = h5mesh['geometry']
+  if 'viz' in h5mesh and 'topology' in h5mesh['viz']:
     topoPath  = 'viz/topology'
-    topo      = h5['viz']['topology']
+    topo      = h5mesh['viz']['topology']
   else:
     topoPath  = 'topology'
-    topo      = h5['topology']
+    topo      = h5mesh['topology']
   vertices    = geom['vertices']
   numVertices = vertices.shape[0]
   spaceDim    = vertices.shape[1]
@@ -235,8 +313,10 @@ def generateXdmf(hdfFilename, xdmfFilename = None):
   if 'cell_fields' in h5: cfields = h5['cell_fields'].items()
 
   # Write Xdmf
-  Xdmf(xdmfFilename).write(hdfFilename, topoPath, numCells, numCorners, cellDim, geomPath, numVertices, spaceDim, time, vfields, cfields)
+  Xdmf(xdmfFilename).write(hdfFilename, topoPath, numCells, numCorners, cellDim, geomPath, numVertices, spaceDim, time, vfields, cfields, meshFilename)
   h5.close()
+  if meshFilename is not None:
+    h5mesh.close()
   return
 
 if __name__ == '__main__':
@@ -22,7 +22,7 @@ try: range = xrange
 except: pass
 
 
-def create_DMPlex_from_points(x, y, bmask=None, refinement_steps=0):
+def create_DMPlex_from_points(x, y, bmask=None, refinement_steps=0, node_weights=None, height=None, overlap=1):
     """
     Triangulates x,y coordinates on rank 0 and creates a PETSc DMPlex object
     from the cells and vertices to distribute among processors.
@@ -39,6 +39,14 @@ def create_DMPlex_from_points(x, y, bmask=None, refinement_steps=0):
         if bmask=None (default) then the convex hull of points is used
      refinement_steps : int
         number of iterations to refine the mesh (default: 0)
+     node_weights : array of floats, shape (n,)
+        (optional) expected work at each point, e.g. a small weight for masked
+        (submarine) points, used to balance the partition
+     height : array of floats, shape (n,)
+        (optional) height of each point, catchments are kept on the same
+        processor where possible (see partition_cells)
+     overlap : int
+        number of rings of cells shared with neighbouring processors (default: 1)
 
     Returns
     -------
@@ -51,6 +59,8 @@ def create_DMPlex_from_points(x, y, bmask=None, refinement_steps=0):
 
      Refinement adds the midpoints of every line segment to the DM.
      Boundary markers are automatically updated with each iteration.
+     The mesh is refined after it is distributed so the root processor
+     only holds the coarse mesh.
 
     """
     from stripy import Triangulation
@@ -86,8 +96,96 @@ def create_DMPlex_from_points(x, y, bmask=None, refinement_steps=0):
         boundary_indices = np.nonzero(~bmask)[0]
         boundary_vertices = points_to_edges(tri, boundary_indices)
 
-    return create_DMPlex(tri.x, tri.y, tri.simplices, boundary_vertices)
+    catchments = None
+    if height is not None:
+        catchments = mesh_catchments(tri.x, tri.y, tri.simplices, height)
 
+    return create_DMPlex(tri.x, tri.y, tri.simplices, boundary_vertices, refinement_steps=refinement_steps,
+                         node_weights=node_weights, catchments=catchments, overlap=overlap, height=height)
+
+
+
+def label_DMPlex_points(dm, label, points, value=1):
+    """
+    Marks DAG points in the DM with a label value in a single operation
+    (the points are added to any that are already marked).
+    The label is created if it does not exist. petsc4py versions without
+    DMLabel (DM.getLabel) mark the points one at a time.
+    """
+    from petsc4py import PETSc
+
+    if not dm.hasLabel(label):
+        dm.createLabel(label)
+
+    points = np.asarray(points, dtype=PETSc.IntType).ravel()
+
+    if not hasattr(dm, "getLabel"):
+        for point in np.unique(points):
+            dm.setLabelValue(label, point, value)
+        return
+
+    dmlabel = dm.getLabel(label)
+
+    if dmlabel.getStratumSize(value) > 0:
+        points = np.hstack([dmlabel.getStratumIS(value).indices, points])
+
+    points = np.unique(points).astype(PETSc.IntType)
+    dmlabel.setStratumIS(value, PETSc.IS().createGeneral(points, comm=PETSc.COMM_SELF))
+
+
+def _get_DMPlex_cones(dm, start, end, size):
+    """
+    Cones of the DAG points start to end (contiguous, size points each), shape (end-start, size).
+    The cones are read in one piece from the cone section if petsc4py provides it
+    (getConeSection and getCones), otherwise one point at a time.
+    """
+    from petsc4py import PETSc
+
+    if hasattr(dm, "getConeSection"):
+        offset = dm.getConeSection().getOffset(start)
+        return dm.getCones()[offset:offset + size*(end - start)].reshape(-1,size)
+
+    cones = np.empty((end - start, size), dtype=PETSc.IntType)
+    for i, point in enumerate(range(start, end)):
+        cones[i] = dm.getCone(point)
+    return cones
+
+
+def get_DMPlex_edge_cones(dm):
+    """
+    Returns the (DAG) vertices of every edge in the DM, shape (nedges, 2)
+    """
+    from petsc4py import PETSc
+
+    eStart, eEnd = dm.getDepthStratum(1) # edges
+
+    if eEnd == eStart:
+        return np.zeros((0,2), dtype=PETSc.IntType)
+
+    # edges are contiguous in the DAG and have two vertices each
+    return _get_DMPlex_cones(dm, eStart, eEnd, 2)
+
+
+def get_DMPlex_cells(dm):
+    """
+    Returns the vertices of every cell in the DM (local point ordering), shape (ncells, 3)
+    """
+    from petsc4py import PETSc
+
+    cStart, cEnd = dm.getHeightStratum(0) # cells
+    eStart, eEnd = dm.getDepthStratum(1)  # edges
+    pStart, pEnd = dm.getDepthStratum(0)  # points
+
+    if cEnd == cStart:
+        return np.zeros((0,3), dtype=PETSc.IntType)
+
+    # the cone of a cell is its three edges
+    cell_edges = _get_DMPlex_cones(dm, cStart, cEnd, 3)
+
+    # each vertex of a cell appears in two of its edges
+    vertices = np.sort(get_DMPlex_edge_cones(dm)[cell_edges - eStart].reshape(-1,6), axis=1)
+
+    return vertices[:,::2] - pStart
 
 
 def set_DMPlex_boundary_points(dm):
@@ -96,19 +194,19 @@ def set_DMPlex_boundary_points(dm):
     marked as "boundary" faces in the DAG then sets them
     as boundaries.
     """
-    pStart, pEnd = dm.getDepthStratum(0) # points
     eStart, eEnd = dm.getDepthStratum(1) # edges
+
+    if dm.getStratumSize('boundary', 1) == 0:
+        return
+
     edgeIS = dm.getStratumIS('boundary', 1)
 
     edge_mask = np.logical_and(edgeIS.indices >= eStart, edgeIS.indices < eEnd)
     boundary_edges = edgeIS.indices[edge_mask]
 
-    # query the DAG for points that join an edge
-    for edge in boundary_edges:
-        vertices = dm.getCone(edge)
-        # mark the boundary points
-        for vertex in vertices:
-            dm.setLabelValue("boundary", vertex, 1)
+    # the DAG vertices of each edge mark the boundary points
+    cones = get_DMPlex_edge_cones(dm)
+    label_DMPlex_points(dm, "boundary", cones[boundary_edges - eStart])
 
 def set_DMPlex_boundary_points_and_edges(dm, boundary_vertices):
     """ Label boundary points and edges """
@@ -119,22 +217,28 @@ def set_DMPlex_boundary_points_and_edges(dm, boundary_vertices):
         raise ValueError("boundary vertices must be of shape (n,2)")
 
     # points in DAG
-    pStart, eEnd = dm.getDepthStratum(0)
+    pStart, pEnd = dm.getDepthStratum(0)
+    eStart, eEnd = dm.getDepthStratum(1)
 
-    # convert to DAG ordering
-    boundary_edges = np.array(boundary_vertices + pStart, dtype=PETSc.IntType)
+    # convert to DAG ordering (only the root processor holds the points of a DM to be distributed)
+    if pEnd == pStart:
+        boundary_vertices = np.empty((0,2))
+    boundary_edges = np.array(boundary_vertices, dtype=PETSc.IntType).reshape(-1,2) + pStart
     boundary_indices = np.array(np.unique(boundary_edges), dtype=PETSc.IntType)
 
-    # mark edges
-    for edge in boundary_edges:
-        # join is the common edge to which they are connected
-        join = dm.getJoin(edge)
-        for j in join:
-            dm.setLabelValue("boundary", j, 1)
+    # find the edges that join each pair of vertices
+    if hasattr(dm, "getConeSection"):
+        npoints = pEnd
+        cones = np.sort(get_DMPlex_edge_cones(dm), axis=1).astype(np.int64)
+        pairs = np.sort(boundary_edges, axis=1).astype(np.int64)
+        edge_mask = np.in1d(cones[:,0] * npoints + cones[:,1], pairs[:,0] * npoints + pairs[:,1])
+        edges = np.nonzero(edge_mask)[0] + eStart
+    else:
+        # without the cone section a join for each boundary edge is cheaper than every edge cone
+        edges = np.array([j for edge in boundary_edges for j in dm.getJoin(edge)], dtype=PETSc.IntType)
 
-    # mark points
-    for ind in boundary_indices:
-        dm.setLabelValue("boundary", ind, 1)
+    # mark edges and points
+    label_DMPlex_points(dm, "boundary", np.hstack([edges, boundary_indices]))
 
 def get_boundary_points(dm):
 
@@ -145,19 +249,16 @@ def get_boundary_points(dm):
     edge_mask = np.logical_and(edgeIS.indices >= eStart, edgeIS.indices < eEnd)
     boundary_edges = edgeIS.indices[edge_mask]
 
-    boundary_vertices = np.empty((boundary_edges.size,2), dtype=PETSc.IntType)
-
     # query the DAG for points that join an edge
-    for idx, edge in enumerate(boundary_edges):
-        boundary_vertices[idx] = dm.getCone(edge)
+    boundary_vertices = get_DMPlex_edge_cones(dm)[boundary_edges - eStart]
 
     # convert to local point ordering
-    boundary_vertices -= pStart
+    boundary_vertices = boundary_vertices - pStart
     return np.unique(boundary_vertices)
 
 
 
-def create_DMPlex_from_hdf5(file):
+def create_DMPlex_from_hdf5(file, overlap=1):
     """
     Creates a DMPlex object from an HDF5 file.
     This is useful for rebuilding a mesh that is saved from a
@@ -167,6 +268,8 @@ def create_DMPlex_from_hdf5(file):
     ----------
      file : string
         point to the location of hdf5 file
+     overlap : int
+        number of rings of cells shared with neighbouring processors (default: 1)
 
     Returns
     -------
@@ -179,6 +282,44 @@ def create_DMPlex_from_hdf5(file):
     """
     from petsc4py import PETSc
 
+    file = str(file)
+    if not file.endswith('.h5'):
+        file += '.h5'
+
+    dm, fields = create_DMPlex_and_fields_from_hdf5(file, [], overlap)
+
+    return dm
+
+
+def create_DMPlex_and_fields_from_hdf5(file, fields, overlap=1):
+    """
+    Creates a DMPlex object and loads fields from an HDF5 file
+    (written by the PETSc HDF5 viewer, e.g. a checkpoint).
+    The mesh and the fields are distributed together so that a run can be
+    restarted on a different number of processors.
+
+    Parameters
+    ----------
+     file : string
+        point to the location of hdf5 file
+     fields : list of strings
+        names of the fields (vectors) saved in the file
+     overlap : int
+        number of rings of cells shared with neighbouring processors (default: 1)
+
+    Returns
+    -------
+     DM : object
+        PETSc DMPlex object
+     fields : dict of ndarrays
+        local values (including shadow nodes) of each field
+
+    Notes
+    -----
+     This function requires petsc4py >= 3.8
+    """
+    from petsc4py import PETSc
+
     file = str(file)
     if not file.endswith('.h5'):
         file += '.h5'
@@ -191,18 +332,50 @@ def create_DMPlex_from_hdf5(file):
     origSect.setUp()
     dm.setDefaultSection(origSect)
 
-    origVec = dm.createGlobalVector()
+    origVec = dm.createLocalVector()
+
+    # the fields are stored in the order of the vertices in the file
+    # which is the order of the undistributed DM. They are loaded into global
+    # vectors and scattered to local vectors, which match the local section
+    # that distributeField expects
+
+    ViewHDF5 = PETSc.Viewer()
+    ViewHDF5.createHDF5(file, mode='r')
+
+    field_vecs = dict()
+    for name in fields:
+        gvec = dm.createGlobalVector()
+        gvec.setName(name)
+        gvec.load(ViewHDF5)
+
+        vec = dm.createLocalVector()
+        dm.globalToLocal(gvec, vec)
+        gvec.destroy()
+        field_vecs[name] = vec
+
+    ViewHDF5.destroy()
 
     if PETSc.COMM_WORLD.size > 1:
         # Distribute to other processors
-        sf = dm.distribute(overlap=1)
+        sf = dm.distribute(overlap=overlap)
         newSect, newVec = dm.distributeField(sf, origSect, origVec)
         dm.setDefaultSection(newSect)
 
-    return dm
+        # the same star forest moves the field values with their vertices
+        for name in fields:
+            fieldSect, fieldVec = dm.distributeField(sf, origSect, field_vecs[name])
+            field_vecs[name].destroy()
+            field_vecs[name] = fieldVec
+
+    local_fields = dict()
+    for name in fields:
+        local_fields[name] = field_vecs[name].array.copy()
+        field_vecs[name].destroy()
+
+    return dm, local_fields
 
 
-def create_DMPlex_from_box(minX, maxX, minY, maxY, resX, resY, refinement=None):
+def create_DMPlex_from_box(minX, maxX, minY, maxY, resX, resY, refinement=None, overlap=1):
     """
     Create a box and fill with triangles up to a specified refinement
     - This only works if PETSc was configured with triangle
@@ -231,7 +404,7 @@ def create_DMPlex_from_box(minX, maxX, minY, maxY, resX, resY, refinement=None):
     origVec = dm.createGlobalVec()
 
     if PETSc.COMM_WORLD.size > 1:
-        sf = dm.distribute(overlap=1)
+        sf = dm.distribute(overlap=overlap)
         newSect, newVec = dm.distributeField(sf, origSect, origVec)
         dm.setDefaultSection(newSect)
 
@@ -258,10 +431,11 @@ def create_DMDA(minX, maxX, minY, maxY, resX, resY):
     return dm
 
 
-def create_DMPlex(x, y, simplices, boundary_vertices=None):
+def create_DMPlex(x, y, simplices, boundary_vertices=None, cell_partition=None, refinement_steps=0,
+                  node_weights=None, catchments=None, overlap=1, height=None):
     """
-    Create a PETSc DMPlex object on root processor
-    and distribute to other processors
+    Create a PETSc DMPlex object on root processor,
+    distribute to other processors and refine the distributed DM
 
     Parameters
     ----------
@@ -270,13 +444,79 @@ def create_DMPlex(x, y, simplices, boundary_vertices=None):
      simplices : connectivity of the mesh
      boundary_vertices : array of ints, shape(l,2)
         (optional) boundary edges
+     cell_partition : array of ints, shape (nprocs,)
+        (optional, root processor) number of cells given to each processor,
+        in the order of simplices, instead of the default partitioner
+     refinement_steps : int
+        number of iterations to refine the mesh after it is distributed (default: 0)
+        the "boundary" and "coarse" labels are inherited by the refined mesh
+     node_weights : array of floats, shape (n,)
+        (optional, root processor) expected work at each point
+     catchments : array of ints, shape (n,)
+        (optional, root processor) catchment of each point, kept on one processor
+        where possible. node_weights and catchments replace the default partitioner
+        with partition_cells.
+     overlap : int
+        number of rings of cells shared with neighbouring processors (default: 1)
+     height : array of floats, shape (n,)
+        (optional, root processor) height of each point, a cell is kept with
+        the catchment of its lowest vertex (see partition_cells)
 
     Returns
     -------
      DM : PETSc DMPlex object
     """
+
+    dm, fields = create_DMPlex_and_fields(x, y, simplices, dict(), boundary_vertices, cell_partition,
+                                          refinement_steps, node_weights, catchments, overlap, height)
+
+    return dm
+
+
+def create_DMPlex_and_fields(x, y, simplices, fields, boundary_vertices=None, cell_partition=None,
+                             refinement_steps=0, node_weights=None, catchments=None, overlap=1, height=None):
+    """
+    Create a PETSc DMPlex object on root processor and distribute it
+    to other processors together with fields defined on its nodes
+
+    Parameters
+    ----------
+     x : array of floats, shape (n,) x coordinates
+     y : array of floats, shape (n,) y coordinates
+     simplices : connectivity of the mesh
+     fields : dict of arrays of floats, shape (n,)
+        (root processor) values of each field, the same keys are required on every processor
+     boundary_vertices : array of ints, shape(l,2)
+        (optional) boundary edges
+     cell_partition : array of ints, shape (nprocs,)
+        (optional, root processor) number of cells given to each processor,
+        in the order of simplices, instead of the default partitioner
+     refinement_steps : int
+        number of iterations to refine the mesh after it is distributed (default: 0)
+        the "boundary" and "coarse" labels are inherited by the refined mesh
+     node_weights : array of floats, shape (n,)
+        (optional, root processor) expected work at each point
+     catchments : array of ints, shape (n,)
+        (optional, root processor) catchment of each point, kept on one processor
+        where possible. node_weights and catchments replace the default partitioner
+        with partition_cells.
+     overlap : int
+        number of rings of cells shared with neighbouring processors (default: 1)
+     height : array of floats, shape (n,)
+        (optional, root processor) height of each point, a cell is kept with
+        the catchment of its lowest vertex (see partition_cells)
+
+    Returns
+    -------
+     DM : PETSc DMPlex object
+     fields : dict of ndarrays
+        local values (including shadow nodes) of each field
+    """
     from petsc4py import PETSc
 
+    if fields and refinement_steps:
+        raise ValueError("Fields cannot be distributed with a mesh that is refined")
+
     if PETSc.COMM_WORLD.rank == 0:
         coords = np.column_stack([x,y])
         cells  = simplices.astype(PETSc.IntType)
@@ -303,8 +543,7 @@ def create_DMPlex(x, y, simplices, boundary_vertices=None):
 
     ## label coarse DM in case it is ever needed again
     pStart, pEnd = dm.getDepthStratum(0)
-    for pt in range(pStart, pEnd):
-        dm.setLabelValue("coarse", pt, 1)
+    label_DMPlex_points(dm, "coarse", np.arange(pStart, pEnd))
 
 
     # define one DoF on the nodes
@@ -315,12 +554,694 @@ def create_DMPlex(x, y, simplices, boundary_vertices=None):
 
     origVec = dm.createGlobalVector()
 
+    field_vecs = dict()
+    for name in fields:
+        vec = dm.createGlobalVector()
+        if PETSc.COMM_WORLD.rank == 0:
+            vec.setArray(np.asarray(fields[name], dtype=PETSc.ScalarType))
+        field_vecs[name] = vec
+
     if PETSc.COMM_WORLD.size > 1:
+        if cell_partition is not None:
+            _set_shell_partition(dm, cell_partition)
+        elif node_weights is not None or catchments is not None:
+            order, sizes = None, None
+            if PETSc.COMM_WORLD.rank == 0:
+                order, sizes = partition_cells(x, y, simplices, PETSc.COMM_WORLD.size,
+                                               node_weights=node_weights, catchments=catchments, height=height)
+            _set_shell_partition(dm, sizes, order)
+
         # Distribute to other processors
-        sf = dm.distribute(overlap=1)
+        sf = dm.distribute(overlap=overlap)
         newSect, newVec = dm.distributeField(sf, origSect, origVec)
         dm.setDefaultSection(newSect)
 
+        # the same star forest moves the field values with their vertices
+        for name in fields:
+            fieldSect, fieldVec = dm.distributeField(sf, origSect, field_vecs[name])
+            field_vecs[name] = fieldVec
+
+    if refinement_steps:
+        # each processor refines its own part of the mesh (and rebuilds the section)
+        dm = refine_DM(dm, refinement_steps)
+
+    local_fields = dict()
+    for name in fields:
+        local_fields[name] = field_vecs[name].array.copy()
+        field_vecs[name].destroy()
+
+    return dm, local_fields
+
+
+def _set_shell_partition(dm, cell_partition, cell_order=None):
+    """
+    Distribute the cells on the root processor in consecutive blocks
+    of cell_partition[p] cells to processor p (in the order of cell_order)
+    """
+    from petsc4py import PETSc
+
+    size = PETSc.COMM_WORLD.size
+    cStart, cEnd = dm.getHeightStratum(0)
+
+    if PETSc.COMM_WORLD.rank == 0:
+        sizes = np.array(cell_partition, dtype=PETSc.IntType)
+        if cell_order is None:
+            points = np.arange(0, cEnd - cStart, dtype=PETSc.IntType)
+        else:
+            points = np.array(cell_order, dtype=PETSc.IntType)
+    else:
+        sizes = np.zeros(size, dtype=PETSc.IntType)
+        points = np.zeros(0, dtype=PETSc.IntType)
+
+    part = dm.getPartitioner()
+    part.setType(PETSc.Partitioner.Type.SHELL)
+    part.setShellPartition(size, sizes, points)
+
+
+def _set_distributed_shell_partition(dm, cell_part):
+    """
+    Send each cell that this processor owns to processor cell_part[c]
+    (cell_part is given for every local cell, the cells in the overlap are ignored)
+    """
+    from petsc4py import PETSc
+
+    size = PETSc.COMM_WORLD.size
+    cStart, cEnd = dm.getHeightStratum(0)
+
+    # the partitioner numbers the cells that are not leaves of the point star forest
+    owned = _owned_points(dm, cStart, cEnd)
+    cell_part = np.asarray(cell_part)[owned]
+
+    sizes = np.bincount(cell_part, minlength=size).astype(PETSc.IntType)
+    points = np.argsort(cell_part, kind='mergesort').astype(PETSc.IntType)
+
+    part = dm.getPartitioner()
+    part.setType(PETSc.Partitioner.Type.SHELL)
+    part.setShellPartition(size, sizes, points)
+
+
+def _owned_points(dm, start, end):
+    """
+    Mask of the points start to end that this processor owns
+    (the points that are not leaves of the point star forest)
+    """
+    from mpi4py import MPI
+
+    owned = np.ones(end - start, dtype=bool)
+
+    # the point SF of a DM that is not distributed has no graph
+    if MPI.COMM_WORLD.size == 1:
+        return owned
+
+    nroots, ilocal, iremote = dm.getPointSF().getGraph()
+    if ilocal is not None and len(ilocal):
+        leaves = np.asarray(ilocal)
+        leaves = leaves[np.logical_and(leaves >= start, leaves < end)]
+        owned[leaves - start] = False
+
+    return owned
+
+
+def _morton_order(x, y, bits=16, extent=None):
+    """
+    Position of points along a Z-order (Morton) curve over the
+    extent (minX, maxX, minY, maxY) (default: the bounding box of the points)
+    """
+    if extent is None:
+        extent = (x.min(), x.max(), y.min(), y.max())
+    minX, maxX, minY, maxY = extent
+
+    scale = (1 << bits) - 1
+    ix = ((x - minX) / max(maxX - minX, 1e-300) * scale).astype(np.uint64)
+    iy = ((y - minY) / max(maxY - minY, 1e-300) * scale).astype(np.uint64)
+
+    code = np.zeros(x.shape, dtype=np.uint64)
+    for b in range(0, bits):
+        code |= ((ix >> np.uint64(b)) & np.uint64(1)) << np.uint64(2*b)
+        code |= ((iy >> np.uint64(b)) & np.uint64(1)) << np.uint64(2*b + 1)
+
+    return code
+
+
+def mesh_catchments(x, y, simplices, height):
+    """
+    Coarse drainage analysis of a triangulation: each point flows to its steepest
+    downhill neighbour and the catchment of a point is the (lowest) point where
+    its flow path ends.
+
+    Returns
+    -------
+     catchments : array of ints, shape (n,)
+        index of the outlet (or internal low point) of each point
+    """
+    npoints = x.size
+    height = np.asarray(height, dtype=np.float64)
+
+    edges = np.vstack((simplices[:,[0,1]], simplices[:,[1,2]], simplices[:,[0,2]]))
+    edges = np.vstack((edges, edges[:,::-1]))
+
+    slope = (height[edges[:,1]] - height[edges[:,0]]) / np.hypot(x[edges[:,1]] - x[edges[:,0]],
+                                                                  y[edges[:,1]] - y[edges[:,0]])
+
+    # steepest descent neighbour (or the point itself if it is a low point)
+    order = np.lexsort((slope, edges[:,0]))
+    first = np.ones(order.size, dtype=bool)
+    first[1:] = edges[order[1:],0] != edges[order[:-1],0]
+    steepest = order[first]
+
+    receiver = np.arange(npoints)
+    downhill = slope[steepest] < 0.0
+    receiver[edges[steepest[downhill],0]] = edges[steepest[downhill],1]
+
+    # follow the flow paths to the end by pointer jumping
+    for its in range(0, 64):
+        next_receiver = receiver[receiver]
+        if np.array_equal(next_receiver, receiver):
+            break
+        receiver = next_receiver
+
+    return receiver
+
+
+def partition_cells(x, y, simplices, nparts, node_weights=None, catchments=None, tolerance=0.1, height=None):
+    """
+    Weighted partition of the cells of a triangulation that keeps catchments together.
+
+    The cells are ordered along a space-filling curve, catchment by catchment, and cut into
+    nparts blocks of equal weight (the mean weight of the nodes of each cell). A cut is moved
+    to the nearest boundary between catchments if that changes the weight of the block by
+    less than the tolerance, so only catchments that are too large for one processor are split.
+
+    Parameters
+    ----------
+     x, y : arrays of floats, shape (n,)
+     simplices : array of ints, shape (m,3)
+     nparts : int
+     node_weights : array of floats, shape (n,) (default: 1.0)
+     catchments : array of ints, shape (n,) (optional)
+     tolerance : float
+        fraction of the weight of a block a cut can be moved
+     height : array of floats, shape (n,) (optional)
+        a cell belongs to the catchment of its lowest vertex
+        (of its first vertex if the height is not given)
+
+    Returns
+    -------
+     order : array of ints, shape (m,)
+        cells in order of their partition
+     sizes : array of ints, shape (nparts,)
+        number of cells in each partition
+    """
+    ncells = simplices.shape[0]
+
+    if node_weights is None:
+        node_weights = np.ones(x.size)
+    weights = np.asarray(node_weights, dtype=np.float64)[simplices].mean(axis=1)
+
+    cx = x[simplices].mean(axis=1)
+    cy = y[simplices].mean(axis=1)
+    curve = _morton_order(cx, cy)
+
+    if catchments is None:
+        order = np.argsort(curve)
+        cell_catchment = np.zeros(ncells, dtype=int)
+    else:
+        # catchment of the lowest vertex of each cell
+        catchments = np.asarray(catchments)
+        if height is None:
+            lowest = simplices[:,0]
+        else:
+            lowest = simplices[np.arange(ncells), np.argmin(np.asarray(height)[simplices], axis=1)]
+        cell_catchment = catchments[lowest]
+
+        # catchments in the order of their (mean) position along the curve
+        unique, inverse = np.unique(cell_catchment, return_inverse=True)
+        position = np.bincount(inverse, weights=curve.astype(np.float64)) / np.bincount(inverse)
+        rank = np.empty(unique.size, dtype=int)
+        rank[np.argsort(position)] = np.arange(unique.size)
+
+        order = np.lexsort((curve, rank[inverse]))
+
+    cumulative = np.cumsum(weights[order])
+    total = cumulative[-1]
+    target = total / nparts
+
+    changes = np.nonzero(cell_catchment[order][1:] != cell_catchment[order][:-1])[0] + 1
+
+    cuts = [0]
+    for k in range(1, nparts):
+        ideal = k * target
+        cut = int(np.searchsorted(cumulative, ideal))
+
+        if changes.size:
+            i = np.searchsorted(changes, cut)
+            candidates = changes[max(i-1, 0):i+1]
+            best = candidates[np.argmin(np.abs(cumulative[candidates-1] - ideal))]
+            if abs(cumulative[best-1] - ideal) <= tolerance * target:
+                cut = int(best)
+
+        cuts.append(min(max(cut, cuts[-1]), ncells))
+
+    cuts.append(ncells)
+    sizes = np.diff(cuts)
+
+    return order, sizes
+
+
+def partition_distributed_cells(x, y, weights, nparts, bits=16):
+    """
+    Weighted partition of cells that are distributed among the processors.
+
+    The cells are ordered along a space-filling curve over the extent of all cells and
+    cut into nparts blocks of equal weight. The position of each cut along the curve is
+    found by bisection, with one reduction of the weight below every cut per bit, so no
+    processor needs the cells of the others. Collective.
+
+    Parameters
+    ----------
+     x, y : arrays of floats, shape (m,)
+        centroids of the local cells
+     weights : array of floats, shape (m,)
+        work of each local cell (zero for cells that are counted by another processor)
+     nparts : int
+     bits : int, resolution of the curve in each direction
+
+    Returns
+    -------
+     part : array of ints, shape (m,)
+        partition of each local cell
+    """
+    from mpi4py import MPI
+    comm = MPI.COMM_WORLD
+
+    bounds = np.array([np.inf, np.inf, -np.inf, -np.inf])
+    if x.size:
+        bounds = np.array([-x.min(), -y.min(), x.max(), y.max()])
+    comm.Allreduce(MPI.IN_PLACE, bounds, op=MPI.MAX)
+    extent = (-bounds[0], bounds[2], -bounds[1], bounds[3])
+
+    curve = _morton_order(x, y, bits, extent)
+    order = np.argsort(curve)
+    curve = curve[order]
+    cumulative = np.hstack([0.0, np.cumsum(np.asarray(weights, dtype=np.float64)[order])])
+
+    total = np.array(cumulative[-1])
+    comm.Allreduce(MPI.IN_PLACE, total, op=MPI.SUM)
+    target = total * np.arange(1, nparts) / nparts
+
+    # smallest position along the curve with at least the target weight below it
+    lo = np.zeros(nparts - 1, dtype=np.uint64)
+    hi = np.full(nparts - 1, np.uint64(1) << np.uint64(2*bits), dtype=np.uint64)
+    for b in range(0, 2*bits + 1):
+        mid = lo + (hi - lo) // np.uint64(2)
+        below = cumulative[np.searchsorted(curve, mid)]
+        comm.Allreduce(MPI.IN_PLACE, below, op=MPI.SUM)
+        enough = below >= target
+        hi = np.where(enough, mid, hi)
+        lo = np.where(enough, lo, mid + np.uint64(1))
+
+    part = np.empty(x.size, dtype=int)
+    part[order] = np.searchsorted(hi, curve, side='right')
+
+    return part
+
+
+def resolve_cocircular_triangles(x, y, simplices, tolerance=1.0e-10):
+    """
+    Choose the same Delaunay triangles for cocircular points (e.g. a regular grid)
+    whatever order the points were triangulated in.
+
+    The Delaunay triangulation is not unique where four or more points lie on a
+    circle. The shared edge of two neighbouring triangles with cocircular vertices
+    (within tolerance) is flipped until it joins the lowest of the four vertices
+    (smallest x, then y). Each set of cocircular points is then triangulated as a
+    fan from its lowest vertex, which only depends on the coordinates.
+
+    Parameters
+    ----------
+     x : array of floats, shape (n,)
+     y : array of floats, shape (n,)
+     simplices : array of ints, shape (ntri, 3)
+        Delaunay triangulation of the points
+     tolerance : float
+        relative tolerance of the incircle test
+
+    Returns
+    -------
+     simplices : array of ints, shape (ntri, 3)
+    """
+    simplices = np.array(simplices)
+    ntri = simplices.shape[0]
+    rows = np.arange(0, ntri*3).reshape(-1,1)
+
+    for its in range(0, ntri+1):
+
+        # edge (a, b) of triangle t opposite vertex c
+        t = np.tile(np.arange(0, ntri), 3)
+        a = simplices[:,[1,2,0]].T.ravel()
+        b = simplices[:,[2,0,1]].T.ravel()
+        c = simplices.T.ravel()
+
+        key = np.minimum(a, b) * x.size + np.maximum(a, b)
+        order = np.argsort(key, kind='mergesort')
+        shared = key[order[1:]] == key[order[:-1]]
+        e1, e2 = order[:-1][shared], order[1:][shared]
+
+        quad = np.column_stack((a[e1], b[e1], c[e1], c[e2]))
+        qx, qy = x[quad], y[quad]
+
+        # incircle test from the lowest vertex, in the same order on every processor
+        lex = np.lexsort((qy, qx), axis=-1)
+        r = rows[:quad.shape[0]]
+        dx = qx[r, lex[:,1:]] - qx[r, lex[:,:1]]
+        dy = qy[r, lex[:,1:]] - qy[r, lex[:,:1]]
+        w = dx**2 + dy**2
+
+        det = dx[:,0] * (dy[:,1]*w[:,2] - w[:,1]*dy[:,2]) \
+            - dy[:,0] * (dx[:,1]*w[:,2] - w[:,1]*dx[:,2]) \
+            + w[:,0]  * (dx[:,1]*dy[:,2] - dy[:,1]*dx[:,2])
+
+        lowest = quad[r[:,0], lex[:,0]]
+        flip = np.logical_and(np.abs(det) <= tolerance * w.max(axis=1)**2,
+                              np.logical_or(lowest == quad[:,2], lowest == quad[:,3]))
+
+        if not flip.any():
+            break
+
+        # flip edges that do not share a triangle
+        used = np.zeros(ntri, dtype=bool)
+        for i in np.nonzero(flip)[0]:
+            t1, t2 = t[e1[i]], t[e2[i]]
+            if used[t1] or used[t2]:
+                continue
+            used[t1] = used[t2] = True
+            qa, qb, qc, qd = quad[i]
+            simplices[t1] = qc, qa, qd
+            simplices[t2] = qd, qb, qc
+
+    return simplices
+
+
+def create_DMPlex_from_points_parallel(x, y, bmask=None, halo=4.0, max_its=8, refinement_steps=0, overlap=1,
+                                       scratch_file=None):
+    """
+    Triangulates x,y coordinates in parallel and creates a PETSc DMPlex object.
+
+    The points are partitioned into strips along the longest side of the domain with
+    an equal number of points on each processor. Each processor triangulates its strip
+    with a halo of points from the neighbouring strips and keeps the triangles with their
+    centroid in its strip. The halo is widened until the circumcircle of every triangle
+    that is kept lies inside the strip and its halo (the Delaunay triangulation of the
+    strip is then the same as the global triangulation), except for triangles on the hull
+    of all the points. Cocircular points are triangulated the same way on every processor
+    (see resolve_cocircular_triangles), so neighbouring strips agree on the triangles they share.
+
+    Each processor writes its cells and vertices to scratch_file (/viz/topology/cells and
+    /geometry/vertices, the layout read by the PETSc XDMF loader), then the DMPlex is loaded
+    from it in parallel and distributed, so no processor holds the whole mesh.
+
+    Parameters
+    ----------
+     x : array of floats, shape (n,)
+        x coordinates of any subset of the points on each processor
+     y : array of floats, shape (n,)
+        y coordinates
+     bmask : array of bools, shape (n,)
+        boundary mask where points along the boundary
+        equal False, and the interior equal True
+        if bmask=None (default) then the convex hull of points is used
+     halo : float
+        initial width of the halo in units of the average point spacing
+     max_its : int
+        number of times the halo can be doubled
+     refinement_steps : int
+        number of iterations to refine the distributed mesh (default: 0)
+     overlap : int
+        number of rings of cells shared with neighbouring processors (default: 1)
+     scratch_file : string
+        HDF5 file on a file system shared by all processors that holds the cells
+        while the DM is loaded, removed afterwards (default: a temporary file in
+        tempfile.gettempdir(), which must be shared when the processors are on more than one node)
+
+    Returns
+    -------
+     DM : object
+        PETSc DMPlex object
+
+    Notes
+    -----
+     petsc4py does not provide the parallel version of createFromCellList, the
+     parallel HDF5 loader of DMPlex is used instead (PETSc >= 3.13).
+    """
+    import os
+    from mpi4py import MPI
+    from petsc4py import PETSc
+    from scipy.spatial import cKDTree
+    from stripy import Triangulation
+
+    comm = MPI.COMM_WORLD
+    size = comm.size
+    rank = comm.rank
+
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    if bmask is None:
+        b = np.ones(x.size)
+    else:
+        b = np.asarray(bmask, dtype=np.float64)
+
+    npoints = comm.allreduce(x.size, op=MPI.SUM)
+    minX = comm.allreduce(x.min() if x.size else np.inf, op=MPI.MIN)
+    maxX = comm.allreduce(x.max() if x.size else -np.inf, op=MPI.MAX)
+    minY = comm.allreduce(y.min() if y.size else np.inf, op=MPI.MIN)
+    maxY = comm.allreduce(y.max() if y.size else -np.inf, op=MPI.MAX)
+
+    axis = 0 if (maxX - minX) >= (maxY - minY) else 1
+    points = np.column_stack((x, y, b))
+
+    # strips with an equal number of points from a weighted sample
+
+    coord = np.sort(points[:,axis])
+    nsample = min(coord.size, 1000)
+    sample = coord[np.linspace(0, coord.size-1, nsample).astype(int)] if nsample else np.zeros(0)
+    list_of_samples = comm.allgather((sample, float(coord.size) / max(nsample, 1)))
+
+    sample = np.hstack([s[0] for s in list_of_samples])
+    weight = np.hstack([np.ones(s[0].size) * s[1] for s in list_of_samples])
+    order = np.argsort(sample)
+    cumulative = np.cumsum(weight[order])
+    quantiles = np.searchsorted(cumulative, np.arange(1, size) * float(npoints) / size)
+    splits = np.hstack(([minX, minY][axis], sample[order][np.minimum(quantiles, sample.size-1)], np.inf))
+
+    def strip_of(c):
+        return np.clip(np.searchsorted(splits[1:-1], c, side='right'), 0, size-1)
+
+    dest = strip_of(points[:,axis])
+    received = comm.alltoall([points[dest == p] for p in range(0, size)])
+    points = np.vstack(received)
+
+    # global numbering of the points in strip order
+
+    nlocal = points.shape[0]
+    offset = comm.scan(nlocal) - nlocal
+    gids = np.arange(offset, offset + nlocal)
+
+    lo, hi = splits[rank], splits[rank+1]
+    width = halo * np.sqrt((maxX - minX) * (maxY - minY) / npoints)
+
+    for its in range(0, max_its+1):
+
+        # halo points from the neighbouring strips
+
+        send = []
+        for p in range(0, size):
+            if p == rank:
+                send.append(np.zeros((0,4)))
+                continue
+            c = points[:,axis]
+            near = np.logical_and(c >= splits[p] - width, c < splits[p+1] + width)
+            send.append(np.column_stack((points[near], gids[near])))
+
+        halo_points = np.vstack(comm.alltoall(send))
+
+        lpoints = np.vstack((points, halo_points[:,:3]))
+        lgids = np.hstack((gids, halo_points[:,3].astype(int)))
+
+        shuffle = np.random.permutation(lpoints.shape[0])
+        tri = Triangulation(lpoints[shuffle,0], lpoints[shuffle,1], permute=False)
+        simplices = resolve_cocircular_triangles(lpoints[:,0], lpoints[:,1], shuffle[tri.simplices])
+
+        # edges of the strip hull that are on the hull of all the points
+
+        hull = shuffle[tri.convex_hull()]
+        hull_edges = np.sort(np.column_stack((hull, np.roll(hull, -1))), axis=1)
+
+        candidates = np.vstack(comm.allgather(lpoints[hull,:2]))
+        p = lpoints[hull_edges[:,0],:2]
+        q = lpoints[hull_edges[:,1],:2]
+        side = (q[:,0:1] - p[:,0:1]) * (candidates[:,1] - p[:,1:2]) - \
+               (q[:,1:2] - p[:,1:2]) * (candidates[:,0] - p[:,0:1])
+        tolerance = 1.0e-10 * np.hypot(q[:,0] - p[:,0], q[:,1] - p[:,1]).reshape(-1,1) * \
+                    max(maxX - minX, maxY - minY)
+        global_hull = np.logical_or(np.all(side >= -tolerance, axis=1), np.all(side <= tolerance, axis=1))
+        hull_edges = hull_edges[global_hull]
+
+        # triangles with their centroid in this strip
+
+        corners = lpoints[simplices,:2]
+        centroid = np.sort(corners[:,:,axis], axis=1).sum(axis=1) / 3.0
+        owned = np.logical_and(centroid >= lo, centroid < hi)
+
+        # circumcircles must lie in the strip and halo (or outside the domain)
+
+        ax, ay = corners[:,0,0], corners[:,0,1]
+        bx, by = corners[:,1,0] - ax, corners[:,1,1] - ay
+        cx, cy = corners[:,2,0] - ax, corners[:,2,1] - ay
+        d = 2.0 * (bx*cy - by*cx)
+        ux = (cy*(bx**2 + by**2) - by*(cx**2 + cy**2)) / d
+        uy = (bx*(cx**2 + cy**2) - cx*(bx**2 + by**2)) / d
+        radius = np.hypot(ux, uy)
+        centre = [ax + ux, ay + uy][axis]
+
+        domain_min, domain_max = [minX, minY][axis], [maxX, maxY][axis]
+        inside = np.logical_and(np.logical_or(centre - radius >= lo - width, centre - radius <= domain_min),
+                                np.logical_or(centre + radius <= hi + width, centre + radius >= domain_max))
+
+        edges = np.sort(np.vstack((simplices[:,[0,1]], simplices[:,[1,2]], simplices[:,[0,2]])), axis=1)
+        on_hull = np.in1d(edges[:,0] * lpoints.shape[0] + edges[:,1],
+                          hull_edges[:,0] * lpoints.shape[0] + hull_edges[:,1])
+        on_hull = on_hull.reshape(3,-1).any(axis=0)
+
+        failed = np.logical_and(owned, np.logical_and(~inside, ~on_hull)).any()
+        if not comm.allreduce(failed, op=MPI.LOR):
+            break
+
+        width *= 2.0
+
+    cells = simplices[owned]
+
+    # boundary edges of the triangles that are kept
+
+    if bmask is None:
+        cell_edges = np.sort(np.vstack((cells[:,[0,1]], cells[:,[1,2]], cells[:,[0,2]])), axis=1)
+        key = cell_edges[:,0] * lpoints.shape[0] + cell_edges[:,1]
+        boundary = cell_edges[np.in1d(key, hull_edges[:,0] * lpoints.shape[0] + hull_edges[:,1])]
+    else:
+        cell_edges = np.vstack((cells[:,[0,1]], cells[:,[1,2]], cells[:,[0,2]]))
+        boundary = cell_edges[np.logical_and(lpoints[cell_edges[:,0],2] == 0, lpoints[cell_edges[:,1],2] == 0)]
+
+    # cells (global vertex numbers) and vertices (in global order) written collectively
+
+    if scratch_file is None:
+        if rank == 0:
+            import tempfile
+            fd, scratch_file = tempfile.mkstemp(suffix='.h5', prefix='quagmire_mesh_', dir=tempfile.gettempdir())
+            os.close(fd)
+        scratch_file = comm.bcast(scratch_file, root=0)
+
+    try:
+        dm = _load_DMPlex_cells(points[:,:2], lgids[cells], scratch_file)
+    finally:
+        if rank == 0 and os.path.exists(scratch_file):
+            os.remove(scratch_file)
+
+    if dm.getDepth() < 2:
+        dm.interpolate()
+
+    if size > 1:
+        dm.distribute(overlap=overlap)
+
+    # boundary edges are found by their coordinates on the processors with the edge
+    # in the bounding box of their vertices (the partition of the DM is not the strips)
+
+    coords = dm.getCoordinatesLocal().array.reshape(-1,2)
+    if coords.shape[0]:
+        box = np.hstack((coords.min(axis=0), coords.max(axis=0)))
+    else:
+        box = np.array((np.inf, np.inf, -np.inf, -np.inf))
+    boxes = comm.allgather(box)
+
+    edge_coords = lpoints[boundary,:2].reshape(-1,4)
+    send = []
+    for box in boxes:
+        in_box = np.ones(edge_coords.shape[0], dtype=bool)
+        for i in range(0, 4):
+            in_box = np.logical_and(in_box, edge_coords[:,i] >= box[i % 2])
+            in_box = np.logical_and(in_box, edge_coords[:,i] <= box[2 + i % 2])
+        send.append(edge_coords[in_box])
+    boundary_coords = np.vstack(comm.alltoall(send))
+
+    boundary_vertices = np.zeros((0,2), dtype=int)
+    if coords.shape[0] and boundary_coords.shape[0]:
+        distance, vertex = cKDTree(coords).query(boundary_coords.reshape(-1,2))
+        found = (distance == 0.0).reshape(-1,2).all(axis=1)
+        boundary_vertices = vertex.reshape(-1,2)[found]
+
+    dm.createLabel("boundary")
+    dm.createLabel("coarse")
+    set_DMPlex_boundary_points_and_edges(dm, boundary_vertices)
+
+    pStart, pEnd = dm.getDepthStratum(0)
+    label_DMPlex_points(dm, "coarse", np.arange(pStart, pEnd))
+
+    # one DoF on the nodes (and refinement of the distributed mesh)
+    return refine_DM(dm, refinement_steps)
+
+
+def _load_DMPlex_cells(coords, cells, scratch_file):
+    """
+    Writes the vertex coordinates (in global order) and cells (global vertex numbers) of each processor
+    collectively to scratch_file and loads a DMPlex from it in parallel (collective)
+    """
+    from mpi4py import MPI
+    from petsc4py import PETSc
+
+    comm = MPI.COMM_WORLD
+
+    vertices = PETSc.Vec().create(comm=PETSc.COMM_WORLD)
+    vertices.setSizes((2*coords.shape[0], PETSc.DECIDE))
+    vertices.setBlockSize(2)
+    vertices.setUp()
+    vertices.setArray(np.ascontiguousarray(coords, dtype=PETSc.ScalarType).ravel())
+    vertices.setName("vertices")
+
+    topology = PETSc.IS().createGeneral(cells.astype(PETSc.IntType).ravel(), comm=PETSc.COMM_WORLD)
+    topology.setBlockSize(3)
+    topology.setName("cells")
+
+    ViewHDF5 = PETSc.Viewer()
+    ViewHDF5.createHDF5(scratch_file, mode='w')
+    ViewHDF5.pushGroup("/geometry")
+    ViewHDF5.view(obj=vertices)
+    ViewHDF5.popGroup()
+    ViewHDF5.pushGroup("/viz/topology")
+    ViewHDF5.view(obj=topology)
+    ViewHDF5.popGroup()
+    ViewHDF5.destroy()
+    vertices.destroy()
+    topology.destroy()
+
+    comm.barrier()
+
+    if comm.rank == 0:
+        import h5py
+        with h5py.File(scratch_file, 'r+') as h5:
+            h5['viz/topology/cells'].attrs['cell_dim'] = 2
+
+    comm.barrier()
+
+    # each processor reads a block of cells and the partitioner redistributes them
+
+    ViewHDF5 = PETSc.Viewer()
+    ViewHDF5.createHDF5(scratch_file, mode='r')
+    ViewHDF5.pushFormat(PETSc.Viewer.Format.HDF5_XDMF)
+    dm = PETSc.DMPlex().create(comm=PETSc.COMM_WORLD)
+    dm.load(ViewHDF5)
+    ViewHDF5.popFormat()
+    ViewHDF5.destroy()
+
+    comm.barrier()
+
     return dm
 
 
@@ -346,7 +1267,9 @@ def refine_DM(dm, refinement_steps=1):
     """
     Refine DM a specified number of refinement steps
     For each step, the midpoint of every line segment is added
-    to the DM.
+    to the DM. The DM can be distributed: each processor refines
+    its own cells (including the overlap) and the labels are inherited
+    by the new points.
     """
 
     for i in range(0, refinement_steps):
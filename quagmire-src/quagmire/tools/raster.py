@@ -0,0 +1,419 @@
+"""
+Copyright 2016-2017 Louis Moresi, Ben Mather, Romain Beucher
+
+This file is part of Quagmire.
+
+Quagmire is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or any later version.
+
+Quagmire is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with Quagmire.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+
+def open_raster(file, shape=None, dtype='f4', dataset=None, offset=0):
+    """
+    Opens a raster without reading it into memory. Only the parts of the
+    raster that are sliced from the returned object are read from disk.
+
+    Parameters
+    ----------
+     file : string
+        .npy file (memory mapped), .h5 / .hdf5 file (h5py dataset)
+        or a raw binary file (memory mapped)
+     shape : tuple (rows, columns)
+        required for raw binary files
+     dtype : numpy dtype of a raw binary file
+     dataset : string
+        name of the dataset in an HDF5 file
+     offset : int
+        header bytes to skip in a raw binary file
+
+    Returns
+    -------
+     raster : array-like object, shape (rows, columns)
+        an HDF5 dataset keeps its file open until raster.file.close()
+        (sample_raster closes the files it opens)
+    """
+
+    file = str(file)
+
+    if file.endswith('.npy'):
+        return np.load(file, mmap_mode='r')
+
+    if file.endswith('.h5') or file.endswith('.hdf5'):
+        import h5py
+        if dataset is None:
+            raise ValueError("Provide the name of the dataset in {}".format(file))
+        return h5py.File(file, 'r')[dataset]
+
+    if shape is None:
+        raise ValueError("Provide the shape of the raw raster {}".format(file))
+
+    return np.memmap(file, dtype=dtype, mode='r', offset=offset, shape=tuple(shape))
+
+
+def _close_raster(raster):
+    """ Close the file behind a raster from open_raster (HDF5 datasets) """
+    h5file = getattr(raster, 'file', None)
+    if h5file is not None and hasattr(h5file, 'close'):
+        h5file.close()
+
+
+def raster_coordinates(shape, extent, x, y):
+    """
+    Fractional (row, column) image coordinates of points in a raster that covers extent.
+    The first row of the raster is the top (maxY) of the extent.
+
+    Parameters
+    ----------
+     shape : tuple (rows, columns)
+     extent : tuple (minX, maxX, minY, maxY)
+     x, y : ndarrays of floats, shape (n,)
+
+    Returns
+    -------
+     im_coords : ndarray of floats, shape (2,n)
+    """
+    minX, maxX, minY, maxY = extent
+
+    rows = shape[0] - (y - minY) * shape[0] / (maxY - minY)
+    cols = (x - minX) * shape[1] / (maxX - minX)
+
+    return np.vstack((rows, cols))
+
+
+def sample_raster(raster, extent, x, y, order=3, halo=4, mode='nearest', **kwargs):
+    """
+    Samples a raster at points (e.g. the local nodes of the mesh) reading only the
+    window of the raster that contains the points and a halo of pixels around it.
+    Each processor therefore reads a tile proportional to its own partition.
+
+    The halo keeps the spline interpolation (order > 1) close to the
+    interpolation of the whole raster away from the edge of the window.
+
+    Parameters
+    ----------
+     raster : array-like object or string
+        raster from open_raster (or any array that can be sliced),
+        or a file name that is passed to open_raster with kwargs
+     extent : tuple (minX, maxX, minY, maxY)
+        coordinates covered by the raster
+     x, y : ndarrays of floats, shape (n,)
+     order : order of the spline interpolation (scipy.ndimage.map_coordinates)
+     halo : int, number of pixels around the window
+     mode : treatment of points outside the raster (scipy.ndimage.map_coordinates)
+
+    Returns
+    -------
+     values : ndarray of floats, shape (n,)
+
+    Usage
+    -----
+     height = sample_raster("dem.npy", (minX, maxX, minY, maxY), mesh.coords[:,0], mesh.coords[:,1])
+    """
+    from scipy import ndimage
+
+    if isinstance(raster, str):
+        raster = open_raster(raster, **kwargs)
+        try:
+            return sample_raster(raster, extent, x, y, order=order, halo=halo, mode=mode)
+        finally:
+            _close_raster(raster)
+
+    x = np.asarray(x)
+    y = np.asarray(y)
+
+    if x.size == 0:
+        return np.zeros(0)
+
+    shape = raster.shape[0], raster.shape[1]
+    im_coords = raster_coordinates(shape, extent, x, y)
+
+    r0 = int(np.clip(np.floor(im_coords[0].min()) - halo, 0, shape[0]-1))
+    r1 = int(np.clip(np.ceil(im_coords[0].max()) + halo + 1, r0+1, shape[0]))
+    c0 = int(np.clip(np.floor(im_coords[1].min()) - halo, 0, shape[1]-1))
+    c1 = int(np.clip(np.ceil(im_coords[1].max()) + halo + 1, c0+1, shape[1]))
+
+    tile = np.asarray(raster[r0:r1, c0:c1], dtype=np.float64)
+
+    im_coords[0] -= r0
+    im_coords[1] -= c0
+
+    return ndimage.map_coordinates(tile, im_coords, order=order, mode=mode)
+
+
+def _triangle_cells(points, simplices, extent, shape, tolerance=1.0e-10):
+    """
+    Raster cells within each triangle and the barycentric weights of its vertices.
+    Cells on a shared edge are found in both triangles (within tolerance).
+
+    Every cell in the bounding box of a triangle (with a margin of a cell) is tested, so the
+    work and the temporary arrays are proportional to the total area of the bounding boxes:
+    about twice the number of cells when the cells are small compared to the triangles, and
+    at least 4 candidates per triangle when the raster is coarser than the mesh. This replaces
+    the point location in the stripy triangulation (containing_simplex_and_bcc), which walks
+    its own triangles and cannot use the resolved (cocircular) simplices.
+
+    Returns
+    -------
+     cells : ndarray of ints, shape (m,), row * columns + column
+     triangles : ndarray of ints, shape (m,), triangle that contains each cell
+     bcc : ndarray of floats, shape (m,3)
+    """
+    minX, maxX, minY, maxY = extent
+    nrows, ncols = shape
+    dx = (maxX - minX) / ncols
+    dy = (maxY - minY) / nrows
+
+    px = points[simplices,0]
+    py = points[simplices,1]
+
+    # candidate cells in the bounding box of each triangle (with a margin of a cell)
+
+    c0 = np.clip(np.floor((px.min(axis=1) - minX) / dx), 0, ncols).astype(int)
+    c1 = np.clip(np.ceil((px.max(axis=1) - minX) / dx) + 1, 0, ncols).astype(int)
+    r0 = np.clip(np.floor(nrows - (py.max(axis=1) - minY) / dy), 0, nrows).astype(int)
+    r1 = np.clip(np.ceil(nrows - (py.min(axis=1) - minY) / dy) + 1, 0, nrows).astype(int)
+
+    nc = np.maximum(c1 - c0, 0)
+    count = nc * np.maximum(r1 - r0, 0)
+
+    t = np.repeat(np.arange(0, simplices.shape[0]), count)
+    k = np.arange(0, count.sum()) - np.repeat(np.cumsum(count) - count, count)
+    rows = r0[t] + k // nc[t]
+    cols = c0[t] + k % nc[t]
+
+    x = minX + cols * dx
+    y = minY + (nrows - rows) * dy
+
+    # barycentric coordinates
+
+    v0x, v0y = px[t,1] - px[t,0], py[t,1] - py[t,0]
+    v1x, v1y = px[t,2] - px[t,0], py[t,2] - py[t,0]
+    v2x, v2y = x - px[t,0], y - py[t,0]
+    det = v0x * v1y - v1x * v0y
+
+    l1 = (v2x * v1y - v1x * v2y) / det
+    l2 = (v0x * v2y - v2x * v0y) / det
+    bcc = np.column_stack((1.0 - l1 - l2, l1, l2))
+
+    inside = np.all(bcc >= -tolerance, axis=1)
+
+    return (rows * ncols + cols)[inside], t[inside], bcc[inside]
+
+
+class MeshRasteriser(object):
+    """
+    Resamples fields on a TriMesh onto a regular raster.
+
+    The triangle that contains each cell of the raster and the barycentric weights of its
+    vertices are found once (a scan of the cells in the bounding box of each triangle) and
+    stored as a sparse matrix, so every subsequent export is a sparse matrix-vector product
+    on each processor.
+    The rows of the raster are divided into contiguous blocks, one per processor. Every processor
+    finds the cells within the triangles of its local mesh and sends them to the processors that
+    hold their rows, which assign each cell once, preferring a processor that owns the triangle
+    (a triangle belongs to the owner of its vertex with the lowest global index), so the
+    raster has no gaps or overlaps between processors and no processor holds more than its
+    own block. The raster uses the same convention as sample_raster (the first row is the
+    top of the extent) and cells outside the mesh are NaN.
+
+    Parameters
+    ----------
+     mesh : TriMesh object
+     extent : tuple (minX, maxX, minY, maxY)
+     shape : tuple (rows, columns)
+
+    Usage
+    -----
+     raster = MeshRasteriser(mesh, (minX, maxX, minY, maxY), (512, 512))
+     block = raster.rasterise(mesh.height)   # rows raster.rows[0] to raster.rows[1] on each processor
+     raster.save_to_hdf5("rasters.h5", height=mesh.height, area=upstream_area)
+    """
+    def __init__(self, mesh, extent, shape):
+        from mpi4py import MPI
+        from scipy.sparse import csr_matrix
+        from meshtools import resolve_cocircular_triangles
+        from time import clock
+
+        t = clock()
+
+        self.mesh = mesh
+        self.comm = MPI.COMM_WORLD
+        self.extent = extent
+        self.shape = int(shape[0]), int(shape[1])
+
+        size, rank = self.comm.size, self.comm.rank
+        nrows, ncols = self.shape
+
+        # block of rows of each processor
+
+        blocks = np.arange(0, size+1)
+        row_start = blocks * (nrows // size) + np.minimum(blocks, nrows % size)
+        self.rows = int(row_start[rank]), int(row_start[rank+1])
+
+        # local triangles (the same triangles as the neighbouring processors
+        # where the points are cocircular)
+
+        points = mesh.tri.points
+        simplices = resolve_cocircular_triangles(mesh.tri.x, mesh.tri.y, mesh.tri.simplices)
+
+        global_index = mesh.lgmap_col.indices
+        lowest = simplices[np.arange(simplices.shape[0]), np.argmin(global_index[simplices], axis=1)]
+        owned = mesh.lgmap_row.indices[lowest] >= 0
+
+        # raster cells within the local triangles (once each, in an owned triangle if possible)
+
+        cells, triangles, bcc = _triangle_cells(points, simplices, extent, self.shape)
+        priority = np.where(owned[triangles], 0, 1)
+
+        order = np.lexsort((priority, cells))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = cells[order[1:]] != cells[order[:-1]]
+        order = order[first]
+
+        # in the order of the processor that holds the row of each cell
+
+        home = np.searchsorted(row_start, cells[order] // ncols, side='right') - 1
+        order = order[np.argsort(home, kind='mergesort')]
+        home = np.sort(home)
+        cells, triangles, bcc, priority = cells[order], triangles[order], bcc[order], priority[order]
+
+        # each cell is kept by one processor (the lowest priority, then the lowest rank),
+        # decided by the processor that holds its row
+
+        sections = np.cumsum(np.bincount(home, minlength=size))[:-1]
+        received = self.comm.alltoall(list(zip(np.split(cells, sections), np.split(priority, sections))))
+
+        block_cells = np.hstack([r[0] for r in received]).astype(int)
+        block_priority = np.hstack([r[1] for r in received])
+        block_ranks = np.repeat(np.arange(size), [r[0].size for r in received])
+
+        order = np.lexsort((block_ranks, block_priority, block_cells))
+        first = np.ones(order.size, dtype=bool)
+        first[1:] = block_cells[order[1:]] != block_cells[order[:-1]]
+        block_keep = np.zeros(order.size, dtype=bool)
+        block_keep[order[first]] = True
+
+        block_sections = np.cumsum([r[0].size for r in received])[:-1]
+        keep = np.hstack(self.comm.alltoall(np.split(block_keep, block_sections))).astype(bool)
+
+        # values of the kept cells are sent to their rows in this order by rasterise
+
+        ncells = keep.sum()
+        self.cells = cells[keep]
+        self.weights = csr_matrix((bcc[keep].ravel(), (np.repeat(np.arange(ncells), 3),
+                                   simplices[triangles[keep]].ravel())), shape=(ncells, mesh.npoints))
+
+        self._block_cells = block_cells[block_keep] - self.rows[0] * ncols
+        self._send_counts = np.bincount(home[keep], minlength=size)
+        self._recv_counts = np.array([k.sum() for k in np.split(block_keep, block_sections)], dtype=int)
+
+        mesh.timings['rasteriser'] = [clock()-t, mesh.log.getCPUTime(), mesh.log.getFlops()]
+        if mesh.rank==0 and mesh.verbose:
+            print("Raster cell location {}s".format(clock()-t))
+
+
+    def interpolate(self, field):
+        """
+        Values of a field (local nodes) at the raster cells of this processor
+        """
+        return self.weights.dot(np.asarray(field, dtype=np.float64))
+
+
+    def rasterise(self, field):
+        """
+        Resample a field onto the block of rows of the raster on this processor
+
+        Arguments
+        ---------
+         field : ndarray of floats, shape (n,)
+
+        Returns
+        -------
+         raster : ndarray of floats, shape (rows[1] - rows[0], columns)
+        """
+        from mpi4py import MPI
+
+        values = self.interpolate(field)
+        block = np.empty(self._recv_counts.sum())
+
+        send_displacements = np.hstack(([0], np.cumsum(self._send_counts)[:-1]))
+        recv_displacements = np.hstack(([0], np.cumsum(self._recv_counts)[:-1]))
+
+        self.comm.Alltoallv([values, (self._send_counts, send_displacements), MPI.DOUBLE],
+                            [block, (self._recv_counts, recv_displacements), MPI.DOUBLE])
+
+        raster = np.empty((self.rows[1] - self.rows[0]) * self.shape[1])
+        raster.fill(np.nan)
+        raster[self._block_cells] = block
+
+        return raster.reshape(-1, self.shape[1])
+
+
+    def save_to_hdf5(self, file, dtype='f4', compression='gzip', **kwargs):
+        """
+        Resample fields onto the raster and save them to an HDF5 file (appended if it exists)
+        as datasets named after the keyword arguments with the extent as an attribute.
+
+        Each processor writes its block of rows: collectively with the MPI-IO driver of h5py
+        if h5py is built with MPI support (and every processor has rows), otherwise one
+        processor after the other.
+
+        Arguments
+        ---------
+         file : string
+         dtype : numpy dtype of the datasets
+         compression : h5py compression filter
+        """
+        import h5py
+
+        file = str(file)
+        if not file.endswith('.h5'):
+            file += '.h5'
+
+        keys = sorted(kwargs.keys())
+
+        blocks = dict()
+        for key in keys:
+            blocks[key] = self.rasterise(kwargs[key]).astype(dtype)
+
+        lo, hi = self.rows
+        collective = self.comm.size > 1 and h5py.get_config().mpi and self.shape[0] >= self.comm.size
+
+        if collective:
+            with h5py.File(file, 'a', driver='mpio', comm=self.comm) as h5:
+                self._create_datasets(h5, keys, dtype, compression)
+                for key in keys:
+                    with h5[key].collective:
+                        h5[key][lo:hi] = blocks[key]
+        else:
+            for rank in range(0, self.comm.size):
+                if rank == self.comm.rank:
+                    with h5py.File(file, 'a') as h5:
+                        if rank == 0:
+                            self._create_datasets(h5, keys, dtype, compression)
+                        if hi > lo:
+                            for key in keys:
+                                h5[key][lo:hi] = blocks[key]
+                self.comm.barrier()
+
+
+    def _create_datasets(self, h5, keys, dtype, compression):
+        """
+        Create (or replace) a dataset the shape of the raster for each field
+        """
+        for key in keys:
+            if key in h5:
+                del h5[key]
+            dset = h5.create_dataset(key, shape=self.shape, dtype=dtype, compression=compression)
+            dset.attrs['extent'] = np.array(self.extent, dtype=np.float64)
@@ -0,0 +1,759 @@
+"""
+Copyright 2016-2017 Louis Moresi, Ben Mather, Romain Beucher
+
+This file is part of Quagmire.
+
+Quagmire is free software: you can redistribute it and/or modify
+it under the terms of the GNU Lesser General Public License as published by
+the Free Software Foundation, either version 3 of the License, or any later version.
+
+Quagmire is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU Lesser General Public License for more details.
+
+You should have received a copy of the GNU Lesser General Public License
+along with Quagmire.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+
+
+def _write_mesh(dm, file, mode='w'):
+    """
+    Write the DM (topology, geometry and the /viz mesh for visualisation)
+    with the PETSc HDF5 viewer. Returns the open viewer.
+    """
+    from petsc4py import PETSc
+
+    viewer = PETSc.Viewer()
+    viewer.createHDF5(file, mode=mode)
+    viewer.view(obj=dm)
+    viewer.pushFormat(PETSc.Viewer.Format.HDF5_VIZ)
+    viewer.view(obj=dm)
+
+    return viewer
+
+
+def _global_cells(dm):
+    """
+    Number of cells of a DMPlex across all processors (each cell counted once).
+    Collective.
+    """
+    from mpi4py import MPI
+
+    cStart, cEnd = dm.getHeightStratum(0)
+    owned = np.ones(cEnd - cStart, dtype=bool)
+
+    # the point SF of a DM that is not distributed has no graph
+    if MPI.COMM_WORLD.size == 1:
+        return int(owned.sum())
+
+    nroots, ilocal, iremote = dm.getPointSF().getGraph()
+    if ilocal is not None and len(ilocal):
+        ghosts = np.asarray(ilocal)
+        ghosts = ghosts[np.logical_and(ghosts >= cStart, ghosts < cEnd)]
+        owned[ghosts - cStart] = False
+
+    return MPI.COMM_WORLD.allreduce(int(owned.sum()), op=MPI.SUM)
+
+
+def _mesh_file_matches(dm, mesh_file, tolerance=1.0e-10):
+    """
+    Check that an existing mesh_file holds the mesh of the DM: the same number of
+    vertices and cells in /viz and the same sum of the vertex coordinates.
+    Collective.
+    """
+    import os
+    from mpi4py import MPI
+    from petsc4py import PETSc
+
+    comm = MPI.COMM_WORLD
+
+    coords = dm.getCoordinates()
+    numVertices = coords.getSize() // dm.getCoordinateDim()
+    numCells = _global_cells(dm) if isinstance(dm, PETSc.DMPlex) else None
+
+    local = coords.array.reshape(-1, dm.getCoordinateDim())
+    checksum = comm.allreduce(local.sum(axis=0), op=MPI.SUM)
+    scale = comm.allreduce(np.abs(local).sum(), op=MPI.SUM)
+
+    matches = False
+    if comm.rank == 0 and os.path.isfile(mesh_file):
+        import h5py
+        with h5py.File(mesh_file, 'r') as h5:
+            if 'viz/geometry/vertices' in h5 and 'viz/topology/cells' in h5:
+                vertices = h5['viz/geometry/vertices']
+                matches = vertices.shape[0] == numVertices and \
+                          (numCells is None or h5['viz/topology/cells'].shape[0] == numCells)
+
+                if matches:
+                    total = np.zeros(vertices.shape[1])
+                    for start in range(0, vertices.shape[0], 1000000):
+                        total += vertices[start:start+1000000].sum(axis=0)
+                    matches = np.abs(total - checksum).max() <= tolerance * max(scale, 1.0)
+
+    return comm.bcast(bool(matches), root=0)
+
+
+def _open_field_file(dm, file, mesh_file):
+    """
+    Create the HDF5 file for the fields. The mesh is written to the same file, or once
+    to mesh_file if it is given. An existing mesh_file is reused if it holds the mesh of
+    the DM (same number of vertices and cells and the same coordinates), otherwise it is
+    overwritten.
+    Returns the open viewer in the visualisation format.
+    """
+    from petsc4py import PETSc
+
+    if mesh_file is None:
+        return _write_mesh(dm, file)
+
+    if not _mesh_file_matches(dm, mesh_file):
+        _write_mesh(dm, mesh_file).destroy()
+
+    viewer = PETSc.Viewer()
+    viewer.createHDF5(file, mode='w')
+    viewer.pushFormat(PETSc.Viewer.Format.HDF5_VIZ)
+
+    return viewer
+
+
+def _xdmf_appender(dm, file, numVertices, mesh_file=None):
+    """
+    XdmfAppender (root processor) for the mesh that PETSc writes to /viz
+    in an HDF5 file (or in mesh_file). Collective: the number of cells is counted
+    across all processors.
+    """
+    import os
+    from mpi4py import MPI
+    from generate_xdmf import XdmfAppender
+
+    numCells = _global_cells(dm)
+    cellDim  = dm.getDimension()
+    spaceDim = dm.getCoordinateDim()
+
+    if MPI.COMM_WORLD.rank != 0:
+        return None
+
+    return XdmfAppender(os.path.splitext(file)[0] + '.xmf', file, 'viz/topology', numCells, cellDim+1,
+                        cellDim, 'viz/geometry', numVertices, spaceDim, meshFilename=mesh_file)
+
+
+class _FieldDatasets(object):
+    """
+    Time series of fields in the /vertex_fields/<name> datasets (one row per timestep)
+    and /time written with h5py to an HDF5 file that already holds the mesh.
+
+    With collective writes each processor writes its own (owned) slab of the global vector
+    with the MPI-IO driver of h5py, otherwise the owned slabs are gathered to the root processor
+    which writes the whole field. The datasets are chunked with one timestep per chunk and,
+    by default, the smallest owned slab as the chunk size so that the chunks line up with the
+    slabs written by each processor. Collective.
+    """
+    def __init__(self, mesh, file, collective, compression=None, compression_opts=None,
+                 chunk_size=None, dtype='f8', field_dtypes=None):
+        import h5py
+        from mpi4py import MPI
+
+        self.comm = MPI.COMM_WORLD
+
+        # slab of the global vector owned by this processor
+
+        self.global_size = mesh.gvec.getSize()
+        self.lo, self.hi = mesh.gvec.getOwnershipRange()
+
+        l2g = mesh.lgmap_row.indices
+        owned = np.logical_and(l2g >= self.lo, l2g < self.hi)
+        owned_nodes = np.nonzero(owned)[0]
+        self.owned_nodes = owned_nodes[np.argsort(l2g[owned_nodes])]
+
+        self.collective = self.comm.size > 1 and collective
+        self.writer_rank = self.comm.size == 1 or self.collective or self.comm.rank == 0
+
+        # the root processor gathers the owned slabs when it writes the whole file
+
+        self.gather = self.comm.size > 1 and not self.collective
+        if self.gather and self.comm.rank == 0:
+            self.buffer_size = self.global_size
+        else:
+            self.buffer_size = self.hi - self.lo
+
+        ranges = self.comm.allgather((self.lo, self.hi))
+        self._counts = np.array([r[1] - r[0] for r in ranges], dtype=int)
+        self._displacements = np.array([r[0] for r in ranges], dtype=int)
+
+        # dataset layout
+
+        if chunk_size is None:
+            chunk_size = self.comm.allreduce(self.hi - self.lo, op=MPI.MIN)
+        self.chunk_size = max(1, min(chunk_size, self.global_size))
+
+        self.compression = compression
+        self.compression_opts = compression_opts
+        self.dtype = np.dtype(dtype)
+        self.field_dtypes = dict()
+        if field_dtypes is not None:
+            self.field_dtypes = dict((key, np.dtype(field_dtypes[key])) for key in field_dtypes)
+
+        self.h5 = None
+        if self.writer_rank:
+            if self.collective:
+                self.h5 = h5py.File(file, 'r+', driver='mpio', comm=self.comm)
+            else:
+                self.h5 = h5py.File(file, 'r+')
+
+
+    def dtype_of(self, key):
+        return self.field_dtypes.get(key, self.dtype)
+
+
+    def owned(self, data):
+        """
+        Owned part of a local field in the order of the global vector
+        """
+        return np.asarray(data)[self.owned_nodes]
+
+
+    def snapshot(self, buffer, key, owned):
+        """
+        Copy the owned part of a field into a buffer
+        (gathered into the whole field on the root processor)
+        """
+        if key not in buffer:
+            buffer[key] = np.empty(self.buffer_size, dtype=self.dtype_of(key))
+
+        if not self.gather:
+            buffer[key][:] = owned
+        elif self.comm.rank == 0:
+            self.comm.Gatherv(np.ascontiguousarray(owned, dtype=self.dtype_of(key)),
+                              [buffer[key], (self._counts, self._displacements)], root=0)
+        else:
+            buffer[key][:] = owned
+            self.comm.Gatherv(buffer[key], None, root=0)
+
+
+    def write(self, buffer, step, time, keys):
+        """
+        Append one timestep to the time and field datasets (writer processors)
+        """
+        h5 = self.h5
+
+        if 'time' not in h5:
+            h5.create_dataset('time', shape=(0,1), maxshape=(None,1), dtype='f8')
+        h5['time'].resize((step+1,1))
+
+        group = h5.require_group('vertex_fields')
+
+        for key in keys:
+            if key not in group:
+                dset = group.create_dataset(key, shape=(0,self.global_size), maxshape=(None,self.global_size),
+                                            chunks=(1,self.chunk_size), dtype=self.dtype_of(key),
+                                            compression=self.compression, compression_opts=self.compression_opts)
+                dset.attrs['vector_field_type'] = b'scalar'
+            dset = group[key]
+            dset.resize((step+1,self.global_size))
+
+            if self.collective:
+                # each processor writes its owned slab in one collective operation
+                with dset.collective:
+                    dset[step, self.lo:self.hi] = buffer[key]
+            else:
+                dset[step, :] = buffer[key]
+
+        if not self.collective or self.comm.rank == 0:
+            h5['time'][step,0] = time
+
+
+    def xdmf_fields(self, keys):
+        """
+        Fields of a timestep for XdmfAppender.append
+        """
+        return [(key, self.global_size, 1, self.dtype_of(key).itemsize) for key in keys]
+
+
+    def flush(self):
+        if self.h5 is not None:
+            self.h5.flush()
+
+
+    def close(self):
+        if self.h5 is not None:
+            self.h5.close()
+            self.h5 = None
+
+
+class TimeSeriesWriter(object):
+    """
+    Writes fields on the mesh to a single HDF5 file as a time series.
+
+    The HDF5 viewer is opened once and the mesh is written when the file is created,
+    or only once to a separate mesh_file that can be shared by several runs or outputs.
+    Each call to write adds a timestep to the /vertex_fields datasets and the /time
+    dataset, which is the layout that generate_xdmf reads. The global vectors are
+    kept in a pool (one per field) and reused for every timestep.
+
+    The fields can be compressed, chunked and stored in single precision for visualisation
+    as in the AsyncTimeSeriesWriter. The fields are then written with h5py instead of the
+    PETSc viewer (in the same layout), collectively with the MPI-IO driver if h5py is built
+    with MPI support, otherwise they are gathered to the root processor.
+
+    Parameters
+    ----------
+     mesh : mesh object (TriMesh or PixMesh)
+     file : string
+        path of the HDF5 file, it is overwritten if it exists
+     flush_interval : int
+        number of timesteps between flushing the file to disk
+     mesh_file : string (optional)
+        write the mesh to this file instead (unless it already holds the same mesh)
+     xdmf : bool
+        keep an Xdmf file (file.xmf) up to date with every timestep (DMPlex only)
+     compression : string (optional)
+        h5py compression filter, e.g. "gzip" or "lzf"
+     compression_opts : compression settings, e.g. the gzip level (0-9)
+     chunk_size : int (optional)
+        number of nodes in each chunk
+     dtype : numpy dtype of the datasets (default: float64)
+     field_dtypes : dict (optional)
+        dtype for individual fields, e.g. {"height": "f8", "slope": "f4"}
+
+    Usage
+    -----
+     writer = TimeSeriesWriter(mesh, "output.h5")
+     writer.write(time, height=height, slope=slope)
+     writer.close()
+    """
+    def __init__(self, mesh, file, flush_interval=1, mesh_file=None, xdmf=True, compression=None,
+                 compression_opts=None, chunk_size=None, dtype='f8', field_dtypes=None):
+        from petsc4py import PETSc
+
+        file = str(file)
+        if not file.endswith('.h5'):
+            file += '.h5'
+
+        self.mesh = mesh
+        self.dm = mesh.dm
+        self.file = file
+        self.flush_interval = flush_interval
+
+        self.step = 0
+        self.times = []
+        self._vectors = dict()
+
+        if mesh_file is not None and not str(mesh_file).endswith('.h5'):
+            mesh_file = str(mesh_file) + '.h5'
+        self.mesh_file = mesh_file
+
+        self.viewer = _open_field_file(self.dm, file, mesh_file)
+
+        # the PETSc viewer writes uncompressed fields in double precision
+
+        self._datasets = None
+        if compression is not None or chunk_size is not None or np.dtype(dtype) != np.float64 or field_dtypes:
+            import h5py
+            self.viewer.destroy()
+            self.viewer = None
+            self._datasets = _FieldDatasets(mesh, file, h5py.get_config().mpi, compression, compression_opts,
+                                            chunk_size, dtype, field_dtypes)
+            self._buffer = dict()
+
+        elif hasattr(self.viewer, 'pushTimestepping'):
+            self.viewer.pushTimestepping()
+
+        self.global_size = mesh.gvec.getSize()
+        self.xdmf = None
+        if xdmf and isinstance(self.dm, PETSc.DMPlex):
+            self.xdmf = _xdmf_appender(self.dm, file, self.global_size, mesh_file)
+
+
+    def _get_vector(self, name):
+        """
+        Global vector for a field from the pool
+        """
+        if name not in self._vectors:
+            vec = self.dm.createGlobalVec()
+            vec.setName(name)
+            self._vectors[name] = vec
+
+        return self._vectors[name]
+
+
+    def _write_datasets(self, time, kwdict):
+        """
+        Write the fields of a timestep with h5py. An error on the root processor
+        (which writes gathered fields) is raised on every processor.
+        """
+        datasets = self._datasets
+        keys = sorted(kwdict.keys())
+
+        owned = dict()
+        error = None
+        try:
+            for key in keys:
+                owned[key] = datasets.owned(kwdict[key])
+        except Exception as e:
+            error = e
+
+        self._agree(error)
+
+        for key in keys:
+            datasets.snapshot(self._buffer, key, owned[key])
+
+        error = None
+        try:
+            if datasets.h5 is not None:
+                datasets.write(self._buffer, self.step, time, keys)
+        except Exception as e:
+            error = e
+
+        self._agree(error)
+
+        if self.xdmf is not None:
+            self.xdmf.append(time, self.step, datasets.xdmf_fields(keys))
+
+
+    def _agree(self, error):
+        """
+        Raise an error of any processor on every processor (collective)
+        """
+        failed = error is not None
+        if self._datasets.comm.size > 1:
+            from mpi4py import MPI
+            failed = self._datasets.comm.allreduce(failed, op=MPI.LOR)
+
+        if failed:
+            if error is None:
+                error = RuntimeError("Step {} of {} failed on another processor".format(self.step, self.file))
+            raise error
+
+
+    def write(self, time, *args, **kwargs):
+        """
+        Write fields for a new timestep
+
+        Pass these as arguments or keyword arguments for
+        their names to be saved to the hdf5 file
+
+        Arguments
+        ---------
+         time : float
+        """
+        kwdict = kwargs
+        for i, arg in enumerate(args):
+            key = "arr_{}".format(i)
+            if key in kwdict.keys():
+                raise ValueError("Cannot use un-named variables\
+                                  and keyword: {}".format(key))
+            kwdict[key] = arg
+
+        if self._datasets is not None:
+            self._write_datasets(time, kwdict)
+
+        else:
+            self.dm.setOutputSequenceNumber(self.step, time)
+            self.viewer.setTimestep(self.step)
+
+            for key in sorted(kwdict.keys()):
+                vec = self._get_vector(key)
+                self.mesh.lvec.setArray(kwdict[key])
+                self.dm.localToGlobal(self.mesh.lvec, vec)
+                self.viewer.view(obj=vec)
+
+            if self.xdmf is not None:
+                self.xdmf.append(time, self.step, [(key, self.global_size, 1) for key in sorted(kwdict.keys())])
+
+        self.times.append(time)
+        self.step += 1
+
+        if self.flush_interval and self.step % self.flush_interval == 0:
+            self.flush()
+
+
+    def flush(self):
+        """
+        Flush the HDF5 file to disk
+        """
+        if self._datasets is not None:
+            self._datasets.flush()
+        elif self.viewer is not None:
+            self.viewer.flush()
+
+
+    def close(self):
+        """
+        Flush and close the HDF5 file and release the vector pool
+        """
+        if self._datasets is not None:
+            self._datasets.close()
+            self._datasets = None
+
+        if self.viewer is None:
+            return
+
+        self.flush()
+        self.viewer.destroy()
+        self.viewer = None
+
+        for vec in self._vectors.values():
+            vec.destroy()
+        self._vectors.clear()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class AsyncTimeSeriesWriter(object):
+    """
+    Writes fields on the mesh to a single HDF5 file as a time series
+    while the computation continues.
+
+    The local fields are copied into one of a set of preallocated snapshot buffers and a
+    background thread writes them with h5py. When all of the buffers are waiting to be written,
+    write blocks until one is free (backpressure). The file has the same layout as the
+    TimeSeriesWriter (/vertex_fields/<name> with one row per timestep, and /time) so that
+    generate_xdmf can read it. The mesh is written with PETSc when the file is created
+    (or once to a separate mesh_file).
+
+    In parallel each processor writes its own (owned) slab of the global vector with the
+    MPI-IO driver of h5py. This requires h5py built with MPI support and an MPI library that
+    provides MPI_THREAD_MULTIPLE, otherwise the fields are gathered to the root processor
+    which writes the file in the background.
+
+    The datasets are chunked with one timestep per chunk and, by default, the smallest
+    owned slab as the chunk size so that the chunks line up with the slabs written by each
+    processor. Fields can be compressed and stored in single precision for visualisation.
+    Compression in parallel requires HDF5 >= 1.10.2 (collective writes are always used).
+
+    Before a snapshot is queued the processors agree that it was copied on all of them and
+    that no earlier write has failed (on the root processor when the fields are gathered),
+    so an error is raised by write on every processor instead of leaving the others waiting
+    in the gather. An error in a collective background write cannot be recovered from
+    (the other processors are waiting in HDF5) and aborts the communicator.
+
+    Parameters
+    ----------
+     mesh : mesh object (TriMesh or PixMesh)
+     file : string
+        path of the HDF5 file, it is overwritten if it exists
+     buffers : int
+        number of snapshot buffers (2: double buffering)
+     mesh_file : string (optional)
+        write the mesh to this file instead (unless it already holds the same mesh)
+     xdmf : bool
+        keep an Xdmf file (file.xmf) up to date with every timestep
+        that has been written (DMPlex only)
+     compression : string (optional)
+        h5py compression filter, e.g. "gzip" or "lzf"
+     compression_opts : compression settings, e.g. the gzip level (0-9)
+     chunk_size : int (optional)
+        number of nodes in each chunk
+     dtype : numpy dtype of the datasets (default: float64)
+     field_dtypes : dict (optional)
+        dtype for individual fields, e.g. {"height": "f8", "slope": "f4"}
+
+    Usage
+    -----
+     writer = AsyncTimeSeriesWriter(mesh, "output.h5")
+     writer.write(time, height=height, slope=slope)
+     writer.close()
+    """
+    def __init__(self, mesh, file, buffers=2, mesh_file=None, xdmf=True, compression=None,
+                 compression_opts=None, chunk_size=None, dtype='f8', field_dtypes=None):
+        import atexit
+        import threading
+        import h5py
+        from mpi4py import MPI
+        from petsc4py import PETSc
+        try: import queue
+        except ImportError: import Queue as queue
+
+        file = str(file)
+        if not file.endswith('.h5'):
+            file += '.h5'
+
+        self.mesh = mesh
+        self.dm = mesh.dm
+        self.file = file
+        self.comm = MPI.COMM_WORLD
+
+        self.step = 0
+        self.times = []
+
+        if mesh_file is not None and not str(mesh_file).endswith('.h5'):
+            mesh_file = str(mesh_file) + '.h5'
+        self.mesh_file = mesh_file
+
+        # mesh written collectively with PETSc before the file is handed to h5py
+
+        _open_field_file(self.dm, file, mesh_file).destroy()
+
+        self.global_size = mesh.gvec.getSize()
+
+        self.xdmf = None
+        if xdmf and isinstance(self.dm, PETSc.DMPlex):
+            self.xdmf = _xdmf_appender(self.dm, file, self.global_size, mesh_file)
+
+        # collective writes from the background thread need MPI_THREAD_MULTIPLE
+
+        collective = h5py.get_config().mpi and MPI.Query_thread() == MPI.THREAD_MULTIPLE
+        self._datasets = _FieldDatasets(mesh, file, collective, compression, compression_opts,
+                                        chunk_size, dtype, field_dtypes)
+        self.collective = self._datasets.collective
+
+        # snapshot buffers - free buffers are recycled by the writer thread
+
+        self._buffers = [dict() for i in range(0, buffers)]
+        self._free = queue.Queue()
+        self._pending = queue.Queue(maxsize=buffers)
+        for i in range(0, buffers):
+            self._free.put(i)
+
+        self._error = None
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+        atexit.register(self.close)
+
+
+    def write(self, time, *args, **kwargs):
+        """
+        Copy the fields for a new timestep and queue them to be written
+
+        Pass these as arguments or keyword arguments for
+        their names to be saved to the hdf5 file
+
+        Arguments
+        ---------
+         time : float
+        """
+        kwdict = kwargs
+        for i, arg in enumerate(args):
+            key = "arr_{}".format(i)
+            if key in kwdict.keys():
+                raise ValueError("Cannot use un-named variables\
+                                  and keyword: {}".format(key))
+            kwdict[key] = arg
+
+        keys = sorted(kwdict.keys())
+
+        owned = dict()
+        error = None
+        try:
+            for key in keys:
+                owned[key] = self._datasets.owned(kwdict[key])
+        except Exception as e:
+            error = e
+
+        # a snapshot that fails on one processor (or follows a failed write) is not queued
+        # on any of them, the others would wait for it in the gather or the collective write
+        self._check_error(error)
+
+        index = self._free.get()
+        buffer = self._buffers[index]
+
+        for key in keys:
+            self._datasets.snapshot(buffer, key, owned[key])
+
+        self._pending.put((index, self.step, time, keys))
+
+        self.times.append(time)
+        self.step += 1
+
+
+    def _run(self):
+        """
+        Background thread: write the queued snapshots in order
+        """
+        while True:
+            item = self._pending.get()
+            if item is None:
+                self._pending.task_done()
+                break
+
+            index, step, time, keys = item
+            try:
+                if self._datasets.h5 is not None and self._error is None:
+                    self._datasets.write(self._buffers[index], step, time, keys)
+                    if self.xdmf is not None:
+                        self.xdmf.append(time, step, self._datasets.xdmf_fields(keys))
+            except Exception as error:
+                if self.collective:
+                    self._abort()
+                self._error = error
+
+            self._free.put(index)
+            self._pending.task_done()
+
+
+    def _abort(self):
+        """
+        A collective write that fails on one processor leaves the others waiting
+        in HDF5: report the error and abort the communicator
+        """
+        import sys
+        import traceback
+
+        sys.stderr.write("AsyncTimeSeriesWriter - collective write of {} failed on processor {}\n".format(
+                         self.file, self.comm.rank))
+        traceback.print_exc()
+        sys.stderr.flush()
+        self.comm.Abort(1)
+
+
+    def _check_error(self, error=None, collective=True):
+        """
+        Raise a local error or an error from the background thread, on every processor
+        if collective (the error may only have happened on the root processor)
+        """
+        failed = error is not None or self._error is not None
+        if collective and self.comm.size > 1:
+            from mpi4py import MPI
+            failed = self.comm.allreduce(failed, op=MPI.LOR)
+
+        if failed:
+            if error is None:
+                error, self._error = self._error, None
+            if error is None:
+                error = RuntimeError("Step {} of {} failed on another processor".format(self.step, self.file))
+            raise error
+
+
+    def flush(self):
+        """
+        Wait for the queued snapshots to be written and flush the file to disk
+        """
+        self._pending.join()
+        self._datasets.flush()
+        self._check_error()
+
+
+    def close(self):
+        """
+        Write the queued snapshots and close the file
+        """
+        if self._thread is None:
+            return
+
+        self._pending.put(None)
+        self._thread.join()
+        self._thread = None
+
+        self._datasets.close()
+
+        # close can be called at exit, where the processors are no longer in step
+        self._check_error(collective=False)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, *args):
+        self.close()
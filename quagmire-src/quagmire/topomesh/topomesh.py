@@ -24,23 +24,77 @@ petsc4py.init(sys.argv)
 from petsc4py import PETSc
 comm = MPI.COMM_WORLD
 from time import clock
+from ..mesh import MeshVariable
 
 try: range = xrange
 except: pass
 
 
 class TopoMesh(object):
-    def __init__(self, downhill_neighbours=2, *args, **kwargs):
+    def __init__(self, downhill_neighbours=2, resolve_flats=False, *args, **kwargs):
         self.downhill_neighbours = downhill_neighbours
+        self.resolve_flats = resolve_flats
 
         # Initialise cumulative flow vectors
         self.DX0 = self.gvec.duplicate()
         self.DX1 = self.gvec.duplicate()
         self.dDX = self.gvec.duplicate()
 
-        # Initialise mesh fields
-        # self.height = self.gvec.duplicate()
-        # self.slope = self.gvec.duplicate()
+        # Initialise mesh fields (see update_height)
+        self._height = None
+        self._slope = None
+
+
+    @property
+    def height(self):
+        """
+        Height field, the local values with valid shadow values.
+        It is a MeshVariable: writing the whole array (mesh.height = h, update_height and the
+        low point filling) exchanges the shadow values at once and is collective.
+        Writes through indexing or in-place operators (e.g. mesh.height[nodes] = h) mark it
+        as dirty and do not rebuild the slope or downhill matrices (see update_height).
+        The next read of a dirty height exchanges the shadow values, which is collective:
+        every processor must read it, not only some of the ranks.
+        """
+        if self._height is None:
+            raise AttributeError("Call update_height to initialise the height field")
+        return self._height.data
+
+    @height.setter
+    def height(self, value):
+        self._set_height(value)
+
+
+    @property
+    def slope(self):
+        """
+        Magnitude of the gradient of the height field (a MeshVariable, computed by update_height).
+        The slope at the shadow nodes is replaced with the value of the processor that owns them
+        when it is written (collective, as for the height).
+        """
+        if self._slope is None:
+            raise AttributeError("Call update_height to initialise the slope")
+        return self._slope.data
+
+    @slope.setter
+    def slope(self, value):
+        if self._slope is None:
+            self._slope = MeshVariable("slope", self)
+        self._slope.set_data(value)
+        self._slope.sync()
+
+
+    def _set_height(self, height, consistent=False):
+        """
+        Write the height field (consistent: the shadow values are already synchronised).
+        The shadow values are exchanged here so that reading the height after a write
+        by the mesh is not collective.
+        """
+        if self._height is None:
+            self._height = MeshVariable("height", self)
+        self._height.set_data(height, consistent)
+        if not consistent:
+            self._height.sync()
 
 
     def update_height(self, height):
@@ -48,20 +102,18 @@ class TopoMesh(object):
         Update height field
         """
 
-        height = np.array(height)
+        height = np.asarray(height, dtype=np.float64)
         if height.size != self.npoints:
             raise IndexError("Incompatible array size, should be {}".format(self.npoints))
 
-        height = self.sync(height)
+        # the shadow values are exchanged when the height is written
+        self.height = height
+        height = self.height
 
         t = clock()
-        self.height = height.copy()
         dHdx, dHdy = self.derivative_grad(height)
         self.slope = np.hypot(dHdx, dHdy)
 
-        # Lets send and receive this from the global space
-        # self.slope[:] = self.sync(self.slope)
-
         self.timings['gradient operation'] = [clock()-t, self.log.getCPUTime(), self.log.getFlops()]
         if self.rank==0 and self.verbose:
             print("{} - Compute slopes {}s".format(self.dm.comm.rank, clock()-t))
@@ -75,18 +127,20 @@ class TopoMesh(object):
             print("{} - Build downhill matrices {}s".format(self.dm.comm.rank, clock()-t))
 
 
-    def _update_height_partial(self, height):
+    def _update_height_partial(self, height, consistent=False):
         """
         Partially update height field for specific purpose of patching topographic low points etc.
         This allows rebuilding of the Adjacency1,2/Downhill matrix but does not compute gradients or
         a third descent path.
+        If the height is consistent (e.g. computed pointwise from synchronised fields)
+        the shadow values are not exchanged.
         """
 
-        height = np.array(height)
+        height = np.asarray(height, dtype=np.float64)
         if height.size != self.npoints:
             raise IndexError("Incompatible array size, should be {}".format(self.npoints))
 
-        self.height = self.sync(height)
+        self._set_height(height, consistent)
 
 
         t = clock()
@@ -131,6 +185,19 @@ class TopoMesh(object):
 
 
 
+    def _get_neighbour_csr(self):
+        """
+        Return the natural neighbours of each node in CSR format (indptr, indices),
+        building them from the triangulation the first time they are needed.
+        """
+
+        if not hasattr(self, "vertex_neighbour_vertices"):
+            self.get_edge_lengths()
+            self.construct_neighbours()
+
+        return self.vertex_neighbour_vertices
+
+
     def _adjacency_matrix_template(self, nnz=(1,1)):
 
         matrix = PETSc.Mat().create(comm=comm)
@@ -209,6 +276,164 @@ class TopoMesh(object):
             # store in neighbour dictionary
             self.down_neighbour[n] = indexN.astype(PETSc.IntType)
 
+        if self.resolve_flats:
+            self._build_flat_routing()
+
+
+    def _csr_neighbours_of(self, nodes):
+        """
+        All (node, neighbour) pairs for the given nodes from the CSR neighbour arrays
+        """
+        indptr, indices = self._get_neighbour_csr()
+
+        start = indptr[nodes]
+        count = indptr[nodes+1] - start
+        offset = np.repeat(start - np.cumsum(count) + count, count) + np.arange(0, count.sum())
+
+        return np.repeat(nodes, count), indices[offset]
+
+
+    def _flat_distance(self, seeds, flat):
+        """
+        Breadth-first sweep from the seed nodes across connected nodes of equal height
+        in the flat mask. Returns the number of sweeps needed to reach each node (0 if never reached).
+        """
+        distance = np.zeros(self.npoints, dtype=int)
+        frontier = np.unique(seeds)
+        sweep = 1
+
+        while frontier.size:
+            distance[frontier] = sweep
+            src, dst = self._csr_neighbours_of(frontier)
+            step = np.logical_and(flat[dst], distance[dst] == 0)
+            step = np.logical_and(step, self.height[dst] == self.height[src])
+            frontier = np.unique(dst[step])
+            sweep += 1
+
+        return distance
+
+
+    def _build_flat_routing(self):
+        """
+        Route flow across flat areas without modifying the height field (after Garbrecht and Martz, 1997).
+
+        Nodes with no downhill neighbour that share their height with a natural neighbour are flat.
+        Two breadth-first sweeps over the natural neighbours measure the distance of each flat
+        node from the lower terrain where the flat drains and from the higher terrain that surrounds it.
+        Flow is directed away from higher ground and towards the outlet of the flat which replaces
+        the epsilon gradient that would otherwise be added to the heights. Flats with no outlet
+        remain as low points.
+
+        The flat mask is stored in self.flat_spots. Flats that cross a partition boundary are
+        resolved independently on each process using the shadow nodes.
+        """
+        from scipy.sparse import coo_matrix
+        from scipy.sparse.csgraph import connected_components
+
+        height = self.height
+        nodes = np.arange(0, self.npoints)
+
+        no_flow = np.logical_and(self.down_neighbour[1] == nodes, self.bmask)
+
+        src, dst = self._csr_neighbours_of(nodes)
+        keep = src != dst
+        src, dst = src[keep], dst[keep]
+
+        level = height[src] == height[dst]
+        higher = height[dst] > height[src]
+
+        # flat nodes and the edges of the flats
+
+        flat = np.zeros(self.npoints, dtype=bool)
+        flat[src[np.logical_and(level, no_flow[src])]] = True
+
+        on_flat = np.logical_and(level, flat[dst])
+        outlet = np.logical_and(on_flat, ~no_flow[src])
+        low_edges = np.unique(src[outlet])
+        high_edges = np.unique(src[np.logical_and(higher, flat[src])])
+
+        self.flat_spots = flat
+
+        if not flat.any():
+            return
+
+        # distance from the outlet and from the higher ground
+
+        towards_lower = self._flat_distance(dst[outlet], flat)
+        from_higher = self._flat_distance(high_edges, flat)
+
+        flat_edges = np.logical_and(level, np.logical_and(flat[src], flat[dst]))
+        graph = coo_matrix((np.ones(np.count_nonzero(flat_edges)), (src[flat_edges], dst[flat_edges])),
+                           shape=(self.npoints, self.npoints))
+        nflats, flat_label = connected_components(graph, directed=False)
+
+        flat_height = np.zeros(nflats, dtype=int)
+        np.maximum.at(flat_height, flat_label[flat], from_higher[flat])
+
+        away_from_higher = np.where(from_higher > 0, flat_height[flat_label] - from_higher + 1, 0)
+
+        # combined gradient: 0 at the outlet, decreasing towards it everywhere on the flat
+
+        gradient = np.full(self.npoints, np.iinfo(int).max, dtype=np.int64)
+        drains = np.logical_and(flat, towards_lower > 0)
+        gradient[drains] = 2*towards_lower[drains] + away_from_higher[drains]
+        gradient[low_edges] = 0
+
+        # each draining flat node flows to the level neighbour with the smallest gradient
+
+        candidate = np.logical_and(level, drains[src])
+        csrc, cdst = src[candidate], dst[candidate]
+        cgrad = gradient[cdst]
+
+        order = np.lexsort((cgrad, csrc))
+        csrc, cdst, cgrad = csrc[order], cdst[order], cgrad[order]
+        first = np.ones(csrc.size, dtype=bool)
+        first[1:] = csrc[1:] != csrc[:-1]
+        first = np.logical_and(first, cgrad < gradient[csrc])
+
+        for n in self.down_neighbour:
+            self.down_neighbour[n][csrc[first]] = cdst[first]
+
+
+    def _receiver_levels(self, receivers, fixed=None):
+        """
+        Order the nodes along their receiver chains from base level upwards.
+
+        Each node is ranked by the number of steps to its base-level node (a node that is its own
+        receiver, a node in the fixed mask or a node on a receiver cycle) by pointer jumping.
+        Returns a list of node arrays, one for each level, so that every node appears after its receiver.
+        """
+
+        nodes = np.arange(0, self.npoints)
+        pointer = np.array(receivers, dtype=int)
+
+        if fixed is not None:
+            pointer[fixed] = nodes[fixed]
+
+        njumps = int(np.log2(self.npoints+1)) + 2
+
+        # following the receivers more than npoints times only visits nodes on cycles
+        # (including the base-level nodes), every one of which is reached
+        jump = pointer.copy()
+        for i in range(0, njumps):
+            jump = jump[jump]
+
+        pointer[jump] = jump
+
+        depth = (pointer != nodes).astype(int)
+
+        for i in range(0, njumps):
+            if np.all(pointer[pointer] == pointer):
+                break
+            depth += depth[pointer]
+            pointer = pointer[pointer]
+
+        order = np.argsort(depth, kind='mergesort')
+        counts = np.bincount(depth)
+        bounds = np.hstack(([0], np.cumsum(counts)))
+
+        return [order[bounds[l]:bounds[l+1]] for l in range(0, counts.size)]
+
 
     def _build_adjacency_matrix_iterate(self):
 
@@ -250,6 +475,7 @@ class TopoMesh(object):
             weights[i,:] = np.sqrt(grad)
 
         weights /= weights.sum(axis=0)
+        self.downhill_weights = weights
         w = self.gvec.duplicate()
 
 
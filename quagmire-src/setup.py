@@ -22,6 +22,7 @@ if __name__ == "__main__":
           long_description  = long_description,
           long_description_content_type='text/markdown',
           ext_modules       = [ext],
+          install_requires  = ['numpy>=1.9', 'scipy>=0.15'],
           packages          = ['quagmire', 'quagmire.tools', 'quagmire.mesh', 'quagmire.topomesh', 'quagmire.surfmesh'],
           package_data      = {'quagmire': ['Examples/Notebooks/data',
                                             # 'Examples/Notebooks/IdealisedExamples/*.ipynb',
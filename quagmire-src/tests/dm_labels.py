@@ -0,0 +1,77 @@
+"""
+Time the construction of a DMPlex with bulk labelling (DMLabel.setStratumIS and
+vectorised edge cones) against labelling every point with setLabelValue.
+Both must mark the same boundary and coarse points.
+
+Modify the size of the mesh with
+ dx = dy = spacing
+
+Run script with
+ python dm_labels.py
+"""
+spacing = 0.005
+
+import numpy as np
+from time import clock
+from petsc4py import PETSc
+from stripy import Triangulation
+from quagmire import tools as meshtools
+
+minX, maxX = -1., 1.
+minY, maxY = -1., 1.
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, spacing, spacing, 50000, 1000)
+
+tri = Triangulation(x, y, permute=True)
+boundary_vertices = tri.convex_hull()
+boundary_vertices = np.column_stack([boundary_vertices, np.roll(boundary_vertices, -1)]).astype(PETSc.IntType)
+
+
+def create_cells():
+    dm = PETSc.DMPlex().createFromCellList(2, tri.simplices.astype(PETSc.IntType), np.column_stack([tri.x, tri.y]))
+    dm.createLabel("boundary")
+    dm.createLabel("coarse")
+    return dm
+
+
+def label_points_loop(dm):
+    """ labelling one point at a time """
+    pStart, pEnd = dm.getDepthStratum(0)
+
+    for edge in boundary_vertices + pStart:
+        for j in dm.getJoin(edge):
+            dm.setLabelValue("boundary", j, 1)
+
+    for ind in np.unique(boundary_vertices + pStart):
+        dm.setLabelValue("boundary", ind, 1)
+
+    for pt in range(pStart, pEnd):
+        dm.setLabelValue("coarse", pt, 1)
+
+
+def label_points_bulk(dm):
+    pStart, pEnd = dm.getDepthStratum(0)
+
+    meshtools.set_DMPlex_boundary_points_and_edges(dm, boundary_vertices)
+    meshtools.label_DMPlex_points(dm, "coarse", np.arange(pStart, pEnd))
+
+
+timings = dict()
+labels = dict()
+
+for name, label_points in [("loop", label_points_loop), ("bulk", label_points_bulk)]:
+    dm = create_cells()
+
+    t = clock()
+    label_points(dm)
+    timings[name] = clock() - t
+
+    labels[name] = [np.sort(dm.getStratumIS(label, 1).indices) for label in ["boundary", "coarse"]]
+
+
+print("{} points, {} cells".format(tri.npoints, tri.simplices.shape[0]))
+print("labels - per point loop {:.4f}s".format(timings["loop"]))
+print("labels - bulk           {:.4f}s ({:.1f}x faster)".format(timings["bulk"], timings["loop"]/timings["bulk"]))
+
+for a, b in zip(labels["loop"], labels["bulk"]):
+    assert np.array_equal(a, b), "bulk labels do not match"
@@ -0,0 +1,80 @@
+"""
+Route flow across flats without modifying the heights (resolve_flats=True).
+
+The surface is an inclined plane with a flat plateau that drains to the
+lower side of the plane and a flat-bottomed pit with no outlet.
+
+ - update_height does not change the heights
+ - the down_neighbour chain of every node on the plateau ends at lower
+   terrain, without cycles
+ - the nodes of the pit remain low points
+
+Chains that leave the processor end at a shadow node.
+
+Run script with
+ mpirun -np <procs> python flat_routing.py
+"""
+
+import numpy as np
+from quagmire import TopoMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+mesh = TopoMesh(dm, verbose=False, resolve_flats=True)
+
+x, y = mesh.coords[:,0], mesh.coords[:,1]
+owned = mesh.lgmap_row.indices >= 0
+
+plateau_height = 1.5
+pit_height = 1.0
+
+height = 0.1*(x - minX) + 1.0
+
+plateau = np.logical_and(np.logical_and(x > 0.0, x < 2.0), np.abs(y) < 2.0)
+pit = (x + 2.5)**2 + y**2 < 1.0
+
+height[plateau] = plateau_height
+height[pit] = pit_height
+
+mesh.update_height(height.copy())
+
+assert np.array_equal(mesh.height, height), "update_height changed the heights"
+
+
+def chain_ends(down_neighbour):
+    """ the node at the end of the down_neighbour chain of every node (-1 on a cycle) """
+    end = np.arange(0, mesh.npoints)
+    for i in range(0, mesh.npoints):
+        end = down_neighbour[end]
+
+    end[down_neighbour[end] != end] = -1
+    return end
+
+
+for n in mesh.down_neighbour:
+    end = chain_ends(mesh.down_neighbour[n])
+
+    nodes = np.logical_and(owned, np.logical_or(plateau, pit))
+    assert np.all(end[nodes] >= 0), "down_neighbour[{}] has a cycle on a flat".format(n)
+
+    ends_here = owned[end]
+
+    drained = np.logical_and(np.logical_and(owned, plateau), ends_here)
+    assert np.all(height[end[drained]] < plateau_height), \
+        "down_neighbour[{}] chain of a plateau node ends on the plateau".format(n)
+
+    trapped = np.logical_and(np.logical_and(owned, pit), ends_here)
+    assert np.all(pit[end[trapped]]), "down_neighbour[{}] chain of a pit node leaves the pit".format(n)
+
+nplateau = comm.allreduce(np.count_nonzero(np.logical_and(owned, plateau)), op=MPI.SUM)
+npit = comm.allreduce(np.count_nonzero(np.logical_and(owned, pit)), op=MPI.SUM)
+nflat = comm.allreduce(np.count_nonzero(np.logical_and(owned, mesh.flat_spots)), op=MPI.SUM)
+
+if comm.rank == 0:
+    print("{} flat nodes - {} plateau nodes drain, {} pit nodes are low points".format(nflat, nplateau, npit))
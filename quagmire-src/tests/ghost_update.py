@@ -0,0 +1,178 @@
+"""
+Time the single-exchange ghost update (update_ghosts, one broadcast from the owners
+to the shadow nodes) against the previous synchronisation with a localToGlobal
+followed by a globalToLocal, for a single sync, the rbf_smoother and the
+low point fill routines. Both must give the same result.
+A block of fields (n,k) is compared with exchanging each field separately
+(on a TriMesh and on a PixMesh).
+Writes to the height through indexing and in-place operators must update
+the shadow values when it is next read, writes by the mesh (update_height)
+exchange the height and slope at once.
+
+Run script with
+ mpirun -np <procs> python ghost_update.py
+"""
+repeats = 100
+
+import numpy as np
+from time import clock
+from quagmire import SurfaceProcessMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+spacing = 0.05
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, spacing, spacing, 40000, 800)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+
+mesh = SurfaceProcessMesh(dm, verbose=False)
+
+radius = np.hypot(mesh.coords[:,0], mesh.coords[:,1])
+theta = np.arctan2(mesh.coords[:,1], mesh.coords[:,0])
+height = np.exp(-0.025*radius**4) + 0.25*(0.2*radius)**4 * np.cos(10.0*theta)**2 + 0.5*(1.0 - 0.2*radius)
+height += np.random.random(height.size) * 0.01
+
+mesh.update_height(height)
+
+
+def round_trip(vector):
+    """ previous sync: every owned value is moved twice """
+    mesh.lvec.setArray(vector)
+    mesh.dm.localToGlobal(mesh.lvec, mesh.gvec)
+    mesh.dm.globalToLocal(mesh.gvec, mesh.lvec)
+    vector[:] = mesh.lvec.array
+    return vector
+
+
+class RoundTrip(object):
+    """ use the previous sync in the mesh methods """
+    def __enter__(self):
+        mesh.update_ghosts = round_trip
+        mesh.sync_begin = lambda vector: None
+        mesh.sync_end = round_trip
+    def __exit__(self, *args):
+        del mesh.update_ghosts, mesh.sync_begin, mesh.sync_end
+
+
+def time_it(function, *args, **kwargs):
+    comm.barrier()
+    t = clock()
+    result = function(*args, **kwargs)
+    comm.barrier()
+    return clock() - t, result
+
+
+def repeat_sync(update, vector):
+    for i in range(0, repeats):
+        update(vector)
+    return vector
+
+
+field = mesh.height.copy()
+field[mesh.lgmap_row.indices < 0] = -1.0
+
+results = dict()
+for name, context in [("localToGlobal + globalToLocal", RoundTrip), ("update_ghosts", None)]:
+    if context is not None:
+        context().__enter__()
+
+    timings = []
+    t, sync_result = time_it(repeat_sync, mesh.update_ghosts, field.copy())
+    timings.append(("{} syncs".format(repeats), t))
+
+    t, rbf_result = time_it(mesh.rbf_smoother, mesh.height, iterations=repeats)
+    timings.append(("rbf_smoother ({} iterations)".format(repeats), t))
+
+    t, result = time_it(mesh.low_points_local_patch_fill, its=2)
+    patch_height = mesh.height.copy()
+    mesh.update_height(height)
+    timings.append(("low_points_local_patch_fill", t))
+
+    t, result = time_it(mesh.low_points_swamp_fill)
+    swamp_height = mesh.height.copy()
+    mesh.update_height(height)
+    timings.append(("low_points_swamp_fill", t))
+
+    if context is not None:
+        context().__exit__()
+
+    results[name] = timings, [sync_result, rbf_result, patch_height, swamp_height]
+
+    if comm.rank == 0:
+        print(name)
+        for stage, t in timings:
+            print("  {:36s} {:.4f}s".format(stage, t))
+
+
+for a, b in zip(results["update_ghosts"][1], results["localToGlobal + globalToLocal"][1]):
+    assert np.allclose(a, b), "update_ghosts does not match the previous sync"
+
+if comm.rank == 0:
+    print("speedup")
+    for (stage, t_new), (stage, t_old) in zip(results["update_ghosts"][0], results["localToGlobal + globalToLocal"][0]):
+        print("  {:36s} {:.2f}x".format(stage, t_old / t_new))
+
+
+## several fields in one exchange (block of fields, shape (n,k))
+
+fields = np.column_stack([mesh.height, mesh.slope, mesh.area, mesh.coords[:,0], mesh.coords[:,1]])
+fields[mesh.lgmap_row.indices < 0] = -1.0
+
+t_separate, separate = time_it(lambda: [repeat_sync(mesh.update_ghosts, fields[:,i].copy()) for i in range(0, fields.shape[1])])
+t_block, block = time_it(repeat_sync, mesh.update_ghosts, fields.copy())
+
+for i in range(0, fields.shape[1]):
+    assert np.array_equal(block[:,i], separate[i]), "block exchange does not match separate fields"
+
+smooth_block = mesh.rbf_smoother(fields[:,:2], iterations=10)
+assert np.allclose(smooth_block[:,0], mesh.rbf_smoother(fields[:,0], iterations=10))
+
+if comm.rank == 0:
+    print("{} fields".format(fields.shape[1]))
+    print("  {:36s} {:.4f}s".format("separate exchanges", t_separate))
+    print("  {:36s} {:.4f}s ({:.2f}x)".format("one block exchange", t_block, t_separate / t_block))
+
+
+## writes to the height (a MeshVariable) through indexing and in-place operators
+
+owned = mesh.lgmap_row.indices >= 0
+expected = mesh.sync(mesh.height + 1.0)
+
+mesh.height[owned] += 1.0
+assert np.array_equal(mesh.height, expected), "shadow values are not updated after an indexed write"
+
+mesh.height -= 1.0
+assert np.allclose(mesh.height, expected - 1.0), "in-place operator did not update the height"
+
+kept = mesh.height
+mesh.update_height(kept + 1.0)
+assert np.allclose(mesh.height, expected), "height was not updated"
+assert np.allclose(kept, expected - 1.0), "writing the height changed a previous reference to it"
+
+# writes by the mesh exchange the shadow values at once, so later reads are not collective
+assert not mesh._height.dirty, "update_height left the height dirty"
+assert np.array_equal(mesh.slope, mesh.sync(mesh.slope)), "slope at the shadow nodes is not the value of their owners"
+
+
+## block of fields on a PixMesh (one exchange through the DMDA with k DoF per node)
+
+pixmesh = SurfaceProcessMesh(meshtools.create_DMDA(minX, maxX, minY, maxY, 200, 200), verbose=False)
+
+fields = np.column_stack([pixmesh.coords[:,0], pixmesh.coords[:,1], pixmesh.coords[:,0]*pixmesh.coords[:,1]])
+fields[pixmesh.lgmap_row.indices < 0] = -1.0
+
+separate = [pixmesh.update_ghosts(fields[:,i].copy()) for i in range(0, fields.shape[1])]
+
+block = pixmesh.update_ghosts(fields.copy())
+block_dm = pixmesh._block_scatters[fields.shape[1]][0]
+
+for block in [block, pixmesh.update_ghosts(np.asfortranarray(fields))]:
+    for i in range(0, fields.shape[1]):
+        assert np.array_equal(block[:,i], separate[i]), "PixMesh block exchange does not match separate fields"
+        assert np.array_equal(block[:,i], pixmesh.coords[:,i] if i < 2 else pixmesh.coords[:,0]*pixmesh.coords[:,1]), \
+            "PixMesh shadow values are not the values of their owners"
+
+assert pixmesh._block_scatters[fields.shape[1]][0] is block_dm, "the DMDA with {} DoF is not reused".format(fields.shape[1])
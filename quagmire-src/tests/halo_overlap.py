@@ -0,0 +1,77 @@
+"""
+Validate the shadow zone (halo) of neighbour cloud operators near the edges
+of the partition. The rbf_smoother and local_area_smoothing on the distributed
+mesh are compared with the same operators on the whole mesh (root processor)
+for DMs distributed with increasing overlap.
+
+With a deep enough overlap the shadow nodes are synchronised every
+mesh.sync_interval iterations instead of after every iteration
+and the smoothed fields must match.
+
+Run script with
+ mpirun -np <procs> python halo_overlap.py
+"""
+overlaps = [1, 4, 6]
+iterations = 8
+
+import numpy as np
+from scipy.spatial import cKDTree
+from quagmire import FlatMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -1., 1.
+minY, maxY = -1., 1.
+dx, dy = 0.02, 0.02
+
+x, y, bmask = meshtools.generate_square_points(minX, maxX, minY, maxY, dx, dy, 10000, 400)
+
+
+def global_smoothing(points, field, delta, size, its, centre_weight=None):
+    """ neighbour cloud smoothing of the whole mesh """
+    distance, cloud = cKDTree(points).query(points, k=size)
+    weights = np.exp(-np.power(distance/delta, 2.0))
+    weights /= weights.sum(axis=1).reshape(-1,1)
+
+    for i in range(0, its):
+        smoothed = (field[cloud] * weights).sum(axis=1)
+        if centre_weight is None:
+            field = smoothed
+        else:
+            field = centre_weight*field + (1.0 - centre_weight)*smoothed
+
+    return field
+
+
+for overlap in overlaps:
+    dm = meshtools.create_DMPlex_from_points(x, y, bmask, overlap=overlap)
+    mesh = FlatMesh(dm, verbose=False)
+
+    # the same kernel on every processor
+    delta = comm.allreduce(mesh.neighbour_cloud_distances[:,1].mean(), op=MPI.SUM) / comm.size
+    mesh._construct_rbf_weights(delta)
+
+    field = np.sin(4.0*mesh.coords[:,0]) * np.cos(3.0*mesh.coords[:,1])
+
+    rbf = mesh.gather_data(mesh.rbf_smoother(field, iterations=iterations))
+    area = mesh.gather_data(mesh.local_area_smoothing(field, its=iterations))
+
+    root_x = mesh.gather_data(mesh.coords[:,0])
+    root_y = mesh.gather_data(mesh.coords[:,1])
+    root_field = mesh.gather_data(field)
+
+    if comm.rank == 0:
+        points = np.column_stack([root_x, root_y])
+        size = mesh.neighbour_cloud.shape[1]
+
+        rbf_error = np.abs(rbf - global_smoothing(points, root_field, delta, size, iterations)).max()
+        area_error = np.abs(area - global_smoothing(points, root_field, delta, size, iterations, 0.75)).max()
+
+        print("overlap {} (halo depth {}) - sync every {} iterations - error rbf_smoother {:.2e}, "
+              "local_area_smoothing {:.2e}".format(overlap, mesh.halo_depth, mesh.sync_interval, rbf_error, area_error))
+
+        # the shadow zone holds the whole neighbour cloud of every owned node
+        if mesh.sync_interval > 0:
+            assert rbf_error < 1e-3, "rbf_smoother is not correct near the edge of the partition"
+            assert area_error < 1e-3, "local_area_smoothing is not correct near the edge of the partition"
@@ -0,0 +1,98 @@
+"""
+Implicit hillslope diffusion (landscape_diffusion_implicit) on a TriMesh
+and a PixMesh.
+
+ - with small timesteps the linear (KSP) solve matches an explicit integration
+   with landscape_diffusion_critical_slope, and boundary nodes do not change
+ - for a timestep far above the explicit stability limit the critical
+   slope (SNES) solve stays finite and within the range of the initial heights
+
+Run script with
+ mpirun -np <procs> python implicit_diffusion.py
+"""
+
+import numpy as np
+from quagmire import SurfaceProcessMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+kappa = 0.1
+critical_slope = 0.5
+end_time = 1.0
+
+
+def norm(v, owned):
+    return np.sqrt(comm.allreduce((v[owned]**2).sum(), op=MPI.SUM))
+
+
+def check_implicit_diffusion(mesh, name):
+    x, y = mesh.coords[:,0], mesh.coords[:,1]
+    owned = mesh.lgmap_row.indices >= 0
+
+    # only the height is needed (not the downhill matrices of update_height)
+    height = np.exp(-0.25*(x**2 + y**2)) + 0.0001
+    mesh.height = height
+
+    hmin = comm.allreduce(height[owned].min(), op=MPI.MIN)
+    hmax = comm.allreduce(height[owned].max(), op=MPI.MAX)
+
+    diffusion_rate, diffusion_timestep = mesh.landscape_diffusion_critical_slope(kappa, None, False, height=height)
+    diffusion_timestep = comm.allreduce(diffusion_timestep, op=MPI.MIN)
+
+
+    # small timesteps - the implicit (KSP) and explicit integrations agree.
+    # The explicit rate (derivative_grad / derivative_div) and the implicit Laplacian are
+    # different discretisations that differ at the scale of the nodes, so the heights are
+    # compared at a time when that difference has diffused away.
+
+    nsteps = int(np.ceil(end_time / (0.5 * diffusion_timestep)))
+    for step in range(0, nsteps):
+        diffusion_rate, timestep = mesh.landscape_diffusion_critical_slope(kappa, None, False, height=mesh.height)
+        mesh.height = mesh.height + end_time / nsteps * diffusion_rate
+    reference = mesh.height - height
+
+    mesh.height = height
+    for step in range(0, 20):
+        delta_h = mesh.landscape_diffusion_implicit(end_time / 20, kappa)
+        assert np.all(delta_h[~mesh.bmask] == 0.0), "{} boundary nodes changed".format(name)
+        mesh.height = mesh.height + delta_h
+
+    error = norm(mesh.height - height - reference, owned) / norm(reference, owned)
+    if comm.rank == 0:
+        print("{} - 20 implicit steps to time {} differ from {} explicit steps by {:.3e}".format(
+              name, end_time, nsteps, error))
+
+    assert error < 0.05, "{} implicit integration differs from the explicit integration by {}".format(name, error)
+
+
+    # timestep far above the explicit limit - critical slope solve stays bounded
+
+    mesh.height = height
+    timestep = 100.0 * diffusion_timestep
+    delta_h = mesh.landscape_diffusion_implicit(timestep, kappa, critical_slope=critical_slope)
+    new_height = height + delta_h
+
+    finite = comm.allreduce(np.isfinite(new_height).all(), op=MPI.LAND)
+    new_hmin = comm.allreduce(new_height[owned].min(), op=MPI.MIN)
+    new_hmax = comm.allreduce(new_height[owned].max(), op=MPI.MAX)
+
+    if comm.rank == 0:
+        print("{} - critical slope step of {} ({} x explicit limit): height range [{:.4f}, {:.4f}] from [{:.4f}, {:.4f}]".format(
+              name, timestep, timestep / diffusion_timestep, new_hmin, new_hmax, hmin, hmax))
+
+    assert finite, "{} critical slope solve is not finite".format(name)
+    assert new_hmin >= hmin - 1.0e-8 and new_hmax <= hmax + 1.0e-8, \
+        "{} critical slope solve is not bounded by the initial heights".format(name)
+    assert new_hmax < hmax, "{} critical slope solve did not diffuse the peak".format(name)
+
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+check_implicit_diffusion(SurfaceProcessMesh(dm, verbose=False), "TriMesh")
+
+dm = meshtools.create_DMDA(minX, maxX, minY, maxY, 100, 100)
+check_implicit_diffusion(SurfaceProcessMesh(dm, verbose=False), "PixMesh")
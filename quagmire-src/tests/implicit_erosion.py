@@ -0,0 +1,127 @@
+"""
+Convergence of the implicit (multiple downhill pathway) stream-power solver
+against the explicit rate for the same operator.
+
+The downhill matrices are frozen after update_height so both integrate the
+same linear system. Backward Euler should converge at first order.
+
+The same is checked for the implicit solver along the single receiver chains
+(stream_power_erosion_implicit, n=1) against the explicit rate with one
+downhill neighbour. Boundary nodes must not change.
+
+Run script with
+ python implicit_erosion.py
+"""
+
+import numpy as np
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+from quagmire import SurfaceProcessMesh
+from quagmire import tools as meshtools
+
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+DM = meshtools.create_DMPlex_from_points(x, y, bmask)
+
+mesh = SurfaceProcessMesh(DM, downhill_neighbours=2, verbose=False)
+x, y, simplices, bmask = mesh.get_local_mesh()
+
+height = np.exp(-0.025*(x**2 + y**2)**2) + 0.0001
+rain = np.ones_like(height)
+
+mesh.update_height(height)
+mesh.update_surface_processes(rain, np.zeros_like(rain))
+
+discharge = mesh.cumulative_flow(rain * mesh.area)
+erodibility = 0.05
+uplift = 0.001
+total_time = 1.0
+h0 = mesh.height.copy()
+
+
+def explicit(nsteps):
+    mesh.height = h0.copy()
+    dt = total_time / nsteps
+    for step in range(0, nsteps):
+        mesh.height = mesh.height + dt * mesh.stream_power_erosion_rate_mfd(erodibility, m=0.5, uplift_rate=uplift,
+                                                                            discharge=discharge)
+    return mesh.height.copy()
+
+
+def implicit(nsteps, solver):
+    mesh.height = h0.copy()
+    dt = total_time / nsteps
+    for step in range(0, nsteps):
+        mesh.height = mesh.height + mesh.stream_power_erosion_deposition_implicit(dt, erodibility, m=0.5,
+                                                                                  uplift_rate=uplift,
+                                                                                  discharge=discharge,
+                                                                                  solver=solver)
+    return mesh.height.copy()
+
+
+reference = explicit(4000)
+
+solvers = ["ksp"]
+if comm.size == 1:
+    solvers.append("sweep")
+
+for solver in solvers:
+    errors = []
+    for nsteps in [4, 8, 16, 32]:
+        local_error = np.array(np.abs(implicit(nsteps, solver) - reference).max())
+        error = np.array(0.0)
+        comm.Allreduce([local_error, MPI.DOUBLE], [error, MPI.DOUBLE], op=MPI.MAX)
+        errors.append(float(error))
+
+    orders = np.log2(np.array(errors[:-1]) / np.array(errors[1:]))
+
+    if comm.rank == 0:
+        print("{} - errors {}".format(solver, errors))
+        print("{} - convergence order {}".format(solver, orders))
+
+    assert np.all(orders > 0.8), "implicit solver ({}) is not first order".format(solver)
+
+
+## single receiver chains (Braun and Willett, 2013)
+
+mesh = SurfaceProcessMesh(DM, downhill_neighbours=1, verbose=False)
+mesh.update_height(height)
+mesh.update_surface_processes(rain, np.zeros_like(rain))
+
+discharge = mesh.cumulative_flow(rain * mesh.area)
+h0 = mesh.height.copy()
+
+
+def implicit_receivers(nsteps):
+    mesh.height = h0.copy()
+    dt = total_time / nsteps
+    for step in range(0, nsteps):
+        mesh.height = mesh.height + mesh.stream_power_erosion_implicit(dt, erodibility, m=0.5, n=1.0,
+                                                                       uplift_rate=uplift,
+                                                                       discharge=discharge)
+    return mesh.height.copy()
+
+
+reference = explicit(4000)
+
+errors = []
+for nsteps in [4, 8, 16, 32]:
+    h = implicit_receivers(nsteps)
+    assert np.array_equal(h[~mesh.bmask], h0[~mesh.bmask]), "boundary nodes changed"
+
+    local_error = np.array(np.abs(h - reference).max())
+    error = np.array(0.0)
+    comm.Allreduce([local_error, MPI.DOUBLE], [error, MPI.DOUBLE], op=MPI.MAX)
+    errors.append(float(error))
+
+orders = np.log2(np.array(errors[:-1]) / np.array(errors[1:]))
+
+if comm.rank == 0:
+    print("receivers - errors {}".format(errors))
+    print("receivers - convergence order {}".format(orders))
+
+assert np.all(orders > 0.8), "implicit receiver solver is not first order"
@@ -0,0 +1,154 @@
+"""
+Volume-limited lake filling (lake_fill_and_spill) on a surface with two
+depressions of different size that share a saddle and spill off the mesh.
+
+ - a small inflow into the larger basin makes a lake that holds exactly that
+   volume and leaves the other basin dry
+ - a larger inflow fills that basin to the saddle and spills the excess
+   into its neighbour
+ - an inflow larger than both basins can hold merges the lakes at a common
+   level equal to the spill height of the mesh and the rest flows out
+
+The levels are checked against a direct bisection of the volume held by the
+nodes of each basin. Water is conserved in every case. The basin graph only
+holds the nodes that each processor owns, the test gathers them on root.
+
+Run script with
+ mpirun -np <procs> python lake_fill_and_spill.py
+"""
+
+import numpy as np
+from quagmire import SurfaceProcessMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 10000, 300)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+
+mesh = SurfaceProcessMesh(dm, verbose=False)
+x, y = mesh.coords[:,0], mesh.coords[:,1]
+
+height = 1.0 - np.exp(-0.5*((x + 2.0)**2 + y**2)) - 0.6*np.exp(-0.5*((x - 2.0)**2 + y**2)) + 0.02*(x**2 + y**2)
+mesh.update_height(height)
+
+basin_graph = mesh.build_basin_graph()
+basins = basin_graph['basins']
+ctmt = basin_graph['catchment']
+owned = mesh.lgmap_row.indices >= 0
+
+assert basins.size == 2, "expected two depressions, found {}".format(basins.size)
+
+
+def volume(z, area, level):
+    return (area * np.maximum(level - z, 0.0)).sum()
+
+
+def level(z, area, water):
+    """ bisection of the volume held by nodes z below a level """
+    lo, hi = z.min(), z.max() + water / area.sum()
+    for i in range(0, 200):
+        mid = 0.5*(lo + hi)
+        if volume(z, area, mid) < water:
+            lo = mid
+        else:
+            hi = mid
+    return 0.5*(lo + hi)
+
+
+# hypsometry of the basins, saddle between them and spill height of the mesh (root)
+
+list_of_nodes = comm.gather(basin_graph['nodes'], root=0)
+
+if comm.rank == 0:
+    node_basin = np.hstack([n[0] for n in list_of_nodes])
+    node_z = np.hstack([n[1] for n in list_of_nodes])
+    node_area = np.hstack([n[2] for n in list_of_nodes])
+    edges = basin_graph['edges']
+
+    between = edges[:,1] < basins.size
+    saddle = edges[between, 2].min()
+    spill = edges[~between, 2].min()
+    assert saddle < spill, "the depressions do not merge before they spill off the mesh"
+
+    hyps = [(node_z[node_basin == b], node_area[node_basin == b]) for b in range(0, 2)]
+    capacity = [volume(z, a, saddle) for z, a in hyps]
+    large = int(np.argmax(capacity))
+    total_capacity = volume(node_z, node_area, spill)
+else:
+    large, capacity, total_capacity = None, None, None
+
+large, capacity, total_capacity = comm.bcast((large, capacity, total_capacity), root=0)
+small = 1 - large
+
+
+def fill(inflow):
+    """ lake levels and outflow; the reference levels are computed on root """
+    lake_height, outflow = mesh.lake_fill_and_spill(inflow, basin_graph)
+
+    stored = (mesh.area * (lake_height - mesh.height))[owned].sum()
+    stored = comm.allreduce(stored, op=MPI.SUM)
+    supplied = comm.allreduce(inflow[owned].sum(), op=MPI.SUM)
+
+    in_basin = np.logical_and(owned, ctmt >= 0)
+    list_of_lakes = comm.gather((np.searchsorted(basins, ctmt[in_basin]), mesh.height[in_basin],
+                                 lake_height[in_basin], inflow[in_basin]), root=0)
+
+    if comm.rank == 0:
+        print("inflow {:.4f}, stored {:.4f}, outflow {:.4f}".format(supplied, stored, outflow))
+        assert np.isclose(stored + outflow, supplied), "water is not conserved"
+
+        basin = np.hstack([l[0] for l in list_of_lakes])
+        z = np.hstack([l[1] for l in list_of_lakes])
+        lake = np.hstack([l[2] for l in list_of_lakes])
+        basin_inflow = np.bincount(basin, weights=np.hstack([l[3] for l in list_of_lakes]), minlength=2)
+        return basin, z, lake, basin_inflow, outflow
+
+
+def check_level(basin, z, lake, b, expected):
+    wet = np.logical_and(basin == b, z < expected)
+    assert np.allclose(lake[wet], expected), "lake level {} not {}".format(lake[wet].max(), expected)
+    dry = np.logical_and(basin == b, z >= expected)
+    assert np.array_equal(lake[dry], z[dry]), "nodes above the lake are flooded"
+
+
+def basin_inflow(fraction):
+    # uniform inflow over the larger basin that adds up to a fraction of its capacity
+    inflow = np.where(ctmt == basins[large], mesh.area, 0.0)
+    inflow[~owned] = 0.0
+    return inflow * fraction * capacity[large] / comm.allreduce(inflow.sum(), op=MPI.SUM)
+
+
+## 1. part of the larger basin is filled
+
+result = fill(basin_inflow(0.5))
+if comm.rank == 0:
+    basin, z, lake, inflow, outflow = result
+    check_level(basin, z, lake, large, level(*hyps[large], water=inflow[large]))
+    check_level(basin, z, lake, small, -np.inf)
+    assert outflow == 0.0
+
+
+## 2. the larger basin spills over the saddle into the smaller basin
+
+result = fill(basin_inflow(1.0 + 0.5 * capacity[small] / capacity[large]))
+if comm.rank == 0:
+    basin, z, lake, inflow, outflow = result
+    spilled = inflow[large] - capacity[large]
+    check_level(basin, z, lake, large, saddle)
+    check_level(basin, z, lake, small, level(*hyps[small], water=spilled))
+    assert outflow == 0.0
+
+
+## 3. one lake over both basins that spills off the mesh
+
+result = fill(basin_inflow(2.0 * total_capacity / capacity[large]))
+if comm.rank == 0:
+    basin, z, lake, inflow, outflow = result
+    check_level(basin, z, lake, large, spill)
+    check_level(basin, z, lake, small, spill)
+    assert np.isclose(outflow, inflow.sum() - total_capacity), "spill volume {} not {}".format(
+        outflow, inflow.sum() - total_capacity)
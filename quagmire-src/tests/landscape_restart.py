@@ -0,0 +1,87 @@
+"""
+Checkpoint a LandscapeEvolution run and restart it from the checkpoint.
+
+ - the restarted run has the time, step, height and fields of the
+   checkpointed run at every node
+ - run(end_time) stops at end_time when the timestep does not divide it
+ - both runs continue to the same height: the restarted mesh has the
+   triangulation of the mesh that was checkpointed
+
+Run script with
+ mpirun -np <procs> python landscape_restart.py
+"""
+
+import numpy as np
+from quagmire import SurfaceProcessMesh, LandscapeEvolution
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+file = "landscape_restart.h5"
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+mesh = SurfaceProcessMesh(dm, verbose=False)
+
+x, y = mesh.coords[:,0], mesh.coords[:,1]
+height = np.exp(-0.025*(x**2 + y**2)**2) + 0.1*np.cos(x)*np.sin(y) + 0.0001
+
+
+def rainfall(x, y):
+    return 1.0 + 0.5*np.tanh(x)
+
+
+parameters = dict(erodibility=1.0e-3, kappa=1.0e-2, max_timestep=0.3, fill=False)
+
+
+def gather(run):
+    """ owned coordinates, height and fields on root, sorted by coordinates """
+    mesh = run.mesh
+    owned = mesh.lgmap_row.indices >= 0
+    keys = sorted(run.fields.keys())
+
+    local = np.column_stack([mesh.coords[owned], mesh.height[owned]] + [run.fields[key][owned] for key in keys])
+    gathered = comm.gather(local, root=0)
+
+    if comm.rank == 0:
+        gathered = np.vstack(gathered)
+        order = np.lexsort((gathered[:,1], gathered[:,0]))
+        return gathered[order]
+
+
+run = LandscapeEvolution(mesh, height, rainfall(x, y), fields={'initial_height': height.copy()}, **parameters)
+run.run(steps=3)
+run.checkpoint(file)
+
+restarted = LandscapeEvolution.restart(file, rainfall, mesh_kwargs={'verbose': False}, **parameters)
+
+assert restarted.time == run.time, "time {} not {}".format(restarted.time, run.time)
+assert restarted.step == run.step, "step {} not {}".format(restarted.step, run.step)
+assert sorted(restarted.fields.keys()) == ['initial_height']
+
+checkpointed = gather(run)
+loaded = gather(restarted)
+if comm.rank == 0:
+    assert loaded.shape == checkpointed.shape, "the number of nodes changed"
+    assert np.array_equal(loaded, checkpointed), "height or fields changed on restart"
+
+
+# continue both runs to an end time that is not a multiple of the timestep
+
+checkpoint_step = run.step
+end_time = run.time + 1.0
+run.run(end_time=end_time)
+restarted.run(end_time=end_time)
+
+for r in [run, restarted]:
+    assert abs(r.time - end_time) <= 1.0e-12 * end_time, "run stopped at {} not {}".format(r.time, end_time)
+
+first = gather(run)
+second = gather(restarted)
+if comm.rank == 0:
+    print("Restarted at step {}, both runs reach time {} at step {}".format(checkpoint_step, end_time, run.step))
+    assert np.allclose(first, second, rtol=1.0e-8, atol=1.0e-10), \
+        "restarted run differs by {}".format(np.abs(first - second).max())
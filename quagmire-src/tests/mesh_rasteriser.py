@@ -0,0 +1,97 @@
+"""
+Resample a linear field from the mesh onto a raster (MeshRasteriser) for
+scattered points and for a structured grid with the raster cells on the
+edges and vertices of the triangles.
+
+ - every cell inside the mesh is assigned to exactly one processor
+   (no NaN holes and no duplicates in the gathered raster)
+ - each processor holds a block of rows, the blocks cover the raster
+ - the raster written to HDF5 matches the gathered blocks
+ - cells outside the mesh are NaN
+ - linear interpolation reproduces the linear field
+
+Run script with
+ mpirun -np <procs> python mesh_rasteriser.py
+"""
+
+import numpy as np
+from scipy.spatial import ConvexHull
+from quagmire import FlatMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+
+def check(mesh, extent, shape):
+    raster = meshtools.MeshRasteriser(mesh, extent, shape)
+
+    field = 2.0*mesh.coords[:,0] + 3.0*mesh.coords[:,1] + 1.0
+    block = raster.rasterise(field)
+    assert block.shape == (raster.rows[1] - raster.rows[0], shape[1]), "block is not the rows of the processor"
+
+    raster.save_to_hdf5("mesh_rasteriser.h5", field=field, dtype='f8')
+
+    owned = mesh.lgmap_row.indices >= 0
+    list_of_coords = comm.gather(mesh.coords[owned], root=0)
+    list_of_blocks = comm.gather(block, root=0)
+    list_of_cells = comm.gather(raster.cells, root=0)
+
+    if comm.rank == 0:
+        nrows, ncols = shape
+        rows, cols = np.mgrid[0:nrows, 0:ncols]
+        x = extent[0] + cols * (extent[1] - extent[0]) / ncols
+        y = extent[2] + (nrows - rows) * (extent[3] - extent[2]) / nrows
+
+        # distance inside the convex hull of the mesh (-ve outside)
+        hull = ConvexHull(np.vstack(list_of_coords))
+        depth = -np.max(np.tensordot(hull.equations[:,:2], np.array((x, y)), axes=1)
+                        + hull.equations[:,2].reshape(-1,1,1), axis=0)
+
+        inside = depth > 1.0e-8
+        outside = depth < -1.0e-8
+
+        image = np.vstack(list_of_blocks)
+        all_cells = np.hstack(list_of_cells)
+
+        print("{} cells inside the mesh, {} with values".format(inside.sum(), np.isfinite(image).sum()))
+
+        assert image.shape == shape, "blocks do not cover the raster"
+        assert all_cells.size == np.unique(all_cells).size, "cells appear more than once"
+        assert all_cells.size == np.isfinite(image).sum()
+        assert np.all(np.isfinite(image[inside])), "NaN holes inside the mesh"
+        assert np.all(np.isnan(image[outside])), "values outside the mesh"
+
+        valid = np.isfinite(image)
+        assert np.allclose(image[valid], 2.0*x[valid] + 3.0*y[valid] + 1.0), "linear field is not reproduced"
+
+        import h5py
+        with h5py.File("mesh_rasteriser.h5", 'r') as h5:
+            saved = h5['field'][:]
+        assert np.array_equal(np.isnan(saved), ~valid) and np.allclose(saved[valid], image[valid]), \
+               "saved raster differs from the blocks"
+
+
+# scattered points
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+mesh = FlatMesh(dm, verbose=False)
+
+check(mesh, (minX, maxX, minY, maxY), (200, 200))
+check(mesh, (minX - 1.0, maxX + 1.0, minY, maxY), (37, 53))
+
+
+# structured grid (raster cells on the edges and vertices of the triangles)
+
+gx, gy = np.meshgrid(np.linspace(minX, maxX, 41), np.linspace(minY, maxY, 31))
+x, y = gx.ravel(), gy.ravel()
+bmask = np.logical_and(np.logical_and(x > minX, x < maxX), np.logical_and(y > minY, y < maxY))
+
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+mesh = FlatMesh(dm, verbose=False)
+
+check(mesh, (minX, maxX, minY, maxY), (60, 80))
+check(mesh, (minX, maxX, minY, maxY), (300, 400))
@@ -0,0 +1,85 @@
+"""
+Compare the cells of the DM from create_DMPlex_from_points_parallel with the
+serial Delaunay triangulation of the same points on the root processor, for
+scattered points and for a structured grid. The cells of the grid are only
+unique once cocircular points are resolved (resolve_cocircular_triangles),
+so neighbouring strips must agree on the triangles they share. The DM is
+loaded in parallel, so the boundary labels are checked as well.
+
+Run script with
+ mpirun -np <procs> python parallel_triangulation.py
+"""
+
+import numpy as np
+from stripy import Triangulation
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+
+def cell_set(x, y, cells):
+    """ cells as sets of vertex coordinates (independent of the numbering) """
+    return set(tuple(sorted(zip(x[cell], y[cell]))) for cell in cells)
+
+
+def parallel_cells(x, y, bmask):
+    # each processor starts with any subset of the points
+    dm = meshtools.create_DMPlex_from_points_parallel(x[comm.rank::comm.size],
+                                                      y[comm.rank::comm.size],
+                                                      bmask[comm.rank::comm.size])
+
+    coords = dm.getCoordinatesLocal().array.reshape(-1,2)
+    cells = meshtools.get_DMPlex_cells(dm)
+
+    # boundary vertices (labelled from their coordinates after the DM is loaded)
+    pStart, pEnd = dm.getDepthStratum(0)
+    boundary = np.zeros(0, dtype=int)
+    if dm.getStratumSize('boundary', 1):
+        boundary = dm.getStratumIS('boundary', 1).indices
+        boundary = boundary[np.logical_and(boundary >= pStart, boundary < pEnd)] - pStart
+
+    # cells in the overlap appear on more than one processor
+    list_of_cells = comm.gather(cell_set(coords[:,0], coords[:,1], cells), root=0)
+    list_of_boundary = comm.gather(set(zip(coords[boundary,0], coords[boundary,1])), root=0)
+    if comm.rank == 0:
+        return set().union(*list_of_cells), set().union(*list_of_boundary)
+
+
+def serial_cells(x, y):
+    tri = Triangulation(x, y, permute=True)
+    return cell_set(x, y, meshtools.resolve_cocircular_triangles(x, y, tri.simplices))
+
+
+# scattered points
+
+if comm.rank == 0:
+    x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+else:
+    x, y, bmask = None, None, None
+
+x, y, bmask = comm.bcast((x, y, bmask), root=0)
+cells, boundary = parallel_cells(x, y, bmask)
+
+if comm.rank == 0:
+    reference = serial_cells(x, y)
+    assert boundary == set(zip(x[~bmask], y[~bmask])), "boundary points are not labelled"
+    print("scattered points - {} cells, {} in the serial triangulation".format(len(cells), len(reference)))
+    assert cells == reference, "parallel triangulation of scattered points does not match"
+
+
+# structured grid (every cell has four cocircular vertices)
+
+gx, gy = np.meshgrid(np.linspace(minX, maxX, 81), np.linspace(minY, maxY, 61))
+x, y = gx.ravel(), gy.ravel()
+bmask = np.logical_and(np.logical_and(x > minX, x < maxX), np.logical_and(y > minY, y < maxY))
+
+cells, boundary = parallel_cells(x, y, bmask)
+
+if comm.rank == 0:
+    reference = serial_cells(x, y)
+    assert boundary == set(zip(x[~bmask], y[~bmask])), "boundary points are not labelled"
+    print("structured grid - {} cells, {} in the serial triangulation".format(len(cells), len(reference)))
+    assert cells == reference, "parallel triangulation of a grid does not match"
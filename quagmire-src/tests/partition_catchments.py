@@ -0,0 +1,84 @@
+"""
+Weighted partition of the cells of a triangulation (partition_cells) on a
+surface with many catchments (mesh_catchments).
+
+ - every point drains to a low point that is not higher than itself
+ - the blocks have equal weight (within the tolerance the cuts can move)
+ - a cell belongs to the catchment of its lowest vertex and only catchments
+   that are too large to move a cut to their edge are split between blocks
+
+Serial test, run script with
+ python partition_catchments.py
+"""
+
+import numpy as np
+from stripy import Triangulation
+from quagmire import tools as meshtools
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+nparts = 8
+tolerance = 0.1
+
+x, y, bmask = meshtools.generate_square_points(minX, maxX, minY, maxY, 0.05, 0.05, 20000, 400)
+tri = Triangulation(x, y, permute=True)
+x, y, simplices = tri.x, tri.y, tri.simplices
+
+height = np.sin(1.5*x) * np.cos(1.5*y) + 0.05*x
+node_weights = np.where(x < 0.0, 1.0, 4.0)
+
+
+## catchments
+
+catchments = meshtools.mesh_catchments(x, y, simplices, height)
+
+assert np.array_equal(catchments[catchments], catchments), "catchments do not end at a low point"
+assert np.all(height[catchments] <= height), "a point drains to a higher point"
+
+ncatchments = np.unique(catchments).size
+print("{} catchments".format(ncatchments))
+assert ncatchments > nparts
+
+
+## partition without catchments: blocks of equal weight
+
+cell_weights = node_weights[simplices].mean(axis=1)
+target = cell_weights.sum() / nparts
+
+order, sizes = meshtools.partition_cells(x, y, simplices, nparts, node_weights=node_weights)
+block_weights = np.add.reduceat(cell_weights[order], np.hstack(([0], np.cumsum(sizes)[:-1])))
+
+print("block weights / target {}".format(block_weights / target))
+assert sizes.sum() == simplices.shape[0] and np.unique(order).size == order.size
+assert np.all(np.abs(block_weights - target) <= 2.0 * cell_weights.max()), "blocks are not balanced"
+
+
+## partition with catchments
+
+order, sizes = meshtools.partition_cells(x, y, simplices, nparts, node_weights=node_weights,
+                                         catchments=catchments, tolerance=tolerance, height=height)
+block_weights = np.add.reduceat(cell_weights[order], np.hstack(([0], np.cumsum(sizes)[:-1])))
+
+print("block weights / target {}".format(block_weights / target))
+assert sizes.sum() == simplices.shape[0] and np.unique(order).size == order.size
+assert np.all(np.abs(block_weights - target) <= 2.0 * (tolerance * target + cell_weights.max())), \
+    "blocks are not balanced"
+
+# catchment of the lowest vertex of each cell
+lowest = simplices[np.arange(simplices.shape[0]), np.argmin(height[simplices], axis=1)]
+cell_catchment = catchments[lowest]
+
+block = np.repeat(np.arange(nparts), sizes)
+cell_block = np.empty_like(block)
+cell_block[order] = block
+
+unique, inverse = np.unique(cell_catchment, return_inverse=True)
+catchment_weight = np.bincount(inverse, weights=cell_weights)
+nblocks = np.array([np.unique(cell_block[inverse == i]).size for i in range(0, unique.size)])
+
+split = nblocks > 1
+print("{} of {} catchments split, smallest split catchment {:.2f} of the target weight".format(
+      split.sum(), unique.size, catchment_weight[split].min() / target if split.any() else 0.0))
+
+assert split.sum() <= nparts - 1, "more catchments are split than there are cuts"
+assert np.all(catchment_weight[split] > tolerance * target), "a small catchment is split"
@@ -0,0 +1,103 @@
+"""
+Repartition a distributed mesh in place (TriMesh.rebalance) with a node
+weight that makes one side of the mesh more expensive.
+
+ - the number of nodes of the whole mesh does not change
+ - the migrated fields and height follow their nodes (checked against
+   the coordinates of every node, including the shadow nodes)
+ - the "boundary" and "coarse" labels are kept
+ - the weighted work of the processors is balanced
+ - rebalancing again keeps the overlap of the DM, so the number of
+   shadow nodes does not grow
+
+Run script with
+ mpirun -np <procs> python rebalance.py
+"""
+
+import numpy as np
+from quagmire import TopoMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+mesh = TopoMesh(dm, verbose=False)
+
+
+def surface(x, y):
+    return np.exp(-0.025*(x**2 + y**2)**2) + 0.0001
+
+
+def work(x, y):
+    return np.where(x > 0.0, 10.0, 1.0)
+
+
+def boundary_nodes(mesh):
+    owned = mesh.lgmap_row.indices >= 0
+    return comm.allreduce(int((~mesh.bmask[owned]).sum()), op=MPI.SUM)
+
+
+def shadow_nodes(mesh):
+    owned = mesh.lgmap_row.indices >= 0
+    return comm.allreduce(int((~owned).sum()), op=MPI.SUM)
+
+
+def weighted_work(mesh):
+    """ ratio of the maximum to the mean of the weighted work of each processor """
+    owned = mesh.lgmap_row.indices >= 0
+    local = work(mesh.coords[owned,0], mesh.coords[owned,1]).sum()
+    loads = np.array(comm.allgather(local))
+    return loads.max() / loads.mean()
+
+
+x, y = mesh.coords[:,0], mesh.coords[:,1]
+mesh.update_height(surface(x, y))
+
+global_size = mesh.gvec.getSize()
+boundary_size = boundary_nodes(mesh)
+before = weighted_work(mesh)
+
+fields = mesh.rebalance({'index': x + 10.0*y}, node_weights=work(x, y), force=True)
+
+x, y = mesh.coords[:,0], mesh.coords[:,1]
+after = weighted_work(mesh)
+
+if comm.rank == 0:
+    print("Imbalance of the weighted work {:.2f} before and {:.2f} after rebalancing".format(before, after))
+
+if comm.size > 1:
+    assert fields is not None, "the mesh was not rebalanced"
+    assert mesh.gvec.getSize() == global_size, "{} nodes after rebalancing, not {}".format(
+        mesh.gvec.getSize(), global_size)
+    assert np.allclose(fields['index'], x + 10.0*y), "fields do not follow their nodes"
+    assert np.allclose(mesh.height, surface(x, y)), "height does not follow its nodes"
+    assert mesh.get_label("coarse").size == mesh.npoints, "coarse label is lost"
+    assert boundary_nodes(mesh) == boundary_size, "boundary label changed"
+    # the measured time per node is part of the weight, so the balance is not exact
+    assert after < max(before, 1.2), "the weighted work is not balanced"
+
+
+# a second rebalance distributes the DM with the same overlap
+
+overlap = mesh.dm_overlap
+shadow_size = shadow_nodes(mesh)
+
+x, y = mesh.coords[:,0], mesh.coords[:,1]
+fields = mesh.rebalance({'index': x + 10.0*y}, node_weights=work(x, y), force=True)
+
+x, y = mesh.coords[:,0], mesh.coords[:,1]
+
+if comm.rank == 0:
+    print("{} shadow nodes after the first and {} after the second rebalance".format(shadow_size,
+          shadow_nodes(mesh)))
+
+if comm.size > 1:
+    assert mesh.dm_overlap == overlap, "overlap {} after rebalancing, not {}".format(mesh.dm_overlap, overlap)
+    assert np.allclose(fields['index'], x + 10.0*y), "fields do not follow their nodes"
+    # the partition is not identical (the measured time is part of the weight), a deeper overlap
+    # would add a whole ring of shadow nodes
+    assert shadow_nodes(mesh) < 1.25 * shadow_size, "the number of shadow nodes grows with each rebalance"
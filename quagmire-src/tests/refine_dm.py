@@ -3,42 +3,116 @@ Distribute a DM from points then refine.
 Modify the number of refinements with
  refine = N
 
+ - the "boundary" and "coarse" labels survive the refinement of the
+   distributed DM: every coarse vertex is still labelled "coarse" and
+   the midpoint of every boundary edge is labelled "boundary"
+ - the section is rebuilt with one DoF on each vertex of the refined mesh
+   and the global vector has V + E entries for each refinement of a mesh
+   with V vertices and E edges
+
+Set plot = True to plot the local mesh on each processor.
+
 Run script with
  mpirun -np <procs> python refine_dm.py
+with <procs> > 1
 """
-refine = 0
+refine = 2
+plot = False
 
 import numpy as np
-import matplotlib.pyplot as plt
 from quagmire import FlatMesh
 from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
 
 minX, maxX = -1., 1.
 minY, maxY = -1., 1.
 dx, dy = 0.01, 0.01
 
-x, y, bmask = meshtools.elliptical_mesh(minX, maxX, minY, maxY, dx, dy, 100, 10)
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, dx, dy, 2000, 200)
 
 inverse_bmask = ~bmask
 x = np.hstack([x, 1.1*x[inverse_bmask]])
 y = np.hstack([y, 1.1*y[inverse_bmask]])
 bmask = np.hstack([bmask, bmask[inverse_bmask]])
 
-dm = meshtools.create_DMPlex_from_points(x,y,bmask, refinement_steps=refine)
+if comm.size == 1:
+    print("Run on more than one processor to refine a distributed DM")
+
+
+def owned_points(dm, start, end):
+    """ the points start to end that are not leaves of the point star forest """
+    if comm.size == 1:
+        # the point star forest of an undistributed DM has no graph
+        return np.arange(start, end)
+    nroots, leaves, remote = dm.getPointSF().getGraph()
+    return np.setdiff1d(np.arange(start, end), leaves)
+
+
+def global_count(dm, depth, label=None):
+    """ number of points of a depth in the whole mesh (with a label) """
+    start, end = dm.getDepthStratum(depth)
+    points = owned_points(dm, start, end)
+    if label is not None:
+        labelled = dm.getStratumIS(label, 1).indices if dm.getStratumSize(label, 1) else []
+        points = np.intersect1d(points, labelled)
+    return comm.allreduce(points.size, op=MPI.SUM)
+
+
+coarse_dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask, refinement_steps=refine)
+
+nvertices = global_count(coarse_dm, 0)
+nedges = global_count(coarse_dm, 1)
+ncells = global_count(coarse_dm, 2)
+nboundary = global_count(coarse_dm, 0, "boundary")
+nboundary_edges = global_count(coarse_dm, 1, "boundary")
 
-mesh = FlatMesh(dm)
+for i in range(0, refine):
+    nvertices, nedges, ncells = nvertices + nedges, 2*nedges + 3*ncells, 4*ncells
+    nboundary, nboundary_edges = nboundary + nboundary_edges, 2*nboundary_edges
+
+for label in ["boundary", "coarse"]:
+    assert dm.hasLabel(label), "the refined DM has no {} label".format(label)
+
+ncoarse = global_count(dm, 0, "coarse")
+nrefined_boundary = global_count(dm, 0, "boundary")
+
+assert ncoarse == global_count(coarse_dm, 0), \
+    "{} vertices are labelled coarse, not {}".format(ncoarse, global_count(coarse_dm, 0))
+assert nrefined_boundary == nboundary, \
+    "{} vertices are labelled boundary, not {}".format(nrefined_boundary, nboundary)
+
+vStart, vEnd = dm.getDepthStratum(0)
+section = dm.getDefaultSection()
+assert section.getStorageSize() == vEnd - vStart, \
+    "the section has {} DoF on {} local vertices".format(section.getStorageSize(), vEnd - vStart)
+assert global_count(dm, 0) == nvertices, \
+    "the refined mesh has {} vertices, not {}".format(global_count(dm, 0), nvertices)
+assert dm.createGlobalVector().getSize() == nvertices, \
+    "the global vector has {} entries on {} vertices".format(dm.createGlobalVector().getSize(), nvertices)
+
+if comm.rank == 0:
+    print("{} refinements on {} processors - {} vertices, {} on the boundary, {} coarse".format(
+          refine, comm.size, nvertices, nrefined_boundary, ncoarse))
+
+mesh = FlatMesh(dm, verbose=False)
 mesh.save_mesh_to_hdf5('coarse_mesh.h5')
 
-local_x = mesh.tri.x
-local_y = mesh.tri.y
-simplices = mesh.tri.simplices
-bmask = mesh.bmask
-coarse = mesh.get_boundary("coarse")
-
-fig = plt.figure(1)
-ax = fig.add_subplot(111)
-ax.triplot(local_x, local_y, simplices, c='b', zorder=1)
-ax.scatter(local_x[~mesh.bmask], local_y[~mesh.bmask], c='r', s=100, zorder=2, label="boundary points")
-# ax.scatter(local_x[~coarse], local_y[~coarse], c='g', s=100, zorder=3, label="coarse points")
-plt.legend()
-plt.show()
\ No newline at end of file
+assert comm.allreduce(np.count_nonzero(~mesh.bmask), op=MPI.SUM) > 0, "no boundary nodes on the refined mesh"
+
+if plot:
+    import matplotlib.pyplot as plt
+
+    local_x = mesh.tri.x
+    local_y = mesh.tri.y
+    simplices = mesh.tri.simplices
+    coarse = mesh.get_boundary("coarse")
+
+    fig = plt.figure(1)
+    ax = fig.add_subplot(111)
+    ax.triplot(local_x, local_y, simplices, c='b', zorder=1)
+    ax.scatter(local_x[~mesh.bmask], local_y[~mesh.bmask], c='r', s=100, zorder=2, label="boundary points")
+    ax.scatter(local_x[~coarse], local_y[~coarse], c='g', s=10, zorder=3, label="coarse points")
+    plt.legend()
+    plt.show()
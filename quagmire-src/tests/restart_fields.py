@@ -0,0 +1,102 @@
+"""
+Checkpoint a DM and fields on one number of processors and restart on
+another (create_DMPlex_and_fields_from_hdf5).
+
+ - every node of the restarted mesh (including the shadow nodes) carries
+   the value the field had at the same coordinates
+ - the fields gathered on the root processor are the same as the ones
+   that were checkpointed
+
+Run script with
+ mpirun -np <N> python restart_fields.py checkpoint
+ mpirun -np <M> python restart_fields.py restart
+with M != N
+"""
+
+import sys
+import numpy as np
+from petsc4py import PETSc
+from quagmire import FlatMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+file = "restart_fields.h5"
+reference_file = "restart_fields.npz"
+
+
+def field_values(x, y):
+    return {'height': np.exp(-0.1*(x**2 + y**2)) + 0.05*x,
+            'rainfall': np.cos(x) * np.sin(0.5*y)}
+
+
+def gather_fields(mesh, fields):
+    """ owned coordinates and field values on root, sorted by coordinates """
+    owned = mesh.lgmap_row.indices >= 0
+    keys = sorted(fields.keys())
+
+    local = np.column_stack([mesh.coords[owned]] + [fields[key][owned] for key in keys])
+    gathered = comm.gather(local, root=0)
+
+    if comm.rank == 0:
+        gathered = np.vstack(gathered)
+        order = np.lexsort((gathered[:,1], gathered[:,0]))
+        return gathered[order]
+
+
+stage = sys.argv[1] if len(sys.argv) > 1 else "checkpoint"
+
+if stage == "checkpoint":
+    x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+    dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+    mesh = FlatMesh(dm, verbose=False)
+
+    fields = field_values(mesh.coords[:,0], mesh.coords[:,1])
+
+    vec = dm.createGlobalVec()
+
+    ViewHDF5 = PETSc.Viewer()
+    ViewHDF5.createHDF5(file, mode='w')
+    ViewHDF5.view(obj=dm)
+
+    for key in fields:
+        mesh.lvec.setArray(fields[key])
+        dm.localToGlobal(mesh.lvec, vec)
+        vec.setName(key)
+        ViewHDF5.view(obj=vec)
+
+    ViewHDF5.destroy()
+    vec.destroy()
+
+    reference = gather_fields(mesh, fields)
+    if comm.rank == 0:
+        np.savez(reference_file, fields=reference, size=comm.size)
+        print("Checkpoint of {} nodes on {} processors".format(reference.shape[0], comm.size))
+
+elif stage == "restart":
+    dm, fields = meshtools.create_DMPlex_and_fields_from_hdf5(file, ['height', 'rainfall'])
+    mesh = FlatMesh(dm, verbose=False)
+
+    expected = field_values(mesh.coords[:,0], mesh.coords[:,1])
+    for key in fields:
+        assert fields[key].shape == (mesh.npoints,), "{} has {} values on {} nodes".format(
+            key, fields[key].shape[0], mesh.npoints)
+        assert np.allclose(fields[key], expected[key]), "{} does not follow its nodes".format(key)
+
+    restarted = gather_fields(mesh, fields)
+    if comm.rank == 0:
+        reference = np.load(reference_file)
+        print("Restart of {} nodes on {} processors (checkpoint on {})".format(
+            restarted.shape[0], comm.size, int(reference['size'])))
+
+        if int(reference['size']) == comm.size:
+            print("Restart on a different number of processors to test the redistribution")
+
+        assert restarted.shape == reference['fields'].shape, "the number of nodes changed"
+        assert np.array_equal(restarted, reference['fields']), "fields changed on restart"
+
+else:
+    raise ValueError("Unknown stage {} - use checkpoint or restart".format(stage))
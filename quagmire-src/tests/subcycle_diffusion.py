@@ -0,0 +1,132 @@
+"""
+Operator-split timestep with subcycled diffusion (landscape_evolution_subcycle)
+against a fine explicit integration of the same erosion and diffusion.
+
+The downhill matrices are frozen after update_height in both, so they
+integrate the same equations. Both are integrated to the same end time in
+2, 4 and 8 operator-split steps: the splitting error is first order, it is
+small and roughly halves with the timestep. (Within a single step the
+stiff diffusion dominates the change in height, so the error relative to
+that change does not fall with the timestep.) Boundary nodes must not change.
+
+With a critical slope, uplift against the fixed boundary steepens the
+surface within a step, so the diffusion on the eroded slope needs more
+substeps than were estimated from the initial slope. The step must then
+be shortened (not fail) and a run to a fixed end time must still reach it.
+
+Run script with
+ mpirun -np <procs> python subcycle_diffusion.py
+"""
+
+import numpy as np
+from quagmire import SurfaceProcessMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+
+mesh = SurfaceProcessMesh(dm, verbose=False)
+x, y, simplices, bmask = mesh.get_local_mesh()
+owned = mesh.lgmap_row.indices >= 0
+
+height = np.exp(-0.025*(x**2 + y**2)**2) + 0.05*np.cos(2.0*x)*np.sin(2.0*y) + 0.0001
+rain = np.ones_like(height)
+
+mesh.update_height(height)
+mesh.update_surface_processes(rain, np.zeros_like(rain))
+
+erodibility = 0.05
+kappa = 0.2
+h0 = mesh.height.copy()
+
+discharge = mesh.cumulative_flow(rain * mesh.area)
+coefficient = mesh._stream_power_coefficient(erodibility, 0.5, discharge)
+stable_timestep = mesh._global_min_timestep(0.25 * mesh.area.min() / kappa)
+
+
+def norm(v):
+    return np.sqrt(comm.allreduce((v[owned]**2).sum(), op=MPI.SUM))
+
+
+def subcycled(max_timestep, nsteps=1):
+    mesh.height = h0.copy()
+    for step in range(0, nsteps):
+        delta_h, timestep, subcycles = mesh.landscape_evolution_subcycle(erodibility, kappa, discharge=discharge,
+                                                                         max_timestep=max_timestep)
+        assert np.all(delta_h[~bmask] == 0.0), "boundary nodes changed"
+        mesh.height = mesh.height + delta_h
+    return mesh.height - h0, timestep, subcycles['diffusion']
+
+
+def explicit(timestep):
+    mesh.height = h0.copy()
+    nsteps = int(np.ceil(timestep / stable_timestep))
+    dt = timestep / nsteps
+    for step in range(0, nsteps):
+        diffusion_rate, diffusion_timestep = mesh.landscape_diffusion_critical_slope(kappa, None, False,
+                                                                                     height=mesh.height)
+        mesh.height = mesh.height + dt * (mesh._stream_power_erosion_rate(coefficient, 0.0) + diffusion_rate)
+    return mesh.height - h0
+
+
+# end time is the stable timestep of the explicit erosion
+
+delta_h, end_time, nsubcycles = subcycled(None)
+reference = explicit(end_time)
+
+errors = []
+for nsteps in [2, 4, 8]:
+    delta_h, timestep, nsubcycles = subcycled(end_time / nsteps, nsteps)
+
+    assert timestep == end_time / nsteps, "timestep {} is not {}".format(timestep, end_time / nsteps)
+    assert nsubcycles > 1, "diffusion was not subcycled"
+
+    errors.append(norm(delta_h - reference) / norm(reference))
+    if comm.rank == 0:
+        print("{} steps of {} - {} diffusion substeps, relative difference {:.3e}".format(
+              nsteps, timestep, nsubcycles, errors[-1]))
+
+assert errors[-1] < 0.01, "subcycled steps differ from the reference by {}".format(errors[-1])
+for i in range(1, len(errors)):
+    assert errors[i] < 0.7 * errors[i-1], "splitting error is not first order: {}".format(errors)
+
+
+# critical slope diffusion with a large max_timestep
+
+critical_slope = 2.0 * comm.allreduce(mesh.slope[owned].max(), op=MPI.MAX)
+uplift_rate = 50.0
+max_subcycles = 10
+
+kappa_eff = mesh._critical_slope_diffusivity(kappa, critical_slope, mesh.slope)
+step_limit = max_subcycles * mesh._global_min_timestep(0.5 * mesh.area.min() / kappa_eff.max())
+end_time = 5.0 * step_limit
+
+mesh.height = h0.copy()
+time = 0.0
+shortened = 0
+while end_time - time > 1.0e-12 * end_time:
+    max_timestep = end_time - time
+    delta_h, timestep, subcycles = mesh.landscape_evolution_subcycle(erodibility, kappa, uplift_rate=uplift_rate,
+                                                                     critical_slope=critical_slope,
+                                                                     discharge=discharge, max_timestep=max_timestep,
+                                                                     implicit_erosion=True,
+                                                                     max_subcycles=max_subcycles)
+    assert 0.0 < timestep <= max_timestep, "timestep {} is not in (0, {}]".format(timestep, max_timestep)
+    assert subcycles['diffusion'] <= max_subcycles, "{} diffusion substeps".format(subcycles['diffusion'])
+    assert np.all(delta_h[~bmask] == 0.0), "boundary nodes changed"
+    assert np.all(np.isfinite(delta_h)), "non-finite change in height"
+
+    if timestep < min(max_timestep, step_limit):
+        shortened += 1
+    mesh.height = mesh.height + delta_h
+    time += timestep
+
+if comm.rank == 0:
+    print("critical slope - {} of the steps to {} were shortened".format(shortened, end_time))
+
+assert shortened > 0, "no step was shortened by the critical slope diffusion"
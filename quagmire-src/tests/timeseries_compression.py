@@ -0,0 +1,74 @@
+"""
+Write a compressed, chunked time series in single precision with the
+TimeSeriesWriter and the AsyncTimeSeriesWriter and read it back with h5py.
+
+ - the datasets have the requested compression, chunks and dtypes
+ - every timestep holds the fields (rounded to float32) at the global
+   index of each node, and the times of the steps
+
+Run script with
+ mpirun -np <procs> python timeseries_compression.py
+"""
+
+import numpy as np
+import h5py
+from quagmire import FlatMesh
+from quagmire import tools as meshtools
+from mpi4py import MPI
+comm = MPI.COMM_WORLD
+
+minX, maxX = -5., 5.
+minY, maxY = -5., 5.
+
+x, y, bmask = meshtools.generate_elliptical_points(minX, maxX, minY, maxY, 0.1, 0.1, 5000, 200)
+dm = meshtools.create_DMPlex_from_points(x, y, bmask)
+mesh = FlatMesh(dm, verbose=False)
+
+x, y = mesh.coords[:,0], mesh.coords[:,1]
+owned = mesh.lgmap_row.indices >= 0
+gids = mesh.lgmap_row.indices[owned]
+
+times = [0.0, 0.25, 1.0]
+
+
+def fields(step):
+    return {'height': np.exp(-0.1*(x**2 + y**2)) + 0.01*step, 'slope': np.hypot(x, y) * (step + 1)}
+
+
+def check(file, chunk_size, field_dtypes):
+    owned_fields = [dict((key, value[owned]) for key, value in fields(step).items()) for step in range(0, len(times))]
+    gathered = comm.gather((gids, owned_fields), root=0)
+
+    if comm.rank == 0:
+        with h5py.File(file, 'r') as h5:
+            assert np.array_equal(h5['time'][:,0], times), "times {} not {}".format(h5['time'][:,0], times)
+
+            for key in ['height', 'slope']:
+                dset = h5['vertex_fields'][key]
+                assert dset.compression == 'gzip', "{} is not compressed".format(key)
+                assert dset.chunks == (1, chunk_size), "{} chunks are {}".format(key, dset.chunks)
+                assert dset.dtype == np.dtype(field_dtypes.get(key, 'f4')), "{} is {}".format(key, dset.dtype)
+
+                for step in range(0, len(times)):
+                    row = dset[step]
+                    for ids, values in gathered:
+                        expected = values[step][key].astype(dset.dtype)
+                        assert np.array_equal(row[ids], expected), "{} at step {} does not match".format(key, step)
+
+        print("{} - {} timesteps read back".format(file, len(times)))
+
+
+chunk_size = 128
+field_dtypes = {'height': 'f8'}
+
+for Writer in [meshtools.TimeSeriesWriter, meshtools.AsyncTimeSeriesWriter]:
+    file = "timeseries_{}.h5".format(Writer.__name__)
+
+    writer = Writer(mesh, file, compression='gzip', compression_opts=4, chunk_size=chunk_size,
+                    dtype='f4', field_dtypes=field_dtypes)
+    for step, time in enumerate(times):
+        writer.write(time, **fields(step))
+    writer.close()
+
+    comm.barrier()
+    check(file, chunk_size, field_dtypes)